@@ -3,11 +3,28 @@ from discord.ext import commands, tasks
 from datetime import datetime
 import random
 import asyncio
+import time
+import re
 
 import utils.config_manager as config
 from utils.console_display import log_info, log_system, log_success, log_error, log_warning
 from utils import db_manager as data_manager
-from utils import ai_request_handler, prompt_builder
+from utils import ai_request_handler, prompt_builder, channel_scheduler
+from utils.unread_log import UnreadLog
+
+def split_message_text(text: str) -> list:
+    """Discordの文字数制限(2000字)に収まるよう、テキストを改行位置で分割する"""
+    chunks = []
+    remaining_text = text
+    while len(remaining_text) > 2000:
+        split_point = remaining_text.rfind('\n', 0, 2000)
+        if split_point == -1:
+            split_point = 2000
+        chunks.append(remaining_text[:split_point])
+        remaining_text = remaining_text[split_point:].lstrip()
+    if remaining_text:
+        chunks.append(remaining_text)
+    return chunks
 
 async def send_splittable_message(channel: discord.TextChannel, text: str, file: discord.File = None):
     """
@@ -19,21 +36,86 @@ async def send_splittable_message(channel: discord.TextChannel, text: str, file:
         await channel.send(text, file=file)
         return
     log_info("MESSAGE", f"長文メッセージ({len(text)}文字)を分割して送信します。")
-    remaining_text = text
-    while len(remaining_text) > 2000:
-        split_point = remaining_text.rfind('\n', 0, 2000)
-        if split_point == -1:
-            split_point = 2000
-        await channel.send(remaining_text[:split_point])
-        remaining_text = remaining_text[split_point:].lstrip()
+    chunks = split_message_text(text)
+    for chunk in chunks[:-1]:
+        await channel.send(chunk)
         await asyncio.sleep(0.5)
-    if remaining_text:
-        await channel.send(remaining_text, file=file)
+    await channel.send(chunks[-1], file=file)
+
+# 受信途中の本文を表示するときの、文の区切り
+_SENTENCE_END_PATTERN = re.compile(r'[。！？!?…\n]')
+
+class ProgressiveMessage:
+    """
+    ストリーミングで受信中の応答を、Discordに少しずつ表示する。
+    最初の文の区切りまで届いたら投稿し、以降は interval 秒ごとに編集して続きを表示する。
+    2000字を超えた分は send_splittable_message と同じ位置で分割し、新しいメッセージとして続ける。
+    """
+    def __init__(self, channel: discord.TextChannel, interval: float, first_chunk_max_chars: int):
+        self.channel = channel
+        self.interval = interval
+        self.first_chunk_max_chars = first_chunk_max_chars
+        self.messages = []   # 投稿済みのメッセージ
+        self._shown = []     # 各メッセージに表示中の本文
+        self._last_render = 0.0
+        self.started = time.monotonic()
+        self.first_visible_at = None
+
+    @property
+    def time_to_first_text(self) -> float | None:
+        """リクエスト開始から最初の本文が表示されるまでの秒数"""
+        return self.first_visible_at - self.started if self.first_visible_at is not None else None
+
+    async def update(self, text: str):
+        """受信済みの本文全体を受け取り、前回の表示から interval 秒経っていれば表示を更新する"""
+        if self.messages and time.monotonic() - self._last_render < self.interval:
+            return
+        # 書きかけの文は表示しない (区切りがないまま first_chunk_max_chars 文字を超えた場合は、そこまでを表示する)
+        boundary = 0
+        for match in _SENTENCE_END_PATTERN.finditer(text):
+            boundary = match.end()
+        if len(text) - boundary < self.first_chunk_max_chars:
+            text = text[:boundary]
+        text = text.rstrip()
+        if text:
+            await self._render(text)
+
+    async def finish(self, text: str):
+        """受信し終えた本文を、間隔を待たずに表示する"""
+        await self._render(text)
+
+    async def abort(self):
+        """リクエストが失敗した場合に、表示途中のメッセージを削除する"""
+        await self._render("")
+
+    async def _render(self, text: str):
+        chunks = split_message_text(text)
+        for i, chunk in enumerate(chunks):
+            if i < len(self.messages):
+                if self._shown[i] != chunk:
+                    await self.messages[i].edit(content=chunk)
+                    self._shown[i] = chunk
+                continue
+            self.messages.append(await self.channel.send(chunk))
+            self._shown.append(chunk)
+            if self.first_visible_at is None:
+                self.first_visible_at = time.monotonic()
+        # 再試行で本文が短くなった場合などは、余ったメッセージを削除する
+        for message in self.messages[len(chunks):]:
+            await message.delete()
+        del self.messages[len(chunks):]
+        del self._shown[len(chunks):]
+        self._last_render = time.monotonic()
 
 class ChatManagerCog(commands.Cog, name="ChatManagerCog"):
     def __init__(self, bot):
         self.bot = bot
-        self.processing_channels = set() # 処理中チャンネルを管理するセット
+        # チャンネルごとの処理ロックと、処理中に来た再実行の要求 (何回来ても終了後に1回だけ再実行する)
+        self._channel_locks = {}         # チャンネルID -> asyncio.Lock
+        self._rerun_requested = set()    # チャンネルID
+
+        # 応答の計測値 (最初の本文が表示されるまでの秒数)
+        self.response_stats = {"replies": 0, "streamed": 0, "avg_first_text_s": 0.0, "last_first_text_s": None}
 
         self.unread_data = data_manager.get_data('unread')
         schedule_data = data_manager.get_data('schedule')
@@ -47,22 +129,41 @@ class ChatManagerCog(commands.Cog, name="ChatManagerCog"):
         self.current_action = "待機中"
         self.current_activity_level = 'normal'
 
+        # 緊急のメッセージ (メンション・リプライなど) で活動サイクルを早めに起こすためのイベント
+        self._wake_event = asyncio.Event()
+        self._urgent_deadlines = {}  # チャンネルID -> 処理を始める期限 (time.monotonic())
+        self._next_cycle_at = None   # 次の定期サイクルの時刻 (time.monotonic())
+        # 実行中のチャンネル処理のタスク (ループはこれを待たずに、次の緊急のメッセージを待つ)
+        self._channel_tasks = set()
+
+        # 連投 (バースト) の検出用: チャンネルごとの最後のメッセージ時刻と、入力中のユーザーの入力中表示の期限
+        self._last_message_at = {}   # チャンネルID -> time.monotonic()
+        self._typing_until = {}      # チャンネルID -> {ユーザーID: time.monotonic()}
+
         log_system("チャット管理モジュールを初期化し、活動サイクルを開始します。")
         self.activity_loop.start()
 
+    def cog_unload(self):
+        self.activity_loop.cancel()
+        for task in self._channel_tasks:
+            task.cancel()
+
     def reset_unread_messages(self):
         """メモリ上の全ての未読メッセージをクリアし、DBに保存します。"""
-        self.unread_data.clear()
+        data_manager.reset_unread()
+        self.unread_data = data_manager.get_data('unread')
         log_success("UNREAD", "メモリ上の全未読メッセージがリセットされました。")
-        data_manager.save_data('unread', self.unread_data)
 
     def pop_unread_message(self, channel_id: int) -> dict | None:
         """指定されたチャンネルの最も古い未読メッセージを1件削除し、DBに保存します。"""
         str_channel_id = str(channel_id)
-        if self.unread_data.get(str_channel_id):
-            popped_message = self.unread_data[str_channel_id].pop(0)
+        unread_log = self.unread_data.get(str_channel_id)
+        if unread_log:
+            popped_message = unread_log.entries[0]
+            # 最も古いメッセージまでを処理済みとしてコミットする
+            unread_log.commit(popped_message['offset'])
             log_info("UNREAD", f"CH[{channel_id}] の未読メッセージを1件popしました。")
-            data_manager.save_data('unread', self.unread_data)
+            data_manager.commit_unread(str_channel_id, popped_message['offset'])
             return popped_message
         return None
 
@@ -81,23 +182,129 @@ class ChatManagerCog(commands.Cog, name="ChatManagerCog"):
             return
 
         if channel_id_str not in self.unread_data:
-            self.unread_data[channel_id_str] = []
+            self.unread_data[channel_id_str] = UnreadLog()
 
         # 送信者のアクティビティを取得
         activity_str = self._get_user_activity_str(message.author)
 
-        self.unread_data[channel_id_str].append({
+        # 連投の検出用に、最後のメッセージ時刻を記録する (送信したユーザーの入力中表示は終わったとみなす)
+        self._last_message_at[channel_id_str] = time.monotonic()
+        self._typing_until.get(channel_id_str, {}).pop(message.author.id, None)
+
+        # 未読ログに1件追記し、DBにもその1件だけを書き込む
+        entry = self.unread_data[channel_id_str].append({
             'author': message.author.display_name, 
             'content': message.content,
             'timestamp': prompt_builder.get_current_time_str(),
+            'received_at': time.time(),
             'activity': activity_str
         })
         log_info("UNREAD", f"[{message.channel.name}] に未読メッセージを1件追加。(Activity: {activity_str})")
-        data_manager.save_data('unread', self.unread_data)
+        data_manager.append_unread(channel_id_str, entry)
+
+        urgency = self._classify_urgency(message)
+        if urgency:
+            self._wake_for_urgent(channel_id_str, urgency)
+
+    @commands.Cog.listener()
+    async def on_typing(self, channel, user, when):
+        """入力中のユーザーを記録する (入力中表示が続いている間は、応答を連投の終わりまで待たせる)"""
+        if user == self.bot.user:
+            return
+        channel_id_str = str(channel.id)
+        if not self.channel_settings.get(channel_id_str, {}).get('chat_mode', False):
+            return
+        self._typing_until.setdefault(channel_id_str, {})[user.id] = time.monotonic() + config.BURST_TYPING_TIMEOUT_SECONDS
+
+    async def _wait_for_burst_end(self, channel_id_str: str):
+        """
+        チャンネルの連投が終わるまで待つ。
+        最後のメッセージから BURST_QUIET_SECONDS 静かになり、入力中のユーザーがいなくなったら終わりとみなす。
+        ただし待ち始めてから BURST_MAX_WAIT_SECONDS 経ったら、連投が続いていても待つのをやめる。
+        """
+        started = time.monotonic()
+        deadline = started + config.BURST_MAX_WAIT_SECONDS
+        while True:
+            now = time.monotonic()
+            typing = self._typing_until.get(channel_id_str, {})
+            for user_id in [u for u, until in typing.items() if until <= now]:
+                del typing[user_id]
+            ready_at = max([self._last_message_at.get(channel_id_str, 0.0) + config.BURST_QUIET_SECONDS, *typing.values()])
+            wake_at = min(ready_at, deadline)
+            if now >= wake_at:
+                break
+            await asyncio.sleep(wake_at - now)
+
+        waited = time.monotonic() - started
+        if waited >= 0.1:
+            log_info("BURST", f"CH[{channel_id_str}] の連投が終わるまで {waited:.1f}秒待機しました。")
+
+    def _classify_urgency(self, message) -> str | None:
+        """すぐに応答すべきメッセージなら理由 (mention / reply / dm / keyword) を、そうでなければ None を返す"""
+        if isinstance(message.channel, discord.DMChannel):
+            return "dm"
+        if self.bot.user in message.mentions:
+            return "mention"
+        reference = message.reference
+        if reference is not None:
+            replied = reference.resolved if isinstance(reference.resolved, discord.Message) else reference.cached_message
+            if replied is not None and replied.author == self.bot.user:
+                return "reply"
+        content = message.content.lower()
+        if any(keyword.lower() in content for keyword in config.URGENT_KEYWORDS):
+            return "keyword"
+        return None
+
+    def _wake_for_urgent(self, channel_id_str: str, urgency: str):
+        """
+        チャンネルの処理を始める期限を、現在の活動レベルの目標応答時間 (activity_params の urgent_latency) で設定し、
+        待機中の活動サイクルを起こす (期限は定期サイクルより早い場合だけ意味を持つ)。
+        """
+        params = self.activity_params.get(self.current_activity_level, {})
+        latency = params.get('urgent_latency', config.URGENT_DEFAULT_LATENCY_SECONDS)
+        deadline = time.monotonic() + latency
+        self._urgent_deadlines[channel_id_str] = min(deadline, self._urgent_deadlines.get(channel_id_str, deadline))
+        log_info("URGENT", f"CH[{channel_id_str}] に緊急のメッセージ ({urgency}) を受信しました。{latency}秒以内に応答します。")
+        self._wake_event.set()
+
+    async def _wait_until_due(self) -> bool:
+        """
+        次の定期サイクルか、緊急のチャンネルの期限まで待つ。
+        定期サイクルの時刻になった場合は True、緊急のチャンネルの期限が来た場合は False を返す。
+        """
+        while True:
+            now = time.monotonic()
+            if any(deadline <= now for deadline in self._urgent_deadlines.values()):
+                return False
+            if now >= self._next_cycle_at:
+                return True
+            wake_at = min([self._next_cycle_at, *self._urgent_deadlines.values()])
+            self._wake_event.clear()
+            try:
+                await asyncio.wait_for(self._wake_event.wait(), timeout=wake_at - now)
+            except asyncio.TimeoutError:
+                pass
+
+    def _start_channel_task(self, channel_id: int, semaphore: asyncio.Semaphore = None):
+        """チャンネルの処理をタスクとして始める (semaphore を渡した場合は、その同時処理数の範囲で処理する)"""
+        async def run():
+            if semaphore is None:
+                await self.process_channel_activity(channel_id)
+                return
+            async with semaphore:
+                await self.process_channel_activity(channel_id)
+
+        task = asyncio.create_task(run())
+        self._channel_tasks.add(task)
+        task.add_done_callback(self._channel_tasks.discard)
+        return task
 
     @tasks.loop(seconds=1.0)
     async def activity_loop(self):
-        """一定時間待機し、ランダムなチャンネルのメッセージ処理または自発的発言を行うループ"""
+        """
+        一定時間待機し、未読のあるチャンネルを優先度順に並行して処理する (未読がなければ自発的発言を行う) ループ。
+        チャンネルの処理はタスクとして始めるだけで終了を待たないので、処理中でも緊急のチャンネルは期限どおりに始まる。
+        """
         now = datetime.now()
         current_hour = str(now.hour)
         weekday = now.weekday()
@@ -106,95 +313,187 @@ class ChatManagerCog(commands.Cog, name="ChatManagerCog"):
         self.current_activity_level = current_schedule['level']
         self.current_action = current_schedule['action']
         params = self.activity_params.get(self.current_activity_level, {'seconds': 3600, 'sigma': 900})
-        wait_duration = max(60.0, random.normalvariate(params['seconds'], params['sigma']))
-
-        log_info("ACTIVITY", f"現在の行動: {self.current_action} | 次の活動まで {wait_duration/60:.2f} 分待機します。")
-        await asyncio.sleep(wait_duration)
-
-        # 処理対象チャンネルの選択
-        default_channel_id = config.get_default_channel_id()
-        channels_with_unread = [int(ch_id) for ch_id, msgs in self.unread_data.items() if msgs]
-        candidate_channel_ids = channels_with_unread or ([default_channel_id] if default_channel_id else [])
+        if self._next_cycle_at is None:
+            wait_duration = max(60.0, random.normalvariate(params['seconds'], params['sigma']))
+            self._next_cycle_at = time.monotonic() + wait_duration
+            log_info("ACTIVITY", f"現在の行動: {self.current_action} | 次の活動まで {wait_duration/60:.2f} 分待機します。")
+
+        # 定期サイクルまで待つ (緊急のメッセージが来た場合は、その期限に起きる)
+        is_cycle = await self._wait_until_due()
+
+        # 未読のあるチャンネルを優先度順に並べる
+        ranked = channel_scheduler.rank_channels(self.unread_data, self.channel_settings)
+        if not is_cycle:
+            # 期限が来た緊急のチャンネルだけを同時処理数の制限なしで処理し、定期サイクルの時刻はそのままにする
+            now = time.monotonic()
+            due = {ch_id for ch_id, deadline in self._urgent_deadlines.items() if deadline <= now}
+            for ch_id in due:
+                self._urgent_deadlines.pop(ch_id, None)
+            ranked = [(ch_id, score) for ch_id, score in ranked if ch_id in due]
+            if ranked:
+                log_info("URGENT", f"緊急のメッセージがあるため、{len(ranked)}チャンネルを先に処理します。")
+            for ch_id, _ in ranked:
+                self._start_channel_task(int(ch_id))
+            return
+        self._next_cycle_at = None
 
-        if not candidate_channel_ids:
-            log_info("ACTIVITY", "処理対象のチャンネルが見つかりませんでした。")
+        if not ranked:
+            default_channel_id = config.get_default_channel_id()
+            if not default_channel_id:
+                log_info("ACTIVITY", "処理対象のチャンネルが見つかりませんでした。")
+                return
+            self._start_channel_task(default_channel_id)
             return
 
-        target_channel_id = random.choice(candidate_channel_ids)
-        await self.process_channel_activity(target_channel_id)
+        # 同時処理数はスケジュールのレベルごとに決める (セマフォの待ち行列は先着順なので、優先度の高い順に処理が始まる)
+        concurrency = max(1, params.get('concurrency', config.SCHEDULER_MAX_CONCURRENCY))
+        semaphore = asyncio.Semaphore(concurrency)
+        log_info("ACTIVITY", f"{len(ranked)}チャンネルを最大{concurrency}並列で処理します: " + ", ".join(f"CH[{ch_id}]({score:.1f})" for ch_id, score in ranked))
+        for ch_id, _ in ranked:
+            self._start_channel_task(int(ch_id), semaphore)
 
     async def process_channel_activity(self, channel_id: int):
-        """チャンネルの活動（未読処理 or 自発発言）を行う共通関数"""
+        """
+        チャンネルの活動（未読処理 or 自発発言）を行う共通関数。
+        同じチャンネルの処理は同時に1つだけ行う。処理中に呼ばれた場合は再実行を予約して戻り、
+        現在の処理が終わった直後に、その間に届いた未読メッセージをまとめてもう1回だけ処理する。
+        """
         str_channel_id = str(channel_id)
-        
-        if str_channel_id in self.processing_channels:
-            log_warning("PROCESS_SKIP", f"CH[{channel_id}] は既に処理中のためスキップします。")
+        lock = self._channel_locks.setdefault(str_channel_id, asyncio.Lock())
+        if lock.locked():
+            self._rerun_requested.add(str_channel_id)
+            log_info("PROCESS_QUEUE", f"CH[{channel_id}] は処理中のため、終了後にもう一度処理します。")
             return
 
+        async with lock:
+            while True:
+                self._rerun_requested.discard(str_channel_id)
+                await self._process_channel_once(channel_id)
+                if str_channel_id not in self._rerun_requested:
+                    break
+                # 再実行は未読メッセージが残っている場合だけ行う (自発発言を重ねない)
+                if not self.unread_data.get(str_channel_id):
+                    self._rerun_requested.discard(str_channel_id)
+                    break
+                log_info("PROCESS_QUEUE", f"CH[{channel_id}] の処理中に届いたメッセージを続けて処理します。")
+
+    async def _process_channel_once(self, channel_id: int):
+        """チャンネルの活動を1回行う (process_channel_activity のロック内から呼ばれる)"""
+        str_channel_id = str(channel_id)
+
         target_channel = self.bot.get_channel(channel_id)
         if not target_channel:
             log_error("PROCESS", f"CH[{channel_id}] が見つかりません。")
             return
 
-        self.processing_channels.add(str_channel_id)
+        # これから未読を処理するので、緊急の期限は不要になる
+        self._urgent_deadlines.pop(str_channel_id, None)
         log_info("PROCESS_START", f"CH[{channel_id}] の処理を開始します。")
 
         try:
-            messages_to_process = self.unread_data.get(str_channel_id, [])
+            # 連投の途中で応答しないよう、チャンネルが静かになるまで待ってからまとめて処理する
+            if self.unread_data.get(str_channel_id):
+                await self._wait_for_burst_end(str_channel_id)
+
+            # 処理開始時点の未読メッセージだけを処理する (処理中に届いたメッセージは次回に残る)
+            unread_log = self.unread_data.get(str_channel_id)
+            messages_to_process = unread_log.snapshot() if unread_log else []
 
             # プロンプト組み立て
-            bot_status = prompt_builder.get_bot_status_text(self.bot)
-            prompt_instruction = prompt_builder.build_response_prompt(messages_to_process, bot_status)
+            bot_status = prompt_builder.get_bot_status_text(self.bot, messages_to_process)
+            recall_text = prompt_builder.build_archive_recall_text(channel_id, messages_to_process)
+            prompt_instruction = prompt_builder.build_response_prompt(messages_to_process, bot_status, recall_text)
 
-            # AIに応答を要求
+            # 応答と感情の変化量を1回のリクエストでまとめて受け取る (失敗時は別途感情分析を行う)
+            emotion_cog = self.bot.get_cog('EmotionCog')
+            response_schema = None
+            if config.EMOTION_COMBINED_ENABLED and emotion_cog and emotion_cog.emotion_map:
+                prompt_instruction += prompt_builder.build_reply_with_emotions_instruction(emotion_cog.emotion_map)
+                response_schema = prompt_builder.build_reply_with_emotions_schema(emotion_cog.emotion_map)
+
+            # AIに応答を要求 (ストリーミングの場合は、受信しながら少しずつ表示する)
+            started = time.monotonic()
+            stream = None
+            if config.STREAM_ENABLED:
+                stream = ProgressiveMessage(target_channel, config.STREAM_EDIT_INTERVAL_SECONDS, config.STREAM_FIRST_CHUNK_MAX_CHARS)
             async with target_channel.typing():
-                response_text = await ai_request_handler.send_request(
+                result = await ai_request_handler.send_request(
                     config.MODEL_PRO,
                     prompt_instruction,
-                    channel_id=channel_id
+                    channel_id=channel_id,
+                    response_schema=response_schema,
+                    unread_messages=messages_to_process,
+                    on_text=stream.update if stream is not None else None
                 )
 
-            if response_text is None:
+            if result is None:
+                if stream is not None:
+                    await stream.abort()
                 return
+            if response_schema is not None:
+                response_text = result.get("message", "")
+                emotion_deltas = result.get("emotion_deltas")
+            else:
+                response_text = result
+                emotion_deltas = None
 
             # 応答送信
-            await send_splittable_message(target_channel, response_text, file=None)
-            log_success("PROCESS", f"CH[{target_channel.name}] に応答しました。")
+            if stream is not None:
+                await stream.finish(response_text)
+                first_text_s = stream.time_to_first_text
+            else:
+                first_text_s = time.monotonic() - started
+                await send_splittable_message(target_channel, response_text, file=None)
+            self._record_first_text(first_text_s, streamed=stream is not None)
+            log_success("PROCESS", f"CH[{target_channel.name}] に応答しました。(最初の表示まで {first_text_s or 0:.1f}秒)")
             
             # 感情更新
-            emotion_cog = self.bot.get_cog('EmotionCog')
             if emotion_cog:
-                user_input = "\n".join(f"[{m['author']}]: {m['content']}" for m in messages_to_process) if messages_to_process else ""
                 try:
-                    await emotion_cog.update_emotions(response_text, user_input)
+                    if isinstance(emotion_deltas, dict):
+                        emotion_cog.apply_emotion_deltas(emotion_deltas)
+                    else:
+                        if response_schema is not None:
+                            log_warning("EMOTION", "応答に感情の変化量が含まれていなかったため、別途感情分析を行います。")
+                        user_input = prompt_builder.format_unread_messages(messages_to_process, with_timestamp=False)
+                        # 分析はバックグラウンドで行い、チャンネルの処理はここで終える
+                        emotion_cog.enqueue_update(response_text, user_input)
                 except Exception as e:
                     log_error("EMOTION", f"感情更新中にエラーが発生しました: {e}")
 
-            # 処理済み未読メッセージをクリア
+            # 処理したメッセージまでをコミット
             if messages_to_process:
-                self.unread_data[str_channel_id] = []
-                log_info("UNREAD", f"CH[{channel_id}] の未読メッセージをクリアしました。")
-                data_manager.save_data('unread', self.unread_data)
+                cursor = messages_to_process[-1]['offset']
+                # 処理中にリセット・再読み込みでログが差し替えられた場合、オフセットは新しいログでは別のメッセージを指すのでコミットしない
+                if self.unread_data.get(str_channel_id) is not unread_log:
+                    log_warning("UNREAD", f"CH[{channel_id}] の未読メッセージは処理中に差し替えられたため、処理済みにしません。")
+                else:
+                    unread_log.commit(cursor)
+                    log_info("UNREAD", f"CH[{channel_id}] の未読メッセージをオフセット {cursor} まで処理済みにしました。(残り: {len(unread_log)}件)")
+                    data_manager.commit_unread(str_channel_id, cursor)
 
         except Exception as e:
              log_error("PROCESS_ERROR", f"CH[{channel_id}] の処理中に予期せぬエラーが発生しました: {type(e).__name__} - {e}")
 
         finally:
-            if str_channel_id in self.processing_channels:
-                self.processing_channels.remove(str_channel_id)
-                log_info("PROCESS_END", f"CH[{channel_id}] の処理を終了します。")
-            else:
-                 log_warning("PROCESS_END", f"CH[{channel_id}] が処理中セットにありませんでした（終了処理）。")
+            log_info("PROCESS_END", f"CH[{channel_id}] の処理を終了します。")
+
+    def _record_first_text(self, seconds: float | None, streamed: bool):
+        """最初の本文が表示されるまでの秒数を計測値に加える"""
+        if seconds is None:
+            return
+        stats = self.response_stats
+        stats["replies"] += 1
+        if streamed:
+            stats["streamed"] += 1
+        stats["avg_first_text_s"] += (seconds - stats["avg_first_text_s"]) / stats["replies"]
+        stats["last_first_text_s"] = seconds
 
     async def force_check_channel(self, channel_id: int):
         """
         ループの待機を無視して、指定されたチャンネルの活動を即座に処理する
+        (処理中の場合は、現在の処理の直後にもう一度処理する)
         """
-        str_channel_id = str(channel_id)
-        if str_channel_id in self.processing_channels:
-            log_warning("FORCE_CHECK_SKIP", f"コマンドによる CH[{channel_id}] の強制チェックは、既に処理中のためスキップします。")
-            return
-
         log_system(f"コマンドにより CH[{channel_id}] の強制チェックを実行します。")
         await self.process_channel_activity(channel_id)
 
@@ -30,7 +30,7 @@ class CommandCog(commands.Cog, name="CommandCog"):
         embed.add_field(name=f"**{p}history (hist)**", value=f"`{p}hist <reload|reset|export>`\n会話履歴を操作", inline=False)
         embed.add_field(name=f"**{p}persona (ps)**", value=f"`{p}ps <reload|apply>`\nキャラクター設定を操作", inline=False)
         embed.add_field(name=f"**{p}emotion (emo)**", value=f"`{p}emo <set|reset|random|reload>`\n感情値を操作", inline=False)
-        embed.add_field(name=f"**{p}memory (mem)**", value=f"`{p}mem <add|list|del|reset>`\n記憶を操作", inline=False)
+        embed.add_field(name=f"**{p}memory (mem)**", value=f"`{p}mem <add|list [ページ]|del <ID>|reset>`\n記憶を操作", inline=False)
         embed.add_field(name=f"**{p}unread (ur)**", value=f"`{p}ur <pop|reset|reload>`\n未読メッセージを操作", inline=False)
         embed.add_field(name=f"**{p}chat <on|off>**", value="常時会話モードのON/OFF", inline=False)
         embed.add_field(name=f"**{p}key <1|2|3>**", value="使用するAPIキーを変更", inline=False)
@@ -53,6 +53,54 @@ class CommandCog(commands.Cog, name="CommandCog"):
         if chat_cog:
             embed.add_field(name="🕒 現在の行動", value=f"{chat_cog.current_action}", inline=True)
 
+        key_lines = [
+            f"#{u['key']} {u['model']}: RPM {u['rpm_used']}% / TPM {u['tpm_used']}%"
+            f" / {u['latency_ms'] if u['latency_ms'] is not None else '-'}ms / エラー率 {u['error_rate']}"
+            + (f" / 休止 {u['cooldown']}秒" if u['cooldown'] else "")
+            for u in ai_request_handler.get_key_utilization()
+        ]
+        if config.HEDGE_ENABLED:
+            hedge = ai_request_handler.get_hedge_stats()
+            key_lines.append(
+                f"ヘッジ: {hedge['hedged']}/{hedge['requests']}件 ({hedge['hedge_rate'] * 100:.1f}%)"
+                f" / 採用 {hedge['hedge_wins']}件 / 短縮 約{hedge['latency_saved_s']}秒"
+            )
+        prefix = ai_request_handler.get_prefix_cache_stats()
+        if prefix:
+            key_lines.append(
+                f"プレフィックスキャッシュ({prefix['mode']}): ヒット率 {prefix['hit_rate'] * 100:.1f}%"
+                f" ({prefix['hits']}/{prefix['lookups']}) / 節約 {prefix['tokens_saved']}トークン"
+            )
+        if key_lines:
+            embed.add_field(name="🔑 APIキー使用率", value="\n".join(key_lines), inline=False)
+
+        persist_stats = data_manager.get_persistence_stats()
+        embed.add_field(
+            name="💾 DB書き込み",
+            value=f"待機: {persist_stats['queue_depth']}件 / 実行中: {persist_stats['in_flight']}件\n"
+                  f"フラッシュ: 平均 {persist_stats['avg_flush_ms']}ms (最大 {persist_stats['max_flush_ms']}ms)\n"
+                  f"保存要求 {persist_stats['requested']} → 書き込み {persist_stats['written']}",
+            inline=False
+        )
+
+        if chat_cog and chat_cog.response_stats['replies']:
+            stats = chat_cog.response_stats
+            embed.add_field(
+                name="💬 応答",
+                value=f"最初の表示まで: 平均 {stats['avg_first_text_s']:.1f}秒 (直近 {stats['last_first_text_s']:.1f}秒)"
+                      f" / ストリーミング {stats['streamed']}/{stats['replies']}件",
+                inline=False
+            )
+
+        mem_cog = self.bot.get_cog('MemoryCog')
+        if mem_cog:
+            stats = mem_cog.consolidation_stats
+            embed.add_field(
+                name="📚 記憶",
+                value=f"{len(mem_cog.memories)}件 / 統合: {stats['merged']}件 / 置き換え: {stats['superseded']}件 (推定 {stats['tokens_saved']}トークン削減)",
+                inline=False
+            )
+
         embed.add_field(name="--- 感情パラメータ ---", value="", inline=False)
         for name, (emoji, ja_name) in emotion_cog.emotion_map.items():
             value = emotion_cog.current_emotions.get(name, 0)
@@ -64,7 +112,7 @@ class CommandCog(commands.Cog, name="CommandCog"):
     async def save_data(self, ctx):
         """現在の全てのデータをDBに保存します。"""
         try:
-            data_manager.save_all_data() # db_manager の save_all_data を呼ぶ
+            await data_manager.save_all_data() # 書き込み完了まで待つ
             log_success("COMMAND", "全データのDB保存に成功しました。")
             await ctx.send("> SYSTEM: 全てのデータをデータベースに保存しました。")
         except Exception as e:
@@ -79,7 +127,7 @@ class CommandCog(commands.Cog, name="CommandCog"):
 
     @history_group.command(name="reload", aliases=["rl"])
     async def history_reload(self, ctx):
-        if data_manager.reload_data('history'):
+        if await data_manager.reload_data('history'):
             await ctx.send("> SYSTEM: 履歴ファイルを再読み込みしました。")
         else:
             await ctx.send("> SYSTEM: 履歴の再読み込みに失敗しました。")
@@ -119,7 +167,7 @@ class CommandCog(commands.Cog, name="CommandCog"):
     @persona_group.command(name="apply", aliases=["ap"])
     async def persona_apply(self, ctx):
         ai_request_handler.apply_persona_to_channel(ctx.channel.id)
-        await ctx.send(f"> SYSTEM: チャンネル `{ctx.channel.name}` の履歴にペルソナを適用しました。")
+        await ctx.send(f"> SYSTEM: チャンネル `{ctx.channel.name}` の履歴を初期化し、最新のペルソナを適用しました。")
 
     # ■■■ Emotion Commands ■■■
     @commands.group(name="emotion", aliases=["emo"], invoke_without_command=True)
@@ -130,7 +178,7 @@ class CommandCog(commands.Cog, name="CommandCog"):
     async def emotion_reload(self, ctx):
         """emotion.jsonを再読み込みし、Botの感情定義を更新します。"""
         emo_cog = self.bot.get_cog("EmotionCog")
-        if emo_cog and emo_cog.reload_data():
+        if emo_cog and await emo_cog.reload_data():
             await ctx.send("> SYSTEM: 感情ファイルを再読み込みし、設定を更新しました。")
         else:
             await ctx.send("> SYSTEM: 感情ファイルのリロードに失敗しました。")
@@ -174,26 +222,29 @@ class CommandCog(commands.Cog, name="CommandCog"):
             await ctx.send(f"> SYSTEM: 新しい記憶を追加しました。\n`{memory_text}`")
 
     @memory_group.command(name="list", aliases=["ls"])
-    async def memory_list(self, ctx):
+    async def memory_list(self, ctx, page: int = 1):
         mem_cog = self.bot.get_cog("MemoryCog")
         if not mem_cog or not mem_cog.memories:
             return await ctx.send("> SYSTEM: 記憶はまだありません。")
         
+        records, total_pages = mem_cog.get_memory_page(page)
+        page = max(1, min(page, total_pages))
         embed = discord.Embed(title="記憶リスト", color=0xffa500)
-        description = "\n".join(f"**{i+1}.** {mem}\n" for i, mem in enumerate(mem_cog.memories))
+        description = "\n".join(f"**{r['id']}.** {r['text']}\n" for r in records)
         embed.description = description
+        embed.set_footer(text=f"{page} / {total_pages} ページ (全{len(mem_cog.memories)}件) | 削除: {self.bot.command_prefix}mem del <ID>")
         await ctx.send(embed=embed)
 
     @memory_group.command(name="delete", aliases=["del"])
-    async def memory_delete(self, ctx, index: int):
+    async def memory_delete(self, ctx, memory_id: int):
         mem_cog = self.bot.get_cog("MemoryCog")
         if not mem_cog: return await ctx.send("> SYSTEM: MemoryCogが見つかりません。")
         
-        deleted = mem_cog.delete_memory(index - 1)
+        deleted = mem_cog.delete_memory(memory_id)
         if deleted:
-            await ctx.send(f"> SYSTEM: 記憶 `{index}`番 を削除しました。\n`{deleted}`")
+            await ctx.send(f"> SYSTEM: 記憶 ID `{memory_id}` を削除しました。\n`{deleted}`")
         else:
-            await ctx.send(f"> SYSTEM: その番号の記憶は見つかりませんでした。")
+            await ctx.send(f"> SYSTEM: そのIDの記憶は見つかりませんでした。")
 
     @memory_group.command(name="reset", aliases=["rs"])
     async def memory_reset(self, ctx):
@@ -231,7 +282,7 @@ class CommandCog(commands.Cog, name="CommandCog"):
     @unread_group.command(name="reload", aliases=["rl"])
     async def unread_reload(self, ctx):
         """unread_messages.jsonを再読み込みします。"""
-        if data_manager.reload_data('unread'):
+        if await data_manager.reload_data('unread'):
             # ChatCog内部のデータ参照を、再読み込みされた新しいデータに更新する
             chat_cog = self.bot.get_cog("ChatManagerCog")
             if chat_cog:
@@ -1,11 +1,15 @@
 import json
 import random
+import asyncio
+import time
+from collections import deque
 from discord.ext import commands
 
 import utils.config_manager as config
-from utils import ai_request_handler, prompt_builder
+from utils import ai_request_handler, prompt_builder, prompt_assets
+from utils.emotion_lexicon import EmotionLexicon
 import utils.db_manager as data_manager
-from utils.console_display import log_error, log_info, log_success
+from utils.console_display import log_error, log_info, log_success, log_warning
 
 class EmotionCog(commands.Cog, name="EmotionCog"):
     def __init__(self, bot):
@@ -17,12 +21,22 @@ class EmotionCog(commands.Cog, name="EmotionCog"):
         self.emotion_map = emotion_data.get('emotion_map', {})
         self.default_emotions = emotion_data.get('default_emotions', {})
         self.current_emotions = emotion_data.get('current_emotions', self.default_emotions.copy())
+        self.lexicon = self._build_lexicon(emotion_data)
+
+        # バックグラウンドで分析する対話の待ち行列 [(ユーザーの発言, AIの応答), ...]
+        self._pending_exchanges = deque()
+        self._analysis_wakeup = None
+        self._analysis_task = None
         
         log_success("EMOTION", "感情コアの準備が完了しました。")
 
-    def reload_data(self):
+    def cog_unload(self):
+        if self._analysis_task is not None:
+            self._analysis_task.cancel()
+
+    async def reload_data(self):
         """data_managerによってリロードされた最新の感情データをCogに反映させる"""
-        if data_manager.reload_data('emotion'):
+        if await data_manager.reload_data('emotion'):
             emotion_data = data_manager.get_data('emotion')
             self.emotion_map = emotion_data.get('emotion_map', {})
             self.default_emotions = emotion_data.get('default_emotions', {})
@@ -31,6 +45,7 @@ class EmotionCog(commands.Cog, name="EmotionCog"):
             new_valid_keys = set(self.emotion_map.keys())
             for key in current_keys - new_valid_keys:
                 del self.current_emotions[key]
+            self.lexicon = self._build_lexicon(emotion_data)
             log_success("EMOTION", "Cog内の感情データを正常にリロードしました。")
             return True
         return False
@@ -42,24 +57,111 @@ class EmotionCog(commands.Cog, name="EmotionCog"):
     def get_emotion_map(self) -> dict:
         return self.emotion_map
 
-    async def update_emotions(self, bot_response: str, user_input: str = ""):
-        log_info("EMOTION", "対話の感情分析を開始...")
-        
+    def enqueue_update(self, bot_response: str, user_input: str = ""):
+        """
+        対話を感情分析の待ち行列に積み、すぐに戻ります。
+        バックグラウンドのワーカーが近い時間の対話をまとめて1回のリクエストで分析し、古い順に反映します。
+        """
+        self._pending_exchanges.append((user_input, bot_response))
+        if self._analysis_task is None or self._analysis_task.done():
+            self._analysis_wakeup = asyncio.Event()
+            self._analysis_task = asyncio.get_running_loop().create_task(self._analysis_worker())
+        self._analysis_wakeup.set()
+
+    async def _analysis_worker(self):
+        while True:
+            self._analysis_wakeup.clear()
+            if not self._pending_exchanges:
+                await self._analysis_wakeup.wait()
+                continue
+
+            # 続けて届く対話を少し待ってからまとめる
+            deadline = time.monotonic() + config.EMOTION_BATCH_WINDOW_SECONDS
+            while len(self._pending_exchanges) < config.EMOTION_BATCH_MAX_EXCHANGES:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(self._analysis_wakeup.wait(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    break
+                self._analysis_wakeup.clear()
+
+            batch = [self._pending_exchanges.popleft()
+                     for _ in range(min(len(self._pending_exchanges), config.EMOTION_BATCH_MAX_EXCHANGES))]
+            try:
+                await self._analyze_exchanges(batch)
+            except Exception as e:
+                log_error("EMOTION", f"バックグラウンドの感情分析中にエラーが発生: {e}")
+
+    def _build_lexicon(self, emotion_data: dict) -> EmotionLexicon:
+        if not emotion_data.get('emotion_lexicon'):
+            self._seed_lexicon(emotion_data)
+        return EmotionLexicon(
+            emotion_data.get('emotion_lexicon', {}), self.emotion_map,
+            config.EMOTION_LEXICON_MAX_DELTA, config.EMOTION_LEXICON_DECAY_RATE
+        )
+
+    def _seed_lexicon(self, emotion_data: dict):
+        """
+        DBの感情データにキーワード表がない場合 (キーワード表の追加前から使っているDBなど)、
+        初期データの emotion.json から取り込んで保存する。取り込めなければ警告を出す。
+        """
         try:
-            with open(config.EMOTION_ANALYZER_PERSONA_FILE, 'r', encoding='utf-8') as f:
-                emotion_persona = f.read()
-        except FileNotFoundError:
+            with open(config.EMOTION_FILE, 'r', encoding='utf-8') as f:
+                lexicon = json.load(f).get('emotion_lexicon')
+        except Exception as e:
+            log_error("EMOTION", f"キーワード表を '{config.EMOTION_FILE}' から読み込めませんでした: {e}")
+            lexicon = None
+
+        if not lexicon:
+            log_warning("EMOTION", "感情データにキーワード表 (emotion_lexicon) がありません。キーワード表での感情推定は行われません。")
+            return
+        emotion_data['emotion_lexicon'] = lexicon
+        data_manager.save_data('emotion', emotion_data)
+        log_info("EMOTION", f"キーワード表を '{config.EMOTION_FILE}' から感情データに取り込みました。")
+
+    def _should_use_lexicon(self) -> bool:
+        """キーワード表で推定するか (レート上限が逼迫している間は、応答とAPIの枠を取り合わない)"""
+        if config.EMOTION_ESTIMATOR == "lexicon":
+            return True
+        if config.EMOTION_ESTIMATOR != "auto" or not self.lexicon:
+            return False
+        pressure = ai_request_handler.get_rate_limit_pressure(config.MODEL_PRO, config.MODEL_FLASH)
+        if pressure >= config.EMOTION_LEXICON_PRESSURE_THRESHOLD:
+            log_warning("EMOTION", f"APIのレート上限が逼迫しているため (逼迫度 {pressure:.2f})、キーワード表で感情を推定します。")
+            return True
+        return False
+
+    async def _analyze_exchanges(self, exchanges: list):
+        if self._should_use_lexicon():
+            for user_input, bot_response in exchanges:
+                # 基準値への戻りにキーワードからの推定を足す
+                emotion_deltas = self.lexicon.decay(self.current_emotions, self.default_emotions)
+                for emotion, delta in self.lexicon.estimate(user_input, bot_response).items():
+                    emotion_deltas[emotion] = emotion_deltas.get(emotion, 0) + delta
+                emotion_deltas = {emotion: delta for emotion, delta in emotion_deltas.items() if delta}
+                if emotion_deltas:
+                    self.apply_emotion_deltas(emotion_deltas)
+            return
+
+        log_info("EMOTION", f"対話{len(exchanges)}件の感情分析を開始...")
+        
+        # ファイルが更新されていなければメモリ上のキャッシュを使う
+        emotion_persona = prompt_assets.read_text(config.EMOTION_ANALYZER_PERSONA_FILE)
+        if emotion_persona is None:
             log_error("EMOTION", f"感情分析ペルソナ '{config.EMOTION_ANALYZER_PERSONA_FILE}' が見つかりません。")
             emotion_persona = "あなたは、ユーザーとAIの対話を分析する心理学者です。"
 
         # ★ 修正: prompt_builderを使用してプロンプトを生成
-        prompt = prompt_builder.build_emotion_analysis_prompt(
-            self.emotion_map, emotion_persona, user_input, bot_response
-        )
+        # 分析役のペルソナと感情リストは毎回同じなので、システム指示として送る (プレフィックスキャッシュの対象)
+        instruction = prompt_builder.build_emotion_analysis_instruction(self.emotion_map, emotion_persona)
+        prompt = prompt_builder.build_emotion_analysis_prompt(exchanges)
         
         # 会話履歴に影響しないよう channel_id=None でリクエスト
-        response_text = await ai_request_handler.send_request(config.MODEL_FLASH, prompt, channel_id=None)
-        # response_text = None
+        response_text = await ai_request_handler.send_request(
+            config.MODEL_FLASH, prompt, channel_id=None, system_instruction=instruction
+        )
 
         if not response_text:
             log_error("EMOTION", "AIからの応答がありませんでした。")
@@ -67,23 +169,29 @@ class EmotionCog(commands.Cog, name="EmotionCog"):
 
         try:
             json_text = response_text.strip().replace('```json', '').replace('```', '')
-            emotion_deltas = json.loads(json_text)
-            
-            for emotion, delta in emotion_deltas.items():
-                if emotion in self.current_emotions and isinstance(delta, (int, float)):
-                    current_value = self.current_emotions[emotion]
-                    new_value = current_value + int(delta)
-                    self.current_emotions[emotion] = max(0, min(500, new_value))
-            
-            # ★ DB保存
-            # メモリキャッシュ(_data_cache['emotion'])を直接更新した前提
-            data_manager.save_data('emotion', data_manager.get_data('emotion'))
-            
-            log_success("EMOTION", f"メモリ上の感情データを更新し、DBに保存しました: {emotion_deltas}")
+            result = json.loads(json_text)
+            # 複数の対話をまとめた場合は、対話ごとの変化量を古い順に反映する
+            for emotion_deltas in (result if isinstance(result, list) else [result]):
+                if isinstance(emotion_deltas, dict):
+                    self.apply_emotion_deltas(emotion_deltas)
 
         except Exception as e:
             log_error("EMOTION", f"感情更新中に予期せぬエラーが発生: {e}")
 
+    def apply_emotion_deltas(self, emotion_deltas: dict):
+        """感情の変化量 {感情名: 変化量} をメモリ上の感情データに反映し、DBに保存します。"""
+        for emotion, delta in emotion_deltas.items():
+            if emotion in self.current_emotions and isinstance(delta, (int, float)):
+                current_value = self.current_emotions[emotion]
+                new_value = current_value + int(delta)
+                self.current_emotions[emotion] = max(0, min(500, new_value))
+        
+        # ★ DB保存
+        # メモリキャッシュ(_data_cache['emotion'])を直接更新した前提
+        data_manager.save_data('emotion', data_manager.get_data('emotion'))
+        
+        log_success("EMOTION", f"メモリ上の感情データを更新し、DBに保存しました: {emotion_deltas}")
+
     def reset_emotions(self):
         """メモリ上の感情データをデフォルト値にリセットし、DBに保存します。"""
         self.current_emotions.clear()
@@ -1,33 +1,327 @@
-from discord.ext import commands
-from utils.console_display import log_success
+import time
+from datetime import datetime
+from discord.ext import commands, tasks
+from utils.console_display import log_success, log_info, log_error
+import utils.config_manager as config
 import utils.db_manager as data_manager # ★ db_manager に変更
+from utils import ai_request_handler, prompt_builder
+from utils.memory_index import MemoryIndex, jaccard, mutual_containment, differing_numbers
+from utils.token_estimator import estimate_tokens
+
+def _now_str() -> str:
+    return datetime.now().isoformat(timespec='seconds')
 
 class MemoryCog(commands.Cog, name="MemoryCog"):
     def __init__(self, bot):
         self.bot = bot
+        # {記憶ID: {id, text, created_at, last_used_at}} (ID順)。IDは削除や追加があっても変わらない。
         self.memories = data_manager.get_data('memory') # db_managerから取得
+        self._next_memory_id = max(self.memories, default=0) + 1
+        self.index = MemoryIndex(embedding_weight=config.MEMORY_EMBEDDING_WEIGHT)
+        self._rebuild_index()
         log_success("MEMORY", f"{len(self.memories)}件の記憶を読み込みました。")
 
-    def add_memory(self, memory_text: str):
-        self.memories.append(memory_text)
-        log_success("MEMORY", f"新しい記憶をメモリに追加: {memory_text}")
-        data_manager.save_data('memory', self.memories) # ★ DB保存
+        # 記憶の統合の計測値
+        self._last_consolidated_at = None
+        self.consolidation_stats = {"runs": 0, "merged": 0, "superseded": 0, "tokens_saved": 0}
+        if config.MEMORY_CONSOLIDATION_ENABLED:
+            self.consolidation_loop.start()
+
+    def cog_unload(self):
+        self.consolidation_loop.cancel()
+
+    def _rebuild_index(self):
+        self.index.clear()
+        for memory_id, record in self.memories.items():
+            self.index.add(memory_id, record['text'])
+
+    def set_embedding_function(self, embed_fn):
+        """
+        記憶の検索に使う埋め込み関数 (テキスト -> ベクトル) を設定し、インデックスを作り直す。
+        None を渡すと BM25 のみの検索に戻る。
+        """
+        self.index = MemoryIndex(embed_fn, config.MEMORY_EMBEDDING_WEIGHT)
+        self._rebuild_index()
+        log_info("MEMORY", f"記憶の検索インデックスを作り直しました。(埋め込み: {'あり' if embed_fn else 'なし'})")
+
+    def add_memory(self, memory_text: str) -> dict:
+        record = {"id": self._next_memory_id, "text": memory_text, "created_at": _now_str(), "last_used_at": None}
+        self._next_memory_id += 1
+        self.memories[record['id']] = record
+        self.index.add(record['id'], memory_text)
+        log_success("MEMORY", f"新しい記憶 (ID: {record['id']}) をメモリに追加: {memory_text}")
+        data_manager.save_memory(record) # ★ DB保存 (この1件のみ)
+        return record
 
     def get_memories(self) -> list:
-        return self.memories
+        return list(self.memories.values())
+
+    def get_memory_page(self, page: int, page_size: int = None) -> tuple[list, int]:
+        """page (1始まり) ページ目の記憶と、全ページ数を返す"""
+        page_size = page_size or config.MEMORY_LIST_PAGE_SIZE
+        total_pages = max(1, -(-len(self.memories) // page_size))
+        page = max(1, min(page, total_pages))
+        records = list(self.memories.values())[(page - 1) * page_size:page * page_size]
+        return records, total_pages
+
+    def select_memories(self, query: str, token_budget: int = None, top_k: int = None) -> list:
+        """
+        プロンプトに入れる記憶を選ぶ。query (未読メッセージなど) との関連度が高い順に選び、
+        関連する記憶がなければ入れない。query が空 (自発発言など) の場合は新しい記憶から選ぶ。
+        合計が token_budget (推定トークン数) を超えない範囲で最大 top_k 件。
+        選んだ記憶は最終使用時刻を更新する (DBへの書き込みは1回にまとめる)。
+        """
+        selected = self._select(query, token_budget, top_k)
+        now = _now_str()
+        for record in selected:
+            record['last_used_at'] = now
+        data_manager.touch_memories(selected)
+        return [record['text'] for record in selected]
+
+    def _select(self, query: str, token_budget: int = None, top_k: int = None) -> list:
+        """select_memories() と同じ基準で記憶のレコードを選ぶ (最終使用時刻は更新しない)"""
+        token_budget = config.MEMORY_PROMPT_TOKEN_BUDGET if token_budget is None else token_budget
+        top_k = config.MEMORY_PROMPT_TOP_K if top_k is None else top_k
+
+        if query:
+            candidates = [memory_id for memory_id, _ in self.index.search(query, top_k)]
+        else:
+            candidates = reversed(self.memories)
+
+        selected = []
+        used_tokens = 0
+        for memory_id in candidates:
+            if len(selected) >= top_k:
+                break
+            tokens = estimate_tokens(self.memories[memory_id]['text']) + 2
+            if used_tokens + tokens > token_budget:
+                continue
+            used_tokens += tokens
+            selected.append(self.memories[memory_id])
+        return selected
+
+    def _average_prompt_tokens(self, queries: list) -> float:
+        """queries のそれぞれでプロンプトに入る記憶 (上位 top_k 件) の推定トークン数の平均"""
+        if not queries:
+            return 0.0
+        total = sum(estimate_tokens(r['text']) + 2 for query in queries for r in self._select(query))
+        return total / len(queries)
     
-    def delete_memory(self, index: int): 
-        if 0 <= index < len(self.memories):
-            removed_memory = self.memories.pop(index)
-            log_success("MEMORY", f"記憶 No.{index+1} をメモリから削除しました。")
-            data_manager.save_data('memory', self.memories) # ★ DB保存
-            return removed_memory
-        return None
+    def delete_memory(self, memory_id: int) -> str | None:
+        record = self.memories.pop(memory_id, None)
+        if record is None:
+            return None
+        self.index.remove(memory_id)
+        log_success("MEMORY", f"記憶 ID: {memory_id} をメモリから削除しました。")
+        data_manager.delete_memory(memory_id) # ★ DB保存 (この1件のみ)
+        return record['text']
 
     def reset_memories(self):
-        self.memories.clear()
+        data_manager.reset_memories() # ★ DB保存 (メモリ上の記憶もクリアされる)
+        self.index.clear()
+        self._next_memory_id = 1
         log_success("MEMORY", "メモリ上の記憶データがリセットされました。")
-        data_manager.save_data('memory', self.memories) # ★ DB保存
+
+    # --- 記憶の統合 ---
+
+    @tasks.loop(minutes=30)
+    async def consolidation_loop(self):
+        """活動の少ない時間帯に、一定間隔で記憶の統合を行う"""
+        interval = config.MEMORY_CONSOLIDATION_INTERVAL_HOURS * 3600
+        if self._last_consolidated_at is not None and time.monotonic() - self._last_consolidated_at < interval:
+            return
+        if not self._is_low_activity_hour(datetime.now()):
+            return
+        self._last_consolidated_at = time.monotonic()
+        try:
+            await self.consolidate_memories()
+        except Exception as e:
+            log_error("MEMORY_CONSOLIDATE", f"記憶の統合中にエラーが発生しました: {e}")
+
+    @consolidation_loop.before_loop
+    async def before_consolidation_loop(self):
+        await self.bot.wait_until_ready()
+
+    def _is_low_activity_hour(self, now: datetime) -> bool:
+        """現在の時間帯が、その日のスケジュールで最も待機時間の長い (活動の少ない) レベルかどうか"""
+        schedule_data = data_manager.get_data('schedule') or {}
+        day_schedule = schedule_data.get("weekend" if now.weekday() >= 5 else "weekday", {})
+        activity_params = schedule_data.get("activity_params", {})
+        if not day_schedule or not activity_params:
+            return False
+
+        def wait_seconds(level: str) -> float:
+            return activity_params.get(level, {}).get('seconds', 0)
+
+        quietest = max(wait_seconds(entry.get('level', 'normal')) for entry in day_schedule.values())
+        current_level = day_schedule.get(str(now.hour), {}).get('level', 'normal')
+        return wait_seconds(current_level) >= quietest
+
+    def _find_similar_groups(self) -> list:
+        """似た記憶のグループ ([記憶ID, ...] のリスト、各グループはID順) を返す"""
+        parent = {memory_id: memory_id for memory_id in self.memories}
+
+        def find(memory_id):
+            while parent[memory_id] != memory_id:
+                parent[memory_id] = parent[parent[memory_id]]
+                memory_id = parent[memory_id]
+            return memory_id
+
+        # 候補は検索インデックスで絞り込み、全ペアの比較は行わない
+        for memory_id, record in self.memories.items():
+            for other_id, _ in self.index.search(record['text'], 5):
+                if other_id == memory_id or find(other_id) == find(memory_id):
+                    continue
+                other_text = self.memories[other_id]['text']
+                if self._is_duplicate(record['text'], other_text):
+                    parent[find(other_id)] = find(memory_id)
+
+        groups = {}
+        for memory_id in self.memories:
+            groups.setdefault(find(memory_id), []).append(memory_id)
+        return [sorted(ids) for ids in groups.values() if len(ids) > 1]
+
+    @staticmethod
+    def _is_duplicate(text: str, other_text: str) -> bool:
+        """
+        2つの記憶が同じ内容の重複かどうか。
+        語がほぼすべて互いに含まれていて、数字 (日付や数量) が一致する場合だけ重複とみなす。
+        一部の語だけが違う記憶 (「猫が好き」と「犬が好き」など) は別の事実なのでまとめない。
+        """
+        if differing_numbers(text, other_text):
+            return False
+        return mutual_containment(text, other_text) >= config.MEMORY_CONSOLIDATION_SIMILARITY
+
+    def _find_superseded_pairs(self, groups: list) -> list:
+        """
+        新しい記憶に置き換えられた可能性のある古い記憶の組 [(古い記憶ID, 新しい記憶ID), ...] を返す。
+        重複ではないが語の多くが共通する記憶 (「東京に住んでいる」と「大阪に住んでいる」など) が候補になる。
+        記憶IDは追加順なので、IDの大きい方を新しい記憶とみなす。
+        """
+        grouped = {memory_id for ids in groups for memory_id in ids}
+        pairs = []
+        claimed = set()
+        for memory_id, record in self.memories.items():
+            if memory_id in grouped or memory_id in claimed:
+                continue
+            for other_id, _ in self.index.search(record['text'], 5):
+                if other_id <= memory_id or other_id in grouped:
+                    continue
+                other_text = self.memories[other_id]['text']
+                if self._is_duplicate(record['text'], other_text):
+                    continue
+                if jaccard(record['text'], other_text) >= config.MEMORY_CONSOLIDATION_SUPERSEDE_SIMILARITY:
+                    pairs.append((memory_id, other_id))
+                    claimed.add(memory_id)
+                    break
+        return pairs
+
+    async def _is_superseded(self, old_text: str, new_text: str) -> bool:
+        """新しい記憶が古い記憶の事実を置き換えているかを軽量モデルに判定させる (判定できない場合は False)"""
+        if not config.MEMORY_CONSOLIDATION_USE_LLM:
+            return False
+        if ai_request_handler.get_rate_limit_pressure(config.MODEL_PRO_3) >= config.MEMORY_CONSOLIDATION_PRESSURE_THRESHOLD:
+            return False
+        verdict = await ai_request_handler.send_request(
+            config.MODEL_PRO_3, prompt_builder.build_memory_supersede_prompt(old_text, new_text), channel_id=None
+        )
+        return (verdict or "").strip().startswith("はい")
+
+    async def _merge_texts(self, texts: list) -> str:
+        """記憶の文章を統合する。統合した文章が得られない場合は None を返す (そのグループはまとめない)。"""
+        if len({text.strip() for text in texts}) == 1:
+            return texts[-1].strip()
+        if not config.MEMORY_CONSOLIDATION_USE_LLM:
+            return None
+        if ai_request_handler.get_rate_limit_pressure(config.MODEL_PRO_3) >= config.MEMORY_CONSOLIDATION_PRESSURE_THRESHOLD:
+            return None
+        merged = await ai_request_handler.send_request(
+            config.MODEL_PRO_3, prompt_builder.build_memory_merge_prompt(texts), channel_id=None
+        )
+        merged = (merged or "").strip()
+        # 統合結果が元より長くなる場合は、プロンプトの節約にならないので使わない
+        if not merged or estimate_tokens(merged) > sum(estimate_tokens(t) for t in texts):
+            return None
+        return merged
+
+    async def consolidate_memories(self) -> int:
+        """
+        重複した記憶を1件にまとめ、新しい記憶に置き換えられた古い記憶を削除する
+        (削除は MEMORY_CONSOLIDATION_SUPERSEDE_ENABLED が True の場合だけで、それ以外は判定結果をログに出す)。
+        まとめた記憶は最も新しい記憶のIDを引き継ぎ、作成時刻はグループ内で最も古いものにする。
+        プロンプトには上位 top_k 件の記憶しか入らないため、節約できたトークン数は
+        各記憶を検索語にしたときの選択結果の推定トークン数の平均で比べ、プロンプト1回あたりの値を返す。
+        """
+        groups = self._find_similar_groups()
+        pairs = self._find_superseded_pairs(groups)
+        self.consolidation_stats["runs"] += 1
+        if not groups and not pairs:
+            log_info("MEMORY_CONSOLIDATE", "統合できる記憶はありませんでした。")
+            return 0
+
+        log_info("MEMORY_CONSOLIDATE", f"重複した記憶のグループが{len(groups)}件、置き換えの候補が{len(pairs)}件見つかりました。統合します...")
+        queries = [record['text'] for record in self.memories.values()]
+        tokens_before = self._average_prompt_tokens(queries)
+        merged_count = 0
+        for ids in groups:
+            # 統合中に削除された記憶は除く
+            ids = [memory_id for memory_id in ids if memory_id in self.memories]
+            if len(ids) < 2:
+                continue
+            texts = [self.memories[memory_id]['text'] for memory_id in ids]
+            merged_text = await self._merge_texts(texts)
+            if merged_text is None:
+                log_info("MEMORY_CONSOLIDATE", f"記憶 {ids} は統合した文章が得られなかったため、まとめずに残します。")
+                continue
+            if config.MEMORY_CONSOLIDATION_DRY_RUN:
+                log_info("MEMORY_CONSOLIDATE", f"[dry run] 記憶 {ids} を「{merged_text}」にまとめます。")
+                continue
+            ids = [memory_id for memory_id in ids if memory_id in self.memories]
+            if len(ids) < 2:
+                continue
+
+            keep_id = ids[-1]
+            record = self.memories[keep_id]
+            record['text'] = merged_text
+            record['created_at'] = min((self.memories[memory_id]['created_at'] or record['created_at']) for memory_id in ids)
+            self.index.add(keep_id, merged_text)
+            data_manager.save_memory(record)
+            for memory_id, text in zip(ids, texts):
+                log_info("MEMORY_CONSOLIDATE", f"記憶 {memory_id}「{text}」を {keep_id}「{merged_text}」にまとめました。")
+            for memory_id in ids[:-1]:
+                self.memories.pop(memory_id)
+                self.index.remove(memory_id)
+                data_manager.delete_memory(memory_id)
+
+            merged_count += len(ids) - 1
+
+        superseded_count = 0
+        for old_id, new_id in pairs:
+            if old_id not in self.memories or new_id not in self.memories:
+                continue
+            old_text, new_text = self.memories[old_id]['text'], self.memories[new_id]['text']
+            if not await self._is_superseded(old_text, new_text):
+                continue
+            if config.MEMORY_CONSOLIDATION_DRY_RUN or not config.MEMORY_CONSOLIDATION_SUPERSEDE_ENABLED:
+                log_info("MEMORY_CONSOLIDATE", f"[dry run] 記憶 {old_id}「{old_text}」は {new_id}「{new_text}」に置き換えられたと判定しました。(削除はしません)")
+                continue
+            if old_id not in self.memories:
+                continue
+            self.memories.pop(old_id)
+            self.index.remove(old_id)
+            data_manager.delete_memory(old_id)
+            log_info("MEMORY_CONSOLIDATE", f"記憶 {old_id}「{old_text}」は {new_id}「{new_text}」に置き換えられたため削除しました。")
+            superseded_count += 1
+
+        tokens_saved = 0
+        if merged_count or superseded_count:
+            tokens_saved = max(0, round(tokens_before - self._average_prompt_tokens(queries)))
+        self.consolidation_stats["merged"] += merged_count
+        self.consolidation_stats["superseded"] += superseded_count
+        self.consolidation_stats["tokens_saved"] += tokens_saved
+        log_success("MEMORY_CONSOLIDATE", f"記憶を{merged_count}件統合し、{superseded_count}件の古い記憶を削除しました。"
+                                          f"(プロンプト1回あたり 推定{tokens_saved}トークン削減, 残り{len(self.memories)}件)")
+        return tokens_saved
 
 async def setup(bot):
-    await bot.add_cog(MemoryCog(bot))
\ No newline at end of file
+    await bot.add_cog(MemoryCog(bot))
@@ -66,11 +66,11 @@ async def main():
     if not config_manager.init(character_name):
         return
 
-    if not data_manager.init_db():
+    if not await data_manager.init_db():
         log_error("SYSTEM", "データベースの初期化に失敗しました。起動を中止します。")
         return
 
-    data_manager.load_all_data()
+    await data_manager.load_all_data()
 
     DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
     if not DISCORD_TOKEN:
@@ -90,7 +90,7 @@ async def main():
         await bot.start(DISCORD_TOKEN)
     finally:
         log_system("シャットダウン処理を実行します...")
-        data_manager.save_all_data()
+        await data_manager.shutdown()
 
 if __name__ == '__main__':
     try:
@@ -0,0 +1,105 @@
+import os
+import sys
+
+import pytest
+
+# リポジトリ直下から utils / cogs を import できるようにする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def backend(tmp_path, monkeypatch):
+    """db_manager の書き込み操作の書き込み先にする、一時ディレクトリの SQLite バックエンド"""
+    import utils.db_manager as data_manager
+    from utils.storage.sqlite_backend import SQLiteBackend
+
+    backend = SQLiteBackend(str(tmp_path / "storage.sqlite3"))
+    backend.connect()
+    monkeypatch.setattr(data_manager, "_backend", backend)
+    monkeypatch.setattr(data_manager, "_data_cache", {})
+    yield backend
+    backend.close()
+
+class FakeChannel:
+    def __init__(self, channel_id):
+        self.id = channel_id
+        self.name = f"ch{channel_id}"
+        self.sent = []
+
+    def typing(self):
+        return FakeTyping()
+
+    async def send(self, content, file=None):
+        self.sent.append(content)
+
+class FakeTyping:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+class FakeBot:
+    def __init__(self):
+        self.user = object()
+        self.command_prefix = "!"
+        self.channels = {}
+
+    def get_channel(self, channel_id):
+        return self.channels.setdefault(channel_id, FakeChannel(channel_id))
+
+    def get_cog(self, name):
+        return None
+
+@pytest.fixture
+def chat_cog(monkeypatch):
+    """活動ループを起動せず、DBにも書き込まない ChatManagerCog を作る (AIへの送信は各テストで差し替える)"""
+    # cogs.chat は discord.py と google-generativeai がない環境では import できない
+    pytest.importorskip("discord")
+    pytest.importorskip("google.generativeai")
+    from discord.ext import tasks
+    import cogs.chat as chat
+    import utils.config_manager as config
+    from utils import db_manager as data_manager, prompt_builder
+
+    monkeypatch.setattr(data_manager, "_data_cache", {
+        'unread': {},
+        'schedule': {"activity_params": {"normal": {"seconds": 3600, "sigma": 0, "concurrency": 1, "urgent_latency": 0}}},
+        'setting': {"channel_settings": {}},
+    })
+    monkeypatch.setattr(data_manager, "commit_unread", lambda channel_id, cursor: None)
+    monkeypatch.setattr(data_manager, "append_unread", lambda channel_id, entry: None)
+    monkeypatch.setattr(tasks.Loop, "start", lambda self, *args, **kwargs: None)
+    monkeypatch.setattr(prompt_builder, "get_bot_status_text", lambda bot, messages: "")
+    monkeypatch.setattr(prompt_builder, "build_archive_recall_text", lambda channel_id, messages: "")
+    monkeypatch.setattr(prompt_builder, "build_response_prompt", lambda messages, status, recall: "prompt")
+    monkeypatch.setattr(config, "STREAM_ENABLED", False)
+    monkeypatch.setattr(config, "BURST_QUIET_SECONDS", 0.0)
+    return chat.ChatManagerCog(FakeBot())
+
+@pytest.fixture
+def make_memory_cog(monkeypatch):
+    """texts を ID 1 から順に持つ MemoryCog を作る (統合のループは起動せず、DBにも書き込まない)"""
+    # cogs.memory は discord.py と google-generativeai がない環境では import できない
+    pytest.importorskip("discord")
+    pytest.importorskip("google.generativeai")
+    from cogs.memory import MemoryCog
+    import utils.config_manager as config
+    import utils.db_manager as data_manager
+
+    def make(texts):
+        memories = {
+            i: {"id": i, "text": text, "created_at": f"2024-01-{i:02d}T00:00:00", "last_used_at": None}
+            for i, text in enumerate(texts, start=1)
+        }
+        monkeypatch.setattr(data_manager, "_data_cache", {'memory': memories})
+        monkeypatch.setattr(config, "MEMORY_CONSOLIDATION_ENABLED", False)
+        cog = MemoryCog(bot=None)
+        cog.touched = []
+        cog.saved = []
+        cog.deleted = []
+        monkeypatch.setattr(data_manager, "touch_memories", lambda records: cog.touched.append([r['id'] for r in records]))
+        monkeypatch.setattr(data_manager, "save_memory", lambda record: cog.saved.append(record['id']))
+        monkeypatch.setattr(data_manager, "delete_memory", lambda memory_id: cog.deleted.append(memory_id))
+        return cog
+
+    return make
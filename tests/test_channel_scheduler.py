@@ -0,0 +1,39 @@
+import pytest
+
+import utils.config_manager as config
+from utils.channel_scheduler import channel_score, rank_channels
+from utils.unread_log import UnreadLog
+
+NOW = 10_000.0
+
+@pytest.fixture(autouse=True)
+def weights(monkeypatch):
+    monkeypatch.setattr(config, "SCHEDULER_UNREAD_WEIGHT", 1.0)
+    monkeypatch.setattr(config, "SCHEDULER_AGE_WEIGHT_PER_MINUTE", 0.1)
+    monkeypatch.setattr(config, "SCHEDULER_DEFAULT_PRIORITY", 1.0)
+
+def unread(*ages_in_minutes):
+    log = UnreadLog()
+    for age in ages_in_minutes:
+        log.append({"content": "x", "received_at": NOW - age * 60})
+    return log
+
+def test_score_combines_count_and_age_of_the_oldest_message():
+    assert channel_score(unread(10, 1), 2.0, NOW, 1.0, 0.1) == pytest.approx(2.0 * (1 + 2 + 1.0))
+
+def test_channels_are_ranked_by_score():
+    ranked = rank_channels({"quiet": unread(0), "busy": unread(0, 0, 0), "old": unread(60)}, {}, NOW)
+    assert [channel_id for channel_id, _ in ranked] == ["old", "busy", "quiet"]
+
+def test_channel_priority_scales_the_score():
+    ranked = rank_channels({"a": unread(0, 0), "b": unread(0)}, {"b": {"priority": 3.0}}, NOW)
+    assert [channel_id for channel_id, _ in ranked] == ["b", "a"]
+
+def test_channels_without_unread_or_priority_are_skipped():
+    ranked = rank_channels({"empty": UnreadLog(), "off": unread(0), "on": unread(0)}, {"off": {"priority": 0}}, NOW)
+    assert [channel_id for channel_id, _ in ranked] == ["on"]
+
+def test_messages_without_a_timestamp_count_without_age():
+    log = UnreadLog()
+    log.append({"content": "x"})
+    assert rank_channels({"1": log}, {}, NOW) == [("1", 2.0)]
@@ -0,0 +1,55 @@
+import asyncio
+import time
+
+import utils.config_manager as config
+from utils.unread_log import UnreadLog
+
+def test_wait_ends_after_the_channel_is_quiet(chat_cog, monkeypatch):
+    monkeypatch.setattr(config, "BURST_QUIET_SECONDS", 0.05)
+    chat_cog._last_message_at["1"] = time.monotonic()
+    started = time.monotonic()
+    asyncio.run(chat_cog._wait_for_burst_end("1"))
+    assert time.monotonic() - started >= 0.05
+
+def test_wait_continues_while_someone_is_typing(chat_cog, monkeypatch):
+    chat_cog._typing_until["1"] = {42: time.monotonic() + 0.1}
+    started = time.monotonic()
+    asyncio.run(chat_cog._wait_for_burst_end("1"))
+    assert time.monotonic() - started >= 0.1
+    # 期限の切れた入力中表示は取り除かれる
+    assert chat_cog._typing_until["1"] == {}
+
+def test_wait_is_capped_by_the_max_wait(chat_cog, monkeypatch):
+    monkeypatch.setattr(config, "BURST_MAX_WAIT_SECONDS", 0.05)
+    chat_cog._typing_until["1"] = {42: time.monotonic() + 60}
+    started = time.monotonic()
+    asyncio.run(chat_cog._wait_for_burst_end("1"))
+    assert time.monotonic() - started < 1
+
+def test_messages_sent_during_the_burst_are_answered_in_one_request(chat_cog, monkeypatch):
+    from utils import ai_request_handler
+    monkeypatch.setattr(config, "BURST_QUIET_SECONDS", 0.05)
+    requests = []
+
+    async def send_request(model, prompt, channel_id=None, unread_messages=None, **kwargs):
+        requests.append([m['content'] for m in unread_messages])
+        return "返信"
+
+    monkeypatch.setattr(ai_request_handler, "send_request", send_request)
+    chat_cog.unread_data["1"] = UnreadLog()
+
+    def receive(content):
+        chat_cog.unread_data["1"].append({"author": "a", "content": content})
+        chat_cog._last_message_at["1"] = time.monotonic()
+
+    async def run():
+        receive("まって")
+        processing = asyncio.create_task(chat_cog.process_channel_activity(1))
+        await asyncio.sleep(0.02)
+        receive("続きがある")
+        await processing
+
+    asyncio.run(run())
+    assert requests == [["まって", "続きがある"]]
+    assert len(chat_cog.unread_data["1"]) == 0
+    assert chat_cog.bot.get_channel(1).sent == ["返信"]
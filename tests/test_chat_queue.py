@@ -0,0 +1,58 @@
+import asyncio
+
+from utils.unread_log import UnreadLog
+
+def make_blocking_processor(chat_cog, release):
+    """1回目の処理だけ release を待ち、処理のたびに未読をすべて処理済みにする"""
+    runs = []
+
+    async def process_once(channel_id):
+        runs.append([e['content'] for e in chat_cog.unread_data.get(str(channel_id), [])])
+        if len(runs) == 1:
+            await release.wait()
+        unread_log = chat_cog.unread_data.get(str(channel_id))
+        if unread_log and runs[-1]:
+            unread_log.commit(unread_log.entries[len(runs[-1]) - 1]['offset'])
+
+    chat_cog._process_channel_once = process_once
+    return runs
+
+def test_triggers_during_processing_rerun_once(chat_cog):
+    release = asyncio.Event()
+    runs = make_blocking_processor(chat_cog, release)
+    chat_cog.unread_data["1"] = UnreadLog()
+    chat_cog.unread_data["1"].append({"content": "a"})
+
+    async def run():
+        first = asyncio.create_task(chat_cog.process_channel_activity(1))
+        await asyncio.sleep(0)
+        # 処理中に届いた要求は、何回来ても終了後に1回だけまとめて処理する
+        chat_cog.unread_data["1"].append({"content": "b"})
+        await chat_cog.process_channel_activity(1)
+        chat_cog.unread_data["1"].append({"content": "c"})
+        await chat_cog.process_channel_activity(1)
+        assert "1" in chat_cog._rerun_requested
+        release.set()
+        await first
+
+    asyncio.run(run())
+    assert runs == [["a"], ["b", "c"]]
+    assert chat_cog._rerun_requested == set()
+
+def test_rerun_is_skipped_when_nothing_is_left_unread(chat_cog):
+    release = asyncio.Event()
+    runs = make_blocking_processor(chat_cog, release)
+    chat_cog.unread_data["1"] = UnreadLog()
+    chat_cog.unread_data["1"].append({"content": "a"})
+
+    async def run():
+        first = asyncio.create_task(chat_cog.process_channel_activity(1))
+        await asyncio.sleep(0)
+        await chat_cog.process_channel_activity(1)
+        release.set()
+        await first
+
+    asyncio.run(run())
+    # 再実行の要求はあったが、未読が残っていないので自発発言を重ねない
+    assert runs == [["a"]]
+    assert chat_cog._rerun_requested == set()
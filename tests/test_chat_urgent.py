@@ -0,0 +1,117 @@
+import asyncio
+import time
+
+import pytest
+
+from utils.unread_log import UnreadLog
+
+def _use_level(cog, level):
+    cog.weekday_schedule = {str(hour): {"level": level, "action": level} for hour in range(24)}
+    cog.weekend_schedule = cog.weekday_schedule
+    cog.activity_params = {
+        "active": {"seconds": 3600, "sigma": 0, "concurrency": 1, "urgent_latency": 0.05},
+        "inactive": {"seconds": 3600, "sigma": 0, "concurrency": 1, "urgent_latency": 600},
+    }
+    cog.current_activity_level = level
+
+def test_urgent_channel_is_processed_while_another_channel_is_busy(chat_cog):
+    release = asyncio.Event()
+    started = []
+
+    async def process_once(channel_id):
+        started.append(channel_id)
+        if channel_id == 1:
+            await release.wait()
+
+    chat_cog._process_channel_once = process_once
+    chat_cog._next_cycle_at = time.monotonic() + 3600
+    chat_cog.unread_data["2"] = UnreadLog()
+    chat_cog.unread_data["2"].append({"content": "@bot"})
+
+    async def run():
+        busy = chat_cog._start_channel_task(1)
+        await asyncio.sleep(0)
+        loop_tick = asyncio.create_task(chat_cog.activity_loop.coro(chat_cog))
+        await asyncio.sleep(0)
+        chat_cog._wake_for_urgent("2", "mention")
+        # チャンネル1の処理を待たずに、ループはすぐに戻る
+        await asyncio.wait_for(loop_tick, timeout=1)
+        await asyncio.sleep(0)
+        assert started == [1, 2]
+        assert not busy.done()
+        release.set()
+        await busy
+
+    asyncio.run(run())
+    assert chat_cog._urgent_deadlines == {}
+
+def test_scheduled_cycle_starts_tasks_without_waiting_for_them(chat_cog):
+    release = asyncio.Event()
+    started = []
+
+    async def process_once(channel_id):
+        started.append(channel_id)
+        await release.wait()
+
+    chat_cog._process_channel_once = process_once
+    chat_cog._next_cycle_at = time.monotonic()
+    for channel_id in ("1", "2"):
+        chat_cog.unread_data[channel_id] = UnreadLog()
+        chat_cog.unread_data[channel_id].append({"content": "hi"})
+
+    async def run():
+        await asyncio.wait_for(chat_cog.activity_loop.coro(chat_cog), timeout=1)
+        await asyncio.sleep(0)
+        # 同時処理数 (concurrency: 1) の範囲で1チャンネルずつ処理する
+        assert len(started) == 1
+        assert len(chat_cog._channel_tasks) == 2
+        release.set()
+        await asyncio.gather(*chat_cog._channel_tasks)
+
+    asyncio.run(run())
+    assert sorted(started) == [1, 2]
+
+@pytest.mark.parametrize("level, latency", [("active", 0.05), ("inactive", 600)])
+def test_urgent_deadline_follows_activity_level(chat_cog, level, latency):
+    _use_level(chat_cog, level)
+    before = time.monotonic()
+    chat_cog._wake_for_urgent("2", "mention")
+    deadline = chat_cog._urgent_deadlines["2"]
+    assert before + latency <= deadline <= time.monotonic() + latency
+
+    # 二通目の緊急のメッセージで期限が延びることはない
+    chat_cog._wake_for_urgent("2", "dm")
+    assert chat_cog._urgent_deadlines["2"] == deadline
+
+def test_urgent_channel_waits_for_level_latency(chat_cog):
+    started = []
+
+    async def process_once(channel_id):
+        started.append(channel_id)
+
+    chat_cog._process_channel_once = process_once
+    chat_cog._next_cycle_at = time.monotonic() + 3600
+    chat_cog.unread_data["2"] = UnreadLog()
+    chat_cog.unread_data["2"].append({"content": "@bot"})
+
+    async def tick(level):
+        _use_level(chat_cog, level)
+        chat_cog._urgent_deadlines.clear()
+        chat_cog._wake_for_urgent("2", "mention")
+        woke_at = time.monotonic()
+        await asyncio.wait_for(chat_cog.activity_loop.coro(chat_cog), timeout=0.5)
+        await asyncio.gather(*chat_cog._channel_tasks)
+        return time.monotonic() - woke_at
+
+    async def run():
+        # 活動的なレベルでは目標時間 (0.05秒) が過ぎてから処理を始める
+        assert await tick("active") >= 0.05
+        assert started == [2]
+
+        # 休止中のレベルでは期限 (600秒) まで待つので、すぐには処理しない
+        with pytest.raises(asyncio.TimeoutError):
+            await tick("inactive")
+        assert started == [2]
+        assert "2" in chat_cog._urgent_deadlines
+
+    asyncio.run(run())
@@ -0,0 +1,39 @@
+import utils.db_manager as data_manager
+from utils.conversation_archive import ConversationArchive
+
+def turn(text, role="user"):
+    return {"role": role, "parts": [text]}
+
+def test_append_turns_assigns_sequence_numbers_and_skips_empty_turns():
+    archive = ConversationArchive()
+    added = archive.append_turns([turn("ラーメンの話"), turn("  ", "model"), turn("カレーの話", "model")])
+    assert [(e['seq'], e['role'], e['text']) for e in added] == [(1, "user", "ラーメンの話"), (2, "model", "カレーの話")]
+    assert len(archive) == 2
+
+def test_sequence_continues_after_reloading():
+    archive = ConversationArchive([{"seq": 5, "role": "user", "text": "前の話", "archived_at": ""}])
+    assert archive.append_turns([turn("次の話")])[0]['seq'] == 6
+
+def test_recall_returns_relevant_turns_in_order():
+    archive = ConversationArchive()
+    archive.append_turns([turn("週末にラーメンを食べた"), turn("天気の話"), turn("ラーメンは味噌が好き", "model")])
+    recalled = archive.recall("ラーメン", top_k=5, token_budget=1000)
+    assert [e['seq'] for e in recalled] == [1, 3]
+
+def test_recall_respects_top_k_budget_and_max_chars():
+    archive = ConversationArchive()
+    archive.append_turns([turn("ラーメン" + "あ" * 100), turn("ラーメン"), turn("ラーメンとカレー")])
+    assert len(archive.recall("ラーメン", top_k=1, token_budget=1000)) == 1
+    assert all(len(e['text']) < 100 for e in archive.recall("ラーメン", top_k=5, token_budget=50))
+    assert all(len(e['text']) <= 4 for e in archive.recall("ラーメン", top_k=5, token_budget=1000, max_chars=4))
+
+def test_recall_with_empty_query_returns_nothing():
+    archive = ConversationArchive()
+    archive.append_turns([turn("ラーメン")])
+    assert archive.recall("", top_k=5, token_budget=1000) == []
+
+def test_archive_appends_merge_into_one_write(backend):
+    first = data_manager._ArchiveAppendOp("1", [{"seq": 1, "text": "a"}])
+    merged = first.merge(data_manager._ArchiveAppendOp("1", [{"seq": 2, "text": "b"}]))
+    merged.prepare()()
+    assert [e['seq'] for e in backend.load_archives()["1"]] == [1, 2]
@@ -0,0 +1,33 @@
+import utils.db_manager as data_manager
+from utils.history_window import HistoryWindow
+
+def turn(text, role="user"):
+    return {"role": role, "parts": [text]}
+
+def test_history_appends_merge_into_one_write(backend):
+    first = data_manager._HistoryAppendOp("1", [turn("a")])
+    merged = first.merge(data_manager._HistoryAppendOp("1", [turn("b", "model")]))
+    assert merged.entries == [turn("a"), turn("b", "model")]
+    # 元の操作は変更しない
+    assert first.entries == [turn("a")]
+
+    data_manager._data_cache['history'] = {"1": HistoryWindow([turn("a"), turn("b", "model")])}
+    merged.prepare()()
+    assert backend.load_histories() == {"1": [turn("a"), turn("b", "model")]}
+
+def test_history_append_trims_to_the_in_memory_window(backend):
+    backend.replace_history("1", [turn(str(i)) for i in range(4)])
+    data_manager._data_cache['history'] = {"1": HistoryWindow([turn("3"), turn("4")])}
+    data_manager._HistoryAppendOp("1", [turn("4")]).prepare()()
+    assert [m['parts'][0] for m in backend.load_histories()["1"]] == ["3", "4"]
+
+def test_history_append_is_replaced_by_a_full_rewrite(backend):
+    replace = data_manager._HistoryReplaceOp("1")
+    assert data_manager._HistoryAppendOp("1", [turn("a")]).merge(replace) is replace
+
+def test_memory_touches_merge_into_one_write(backend):
+    backend.upsert_memory({"id": 1, "text": "a", "created_at": None, "last_used_at": None})
+    backend.upsert_memory({"id": 2, "text": "b", "created_at": None, "last_used_at": None})
+    op = data_manager._MemoryTouchOp({1: "t1"}).merge(data_manager._MemoryTouchOp({1: "t2", 2: "t2"}))
+    op.prepare()()
+    assert [r['last_used_at'] for r in backend.load_memories()] == ["t2", "t2"]
@@ -0,0 +1,46 @@
+from utils.emotion_lexicon import EmotionLexicon
+
+EMOTION_MAP = {"joy": ["Joy", "喜び"], "anger": ["Anger", "怒り"]}
+
+def make_lexicon(**kwargs):
+    table = {
+        "joy": {"好き": 2, "大好き": 6, "ありがとう": 3},
+        "anger": {"ムカつく": 6, "ありがとう": -4},
+        "unknown": ["無視される"],
+    }
+    return EmotionLexicon(table, EMOTION_MAP, **kwargs)
+
+def test_response_counts_more_than_user_input():
+    lexicon = make_lexicon()
+    assert lexicon.estimate("", "ありがとう") == {"joy": 3, "anger": -4}
+    assert lexicon.estimate("ありがとう", "") == {"joy": 2, "anger": -2}
+
+def test_longer_keywords_take_precedence():
+    assert make_lexicon().estimate("", "大好き") == {"joy": 6}
+
+def test_keyword_lists_use_the_default_weight():
+    lexicon = EmotionLexicon({"joy": ["嬉しい"]}, EMOTION_MAP)
+    assert lexicon.estimate("", "嬉しい") == {"joy": EmotionLexicon.DEFAULT_WEIGHT}
+
+def test_emotions_outside_the_map_are_ignored():
+    lexicon = make_lexicon()
+    assert lexicon.estimate("", "無視される") == {}
+    assert not EmotionLexicon({"unknown": ["無視される"]}, EMOTION_MAP)
+
+def test_deltas_are_clamped_to_max_delta():
+    lexicon = make_lexicon(max_delta=10)
+    assert lexicon.estimate("", "ムカつく" * 5) == {"anger": 10}
+    assert lexicon.estimate("", "ありがとう" * 5)["anger"] == -10
+
+def test_empty_table_estimates_nothing():
+    lexicon = EmotionLexicon({}, EMOTION_MAP)
+    assert not lexicon
+    assert lexicon.estimate("大好き", "大好き") == {}
+
+def test_decay_moves_emotions_back_toward_the_baseline():
+    lexicon = make_lexicon(decay_rate=0.1)
+    deltas = lexicon.decay({"joy": 300, "anger": 50, "calm": 100}, {"joy": 200, "anger": 100, "calm": 100})
+    assert deltas == {"joy": -10, "anger": 5}
+
+def test_decay_without_a_rate_does_nothing():
+    assert make_lexicon().decay({"joy": 300}, {"joy": 200}) == {}
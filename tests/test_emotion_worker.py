@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+
+import utils.config_manager as config
+
+@pytest.fixture
+def emotion_cog(monkeypatch):
+    """AIへの送信を差し替えた EmotionCog を作る (反映した変化量は cog.applied に記録し、DBには書き込まない)"""
+    # cogs.emotion は discord.py と google-generativeai がない環境では import できない
+    pytest.importorskip("discord")
+    pytest.importorskip("google.generativeai")
+    from cogs.emotion import EmotionCog
+    from utils import ai_request_handler
+    import utils.db_manager as data_manager
+
+    monkeypatch.setattr(data_manager, "_data_cache", {'emotion': {
+        "emotion_map": {"joy": "喜び"},
+        "default_emotions": {"joy": 100},
+        "current_emotions": {"joy": 100},
+        "emotion_lexicon": {"joy": ["嬉しい"]},
+    }})
+    monkeypatch.setattr(config, "EMOTION_ESTIMATOR", "llm")
+    cog = EmotionCog(bot=None)
+    cog.prompts = []
+    cog.replies = []
+    cog.applied = []
+
+    async def send_request(model, prompt, channel_id=None, **kwargs):
+        cog.prompts.append(prompt)
+        reply = cog.replies.pop(0) if cog.replies else None
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    monkeypatch.setattr(ai_request_handler, "send_request", send_request)
+    monkeypatch.setattr(cog, "apply_emotion_deltas", cog.applied.append)
+    return cog
+
+async def _until(condition, timeout=1.0):
+    async def poll():
+        while not condition():
+            await asyncio.sleep(0.01)
+    await asyncio.wait_for(poll(), timeout=timeout)
+
+def test_exchanges_within_the_window_are_sent_together(emotion_cog, monkeypatch):
+    monkeypatch.setattr(config, "EMOTION_BATCH_WINDOW_SECONDS", 0.1)
+    emotion_cog.replies.append('[{"joy": 1}, {"joy": 2}, {"joy": 3}]')
+
+    async def run():
+        for i in range(3):
+            emotion_cog.enqueue_update(f"応答{i}", f"発言{i}")
+        await _until(lambda: emotion_cog.applied)
+        emotion_cog.cog_unload()
+
+    asyncio.run(run())
+    assert len(emotion_cog.prompts) == 1
+    assert all(f"応答{i}" in emotion_cog.prompts[0] for i in range(3))
+
+def test_a_full_batch_is_sent_without_waiting_for_the_window(emotion_cog, monkeypatch):
+    monkeypatch.setattr(config, "EMOTION_BATCH_WINDOW_SECONDS", 60.0)
+    monkeypatch.setattr(config, "EMOTION_BATCH_MAX_EXCHANGES", 2)
+
+    async def run():
+        for i in range(3):
+            emotion_cog.enqueue_update(f"応答{i}", f"発言{i}")
+        await _until(lambda: emotion_cog.prompts)
+        emotion_cog.cog_unload()
+
+    asyncio.run(run())
+    # 上限の2件だけを送り、3件目は次のまとまりとして待たせる
+    assert "応答0" in emotion_cog.prompts[0] and "応答1" in emotion_cog.prompts[0]
+    assert "応答2" not in emotion_cog.prompts[0]
+    assert len(emotion_cog._pending_exchanges) == 1
+
+@pytest.mark.parametrize("reply, expected", [
+    ('[{"joy": 1}, {"joy": -2}]', [{"joy": 1}, {"joy": -2}]),
+    ('```json\n[{"joy": 1}, {"joy": -2}]\n```', [{"joy": 1}, {"joy": -2}]),
+    # 配列で返らなかった場合は、1つの変化量としてまとめて反映する
+    ('{"joy": 5}', [{"joy": 5}]),
+    ('[{"joy": 1}, "不正な要素"]', [{"joy": 1}]),
+    ('JSONではない応答', []),
+])
+def test_reply_is_applied_in_order(emotion_cog, monkeypatch, reply, expected):
+    monkeypatch.setattr(config, "EMOTION_BATCH_WINDOW_SECONDS", 0.0)
+    emotion_cog.replies.append(reply)
+    asyncio.run(emotion_cog._analyze_exchanges([("発言0", "応答0"), ("発言1", "応答1")]))
+    assert emotion_cog.applied == expected
+
+def test_worker_keeps_running_after_an_error(emotion_cog, monkeypatch):
+    monkeypatch.setattr(config, "EMOTION_BATCH_WINDOW_SECONDS", 0.0)
+    emotion_cog.replies.extend([RuntimeError("APIエラー"), '{"joy": 1}'])
+
+    async def run():
+        emotion_cog.enqueue_update("応答0", "発言0")
+        await _until(lambda: len(emotion_cog.prompts) == 1)
+        await asyncio.sleep(0.01)
+        task = emotion_cog._analysis_task
+        assert not task.done()
+
+        emotion_cog.enqueue_update("応答1", "発言1")
+        await _until(lambda: emotion_cog.applied)
+        # 同じワーカーが続けて処理する
+        assert emotion_cog._analysis_task is task
+        emotion_cog.cog_unload()
+
+    asyncio.run(run())
+    assert emotion_cog.applied == [{"joy": 1}]
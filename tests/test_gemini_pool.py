@@ -0,0 +1,33 @@
+import asyncio
+
+import pytest
+
+# gemini_pool は google-generativeai がない環境では import できない
+pytest.importorskip("google.generativeai")
+
+from utils.gemini_pool import GeminiClientPool
+
+def get_model(pool, *args, **kwargs):
+    # 非同期クライアントの作成にはイベントループが必要 (Bot の中では常にループ上で呼ばれる)
+    async def run():
+        return pool.get_model(*args, **kwargs)
+    return asyncio.run(run())
+
+def test_cached_content_model_keeps_the_pool_enabled():
+    pool = GeminiClientPool()
+    model = get_model(pool, "key1", "gemini-1.5-flash", cached_content="cachedContents/abc")
+    assert model._cached_content == "cachedContents/abc"
+    assert model._client is pool._clients["key1"][0]
+    assert pool._private_api_available
+
+    # 以降のキャッシュを使わないリクエストもプールのモデルを使い回す
+    plain = get_model(pool, "key1", "gemini-1.5-flash", "あなたはルナツーです。")
+    assert plain is get_model(pool, "key1", "gemini-1.5-flash", "あなたはルナツーです。")
+    assert pool._private_api_available
+
+def test_models_are_reused_per_key():
+    pool = GeminiClientPool()
+    first = get_model(pool, "key1", "gemini-1.5-flash", "指示")
+    second = get_model(pool, "key2", "gemini-1.5-flash", "指示")
+    assert first is not second
+    assert first._client is not second._client
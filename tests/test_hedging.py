@@ -0,0 +1,124 @@
+import asyncio
+import types
+
+import pytest
+
+# ai_request_handler は google-generativeai がない環境では import できない
+pytest.importorskip("google.generativeai")
+
+from utils import ai_request_handler
+from utils.key_scheduler import KeyScheduler
+
+def reply(text):
+    return types.SimpleNamespace(text=text)
+
+@pytest.fixture
+def hedged(monkeypatch):
+    """
+    キーごとの応答時間と結果を決めて _send_hedged を呼ぶ。
+    behaviours: {APIキー: (秒, 応答 or 例外[, 最初のチャンクまでの秒])}
+    stream=True の場合はストリーミングで送り、受信途中の本文を hedged.partials に記録する。
+    """
+    monkeypatch.setattr(ai_request_handler, "_get_hedge_delay", lambda model_name: 0.05)
+    cancelled = []
+    partials = []
+
+    def run(behaviours, cancel_after=None, stream=False):
+        async def send_once(api_key, model_name, history, prompt, channel_id, system_instruction=None,
+                            generation_config=None, on_partial=None):
+            delay, result, *first_chunk_at = behaviours[api_key]
+            try:
+                if first_chunk_at and on_partial is not None:
+                    await asyncio.sleep(first_chunk_at[0])
+                    await on_partial(f"{api_key}の途中")
+                    delay -= first_chunk_at[0]
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                cancelled.append(api_key)
+                raise
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        monkeypatch.setattr(ai_request_handler, "_send_once", send_once)
+        scheduler = run.scheduler = KeyScheduler(["key1", "key2"], {}, {"rpm": 100, "tpm": 100000})
+
+        async def call():
+            lease = await scheduler.acquire("model", 10, exclude={1})
+            on_partial = None
+            if stream:
+                async def on_partial(text):
+                    partials.append(text)
+            task = asyncio.ensure_future(ai_request_handler._send_hedged(
+                scheduler, lease, "model", [], "prompt", None, 10, on_partial=on_partial
+            ))
+            if cancel_after is not None:
+                await asyncio.sleep(cancel_after)
+                task.cancel()
+            try:
+                return await task
+            finally:
+                await asyncio.sleep(0)
+
+        result = asyncio.run(call())
+        in_flight = [scheduler._get_health(i, "model").in_flight for i in (0, 1)]
+        return result, in_flight
+
+    run.cancelled = cancelled
+    run.partials = partials
+    return run
+
+def test_fast_primary_is_not_hedged(hedged):
+    (response, lease), in_flight = hedged({"key1": (0.0, reply("a")), "key2": (0.0, reply("b"))})
+    assert (response.text, lease.index) == ("a", 0)
+    # 採用したリースの報告は呼び出し元が行う
+    assert in_flight == [1, 0]
+
+def test_hedge_wins_and_the_primary_is_cancelled_and_released(hedged):
+    (response, lease), in_flight = hedged({"key1": (5.0, reply("a")), "key2": (0.0, reply("b"))})
+    assert (response.text, lease.index) == ("b", 1)
+    assert hedged.cancelled == ["key1"]
+    assert in_flight == [0, 1]
+
+def test_primary_wins_and_the_hedge_is_cancelled_and_released(hedged):
+    (response, lease), in_flight = hedged({"key1": (0.1, reply("a")), "key2": (5.0, reply("b"))})
+    assert (response.text, lease.index) == ("a", 0)
+    assert hedged.cancelled == ["key2"]
+    assert in_flight == [1, 0]
+
+def test_failed_hedge_is_reported_and_the_primary_is_used(hedged):
+    (response, lease), in_flight = hedged({"key1": (0.1, reply("a")), "key2": (0.0, RuntimeError("boom"))})
+    assert (response.text, lease.index) == ("a", 0)
+    assert in_flight == [1, 0]
+
+def test_primary_error_is_raised_when_both_fail(hedged):
+    with pytest.raises(RuntimeError, match="primary"):
+        hedged({"key1": (0.1, RuntimeError("primary")), "key2": (0.0, RuntimeError("hedge"))})
+
+def test_cancelling_the_caller_cancels_both_requests_and_releases_the_hedge(hedged):
+    with pytest.raises(asyncio.CancelledError):
+        hedged({"key1": (5.0, reply("a")), "key2": (5.0, reply("b"))}, cancel_after=0.1)
+    assert sorted(hedged.cancelled) == ["key1", "key2"]
+    # プライマリのリースは呼び出し元が返却する
+    assert [hedged.scheduler._get_health(i, "model").in_flight for i in (0, 1)] == [1, 0]
+
+def test_streaming_primary_is_not_hedged_once_it_starts_showing(hedged):
+    (response, lease), in_flight = hedged({"key1": (0.2, reply("a"), 0.01), "key2": (0.0, reply("b"))}, stream=True)
+    assert (response.text, lease.index) == ("a", 0)
+    assert hedged.partials == ["key1の途中"]
+    assert in_flight == [1, 0]
+
+def test_streaming_primary_is_hedged_until_the_first_chunk(hedged):
+    # 最初のチャンクが来る前はヘッジし、ヘッジ側が先に返れば途中経過なしで採用する
+    (response, lease), in_flight = hedged({"key1": (5.0, reply("a"), 4.0), "key2": (0.0, reply("b"))}, stream=True)
+    assert (response.text, lease.index) == ("b", 1)
+    assert hedged.cancelled == ["key1"]
+    assert hedged.partials == []
+    assert in_flight == [0, 1]
+
+def test_hedge_is_cancelled_when_the_streaming_primary_starts_showing(hedged):
+    (response, lease), in_flight = hedged({"key1": (0.3, reply("a"), 0.1), "key2": (5.0, reply("b"))}, stream=True)
+    assert (response.text, lease.index) == ("a", 0)
+    assert hedged.cancelled == ["key2"]
+    assert hedged.partials == ["key1の途中"]
+    assert in_flight == [1, 0]
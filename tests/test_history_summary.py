@@ -0,0 +1,20 @@
+from utils.history_window import HistoryWindow, SUMMARY_ACK, SUMMARY_HEADER
+from utils.token_estimator import estimate_message_tokens
+
+def turn(text, role="user"):
+    return {"role": role, "parts": [text]}
+
+def test_summary_is_pinned_with_a_model_reply():
+    window = HistoryWindow([turn("こんにちは")])
+    window.set_summary("以前の話")
+    view = window.view(10_000)
+    assert view[0] == turn(SUMMARY_HEADER + "以前の話")
+    assert view[1] == turn(SUMMARY_ACK, "model")
+    assert view[2] == turn("こんにちは")
+    # 要約は保存されるターンには含まない
+    assert list(window) == [turn("こんにちは")]
+    assert window.total_tokens == sum(estimate_message_tokens(t) for t in view)
+
+def test_summary_is_not_pinned_until_it_is_set():
+    window = HistoryWindow([turn("こんにちは")])
+    assert window.view(10_000) == [turn("こんにちは")]
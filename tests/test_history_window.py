@@ -0,0 +1,42 @@
+import utils.config_manager as config
+from utils.history_window import HistoryWindow
+from utils.token_estimator import estimate_message_tokens
+
+def turn(text, role="user"):
+    return {"role": role, "parts": [text]}
+
+def conversation(count):
+    return [turn(f"発言{i}" * 10, "user" if i % 2 == 0 else "model") for i in range(count)]
+
+def test_tracks_total_tokens():
+    messages = conversation(4)
+    window = HistoryWindow(messages)
+    assert window.total_tokens == sum(estimate_message_tokens(m) for m in messages)
+    window.evict_oldest()
+    assert window.total_tokens == sum(estimate_message_tokens(m) for m in messages[1:])
+
+def test_behaves_like_a_list():
+    messages = conversation(3)
+    window = HistoryWindow(messages)
+    assert len(window) == 3
+    assert list(window) == messages
+    assert window[-1] == messages[-1]
+    assert window[1:] == messages[1:]
+
+def test_enforce_budget_keeps_the_newest_turns():
+    window = HistoryWindow(conversation(4))
+    window.enforce_budget(0, keep_turns=2)
+    assert len(window) == 2
+
+def test_view_cuts_to_the_budget_without_evicting():
+    messages = conversation(6)
+    window = HistoryWindow(messages)
+    budget = sum(estimate_message_tokens(m) for m in messages[-3:])
+    view = window.view(budget)
+    assert view == messages[-2:]
+    assert len(window) == 6
+
+def test_each_model_has_its_own_token_budget():
+    assert config.get_history_token_budget(config.MODEL_PRO_3) == config.HISTORY_TOKEN_BUDGETS[config.MODEL_PRO_3]
+    assert config.get_history_token_budget("unknown-model") == config.DEFAULT_HISTORY_TOKEN_BUDGET
+    assert config.get_history_token_budget() == config.HISTORY_TOKEN_BUDGETS[config.MODEL_PRO]
@@ -0,0 +1,90 @@
+import asyncio
+import types
+
+import pytest
+
+import utils.key_scheduler as key_scheduler
+from utils.key_scheduler import KeyScheduler, TokenBucket
+
+LIMITS = {"model": {"rpm": 2, "tpm": 1000}}
+
+@pytest.fixture
+def clock(monkeypatch):
+    """スケジューラが使う時計を、テストから進められる偽物に差し替える"""
+    fake = types.SimpleNamespace(now=1000.0)
+    fake.monotonic = lambda: fake.now
+    monkeypatch.setattr(key_scheduler, "time", fake)
+    return fake
+
+def make_scheduler(keys=("key1", "key2")):
+    return KeyScheduler(list(keys), LIMITS, {"rpm": 10, "tpm": 1000})
+
+def acquire(scheduler, **kwargs):
+    kwargs.setdefault("max_wait", 0)
+    return asyncio.run(scheduler.acquire("model", 10, **kwargs))
+
+def test_bucket_refills_over_a_minute(clock):
+    bucket = TokenBucket(60)
+    bucket.consume(60, clock.now)
+    assert bucket.wait_time(1, clock.now) == pytest.approx(1.0)
+    assert bucket.wait_time(1, clock.now + 1) == 0.0
+    # 容量を超えては貯まらない
+    assert bucket.wait_time(60, clock.now + 3600) == 0.0
+    assert bucket.tokens == 60
+
+def test_overspent_bucket_delays_the_refill(clock):
+    bucket = TokenBucket(60)
+    bucket.consume(90, clock.now)
+    assert bucket.wait_time(1, clock.now) == pytest.approx(31.0)
+
+def test_leases_are_spread_across_keys(clock):
+    scheduler = make_scheduler()
+    first = acquire(scheduler)
+    second = acquire(scheduler)
+    # 1本目を使用中のキーより、空いているキーを選ぶ
+    assert {first.index, second.index} == {0, 1}
+
+def test_exhausted_keys_return_none_without_waiting(clock):
+    scheduler = make_scheduler(["key1"])
+    assert acquire(scheduler) is not None
+    assert acquire(scheduler) is not None
+    assert acquire(scheduler) is None
+    clock.now += 30
+    assert acquire(scheduler) is not None
+
+def test_excluded_key_is_used_only_when_it_is_the_only_key(clock):
+    assert acquire(make_scheduler(), exclude={0}).index == 1
+    assert acquire(make_scheduler(["key1"]), exclude={0}).index == 0
+
+def test_rate_limited_key_cools_down(clock):
+    scheduler = make_scheduler()
+    lease = acquire(scheduler, exclude={1})
+    scheduler.report_rate_limited(lease, retry_after=30)
+    assert acquire(scheduler).index == 1
+    assert acquire(scheduler).index == 1
+    # キー1は休止中、キー2は上限に達している
+    assert acquire(scheduler) is None
+    assert scheduler.pressure("model") == 1.0
+
+    clock.now += 31
+    assert acquire(scheduler, exclude={1}).index == 0
+
+def test_errors_lower_the_key_health(clock):
+    scheduler = make_scheduler()
+    lease = acquire(scheduler, exclude={1})
+    scheduler.report_error(lease)
+    assert acquire(scheduler).index == 1
+
+def test_release_returns_the_key_without_scoring_it(clock):
+    scheduler = make_scheduler()
+    lease = acquire(scheduler, exclude={1})
+    scheduler.release(lease)
+    health = scheduler._get_health(0, "model")
+    assert (health.in_flight, health.total_errors, health.latency) == (0, 0, None)
+
+def test_success_corrects_the_token_estimate(clock):
+    scheduler = make_scheduler(["key1"])
+    lease = acquire(scheduler)
+    scheduler.report_success(lease, used_tokens=1010)
+    # 見積もり (10) との差の 1000 トークンを追加で消費したので、TPM が空くまで待つ
+    assert acquire(scheduler) is None
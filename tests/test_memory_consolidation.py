@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+import utils.config_manager as config
+from utils.memory_index import differing_numbers, jaccard, mutual_containment
+
+@pytest.fixture
+def llm(monkeypatch):
+    """軽量モデルへの送信を差し替え、プロンプトの先頭に応じた応答を返す"""
+    from utils import ai_request_handler
+    replies = {}
+
+    async def send_request(model, prompt, channel_id=None, **kwargs):
+        for marker, reply in replies.items():
+            if marker in prompt:
+                return reply
+        return None
+
+    monkeypatch.setattr(ai_request_handler, "send_request", send_request)
+    monkeypatch.setattr(ai_request_handler, "get_rate_limit_pressure", lambda model: 0.0)
+    return replies
+
+def test_duplicates_are_merged_into_the_newest_id(make_memory_cog, llm):
+    cog = make_memory_cog(["ユーザーは猫を飼っている", "明日は雨の予報", "ユーザーは猫を飼っている"])
+    asyncio.run(cog.consolidate_memories())
+    assert list(cog.memories) == [2, 3]
+    assert cog.memories[3]['created_at'] == "2024-01-01T00:00:00"
+    assert cog.deleted == [1]
+    assert cog.consolidation_stats["merged"] == 1
+
+def test_superseded_memory_is_removed_when_the_model_confirms(make_memory_cog, llm, monkeypatch):
+    monkeypatch.setattr(config, "MEMORY_CONSOLIDATION_SUPERSEDE_ENABLED", True)
+    llm["更新・訂正"] = "はい"
+    cog = make_memory_cog(["ユーザーは東京に住んでいる", "ユーザーは大阪に住んでいる"])
+    asyncio.run(cog.consolidate_memories())
+    assert [r['text'] for r in cog.memories.values()] == ["ユーザーは大阪に住んでいる"]
+    assert cog.consolidation_stats["superseded"] == 1
+
+def test_superseded_memory_is_only_logged_by_default(make_memory_cog, llm, capsys):
+    llm["更新・訂正"] = "はい"
+    cog = make_memory_cog(["ユーザーは東京に住んでいる", "ユーザーは大阪に住んでいる"])
+    asyncio.run(cog.consolidate_memories())
+    assert len(cog.memories) == 2
+    assert cog.deleted == []
+    out = capsys.readouterr().out
+    assert "ユーザーは東京に住んでいる" in out and "ユーザーは大阪に住んでいる" in out
+
+def test_similar_facts_are_kept_when_the_model_disagrees(make_memory_cog, llm):
+    llm["更新・訂正"] = "いいえ"
+    cog = make_memory_cog(["ユーザーは猫が好き", "ユーザーは犬が好き"])
+    asyncio.run(cog.consolidate_memories())
+    assert len(cog.memories) == 2
+    assert cog.deleted == []
+
+def test_superseded_memory_is_kept_without_the_model(make_memory_cog, llm, monkeypatch):
+    monkeypatch.setattr(config, "MEMORY_CONSOLIDATION_SUPERSEDE_ENABLED", True)
+    monkeypatch.setattr(config, "MEMORY_CONSOLIDATION_USE_LLM", False)
+    llm["更新・訂正"] = "はい"
+    cog = make_memory_cog(["ユーザーは東京に住んでいる", "ユーザーは大阪に住んでいる"])
+    asyncio.run(cog.consolidate_memories())
+    assert len(cog.memories) == 2
+
+def test_dry_run_leaves_memories_unchanged(make_memory_cog, llm, monkeypatch):
+    monkeypatch.setattr(config, "MEMORY_CONSOLIDATION_DRY_RUN", True)
+    monkeypatch.setattr(config, "MEMORY_CONSOLIDATION_SUPERSEDE_ENABLED", True)
+    llm["更新・訂正"] = "はい"
+    cog = make_memory_cog(["ユーザーは猫を飼っている", "ユーザーは猫を飼っている", "ユーザーは東京に住んでいる", "ユーザーは大阪に住んでいる"])
+    assert asyncio.run(cog.consolidate_memories()) == 0
+    assert len(cog.memories) == 4
+    assert cog.deleted == cog.saved == []
+
+def test_tokens_saved_is_measured_against_the_top_k_selection(make_memory_cog, llm, monkeypatch):
+    # プロンプトに入るのは1件だけなので、重複を消しても1回あたりの記憶の量は変わらない
+    monkeypatch.setattr(config, "MEMORY_PROMPT_TOP_K", 1)
+    cog = make_memory_cog(["ユーザーは猫を飼っている"] * 3)
+    assert asyncio.run(cog.consolidate_memories()) == 0
+    assert len(cog.memories) == 1
+
+    monkeypatch.setattr(config, "MEMORY_PROMPT_TOP_K", 8)
+    cog = make_memory_cog(["ユーザーは猫を飼っている"] * 3)
+    saved = asyncio.run(cog.consolidate_memories())
+    assert saved > 0
+    assert cog.consolidation_stats["tokens_saved"] == saved
+
+def test_similarity_helpers():
+    assert jaccard("猫が好き", "猫が好き") == 1.0
+    assert mutual_containment("猫が好き", "犬が好き") < 0.95
+    assert differing_numbers("誕生日は5月3日", "誕生日は8月3日")
+    assert not differing_numbers("誕生日は5月3日", "誕生日は5月3日です")
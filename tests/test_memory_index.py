@@ -0,0 +1,33 @@
+from utils.memory_index import MemoryIndex, tokenize
+
+def test_tokenize_splits_japanese_into_bigrams_and_keeps_words():
+    assert tokenize("猫が好き Python") == ["猫が", "が好", "好き", "python"]
+
+def test_search_ranks_the_relevant_memory_first():
+    index = MemoryIndex()
+    index.add(1, "ユーザーは猫を飼っている")
+    index.add(2, "ユーザーはラーメンが好き")
+    index.add(3, "明日は雨の予報")
+    assert index.search("ラーメン食べたい", 1)[0][0] == 2
+
+def test_removed_memories_are_not_returned():
+    index = MemoryIndex()
+    index.add(1, "ラーメンが好き")
+    index.add(2, "ラーメンは醤油派")
+    index.remove(1)
+    assert [doc_id for doc_id, _ in index.search("ラーメン")] == [2]
+    assert len(index) == 1
+
+def test_re_adding_replaces_the_text():
+    index = MemoryIndex()
+    index.add(1, "ラーメンが好き")
+    index.add(1, "カレーが好き")
+    assert index.search("ラーメン") == []
+    assert index.search("カレー")[0][0] == 1
+
+def test_embeddings_are_blended_with_bm25():
+    vectors = {"犬の話": [1.0, 0.0], "猫の話": [0.0, 1.0], "ペット": [0.0, 1.0]}
+    index = MemoryIndex(embed_fn=vectors.get, embedding_weight=1.0)
+    index.add(1, "犬の話")
+    index.add(2, "猫の話")
+    assert index.search("ペット", 1)[0][0] == 2
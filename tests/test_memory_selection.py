@@ -0,0 +1,22 @@
+import pytest
+
+@pytest.fixture
+def memory_cog(make_memory_cog):
+    return make_memory_cog(["ユーザーは猫を飼っている", "ユーザーはラーメンが好き", "明日は雨の予報"])
+
+def test_only_relevant_memories_are_selected(memory_cog):
+    assert memory_cog.select_memories("ラーメン食べたい", top_k=3) == ["ユーザーはラーメンが好き"]
+
+def test_nothing_is_selected_when_no_memory_is_relevant(memory_cog):
+    assert memory_cog.select_memories("こんにちは", top_k=3) == []
+
+def test_recent_memories_are_used_without_a_query(memory_cog):
+    assert memory_cog.select_memories("", top_k=2) == ["明日は雨の予報", "ユーザーはラーメンが好き"]
+
+def test_token_budget_limits_the_selection(memory_cog):
+    assert memory_cog.select_memories("", token_budget=1, top_k=3) == []
+
+def test_last_used_is_written_once_per_selection(memory_cog):
+    memory_cog.select_memories("", top_k=3)
+    assert memory_cog.touched == [[3, 2, 1]]
+    assert all(r['last_used_at'] for r in memory_cog.memories.values())
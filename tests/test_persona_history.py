@@ -0,0 +1,32 @@
+from utils.history_window import HistoryWindow
+from utils.storage.base import strip_legacy_persona
+from utils.token_estimator import estimate_message_tokens
+
+def turn(text, role="user"):
+    return {"role": role, "parts": [text]}
+
+def conversation(count):
+    return [turn(f"発言{i}" * 10, "user" if i % 2 == 0 else "model") for i in range(count)]
+
+def test_legacy_persona_turn_is_stripped():
+    messages = [turn("ペルソナ"), turn("了解", "model"), turn("こんにちは")]
+    assert strip_legacy_persona(messages) == messages[1:]
+
+def test_history_without_a_persona_turn_is_kept():
+    messages = [turn("了解", "model"), turn("こんにちは")]
+    assert strip_legacy_persona(messages) == messages
+
+def test_enforce_budget_keeps_the_window_on_a_user_turn():
+    messages = conversation(6)
+    window = HistoryWindow(messages)
+    budget = sum(estimate_message_tokens(m) for m in messages[3:])
+
+    evicted = window.enforce_budget(budget)
+    assert window[0]['role'] == "user"
+    assert window.total_tokens <= budget
+    assert evicted + list(window) == messages
+
+def test_view_does_not_start_on_a_model_turn():
+    messages = [turn("m0", "model")] + conversation(4)
+    window = HistoryWindow(messages)
+    assert window.view(10_000) == messages[1:]
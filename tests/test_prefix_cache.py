@@ -0,0 +1,122 @@
+import asyncio
+
+from utils.prefix_cache import LocalPrefixCache
+
+INSTRUCTION = "あなたはルナツーです。" * 20
+
+def make_cache(**overrides):
+    options = {"ttl": 3600, "refresh_margin": 60, "min_tokens": 10, "retry_seconds": 300}
+    options.update(overrides)
+    cache = LocalPrefixCache(**options)
+    cache.evicted = []
+    cache.on_evict = cache.evicted.append
+    return cache
+
+def test_acquire_registers_once_and_then_hits():
+    cache = make_cache()
+
+    async def run():
+        first = await cache.acquire("key1", "model", INSTRUCTION)
+        second = await cache.acquire("key1", "model", INSTRUCTION)
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first is second
+    assert first.remote is False
+    assert cache.stats()["created"] == 1
+    assert cache.stats()["hits"] == 1
+
+def test_prefixes_are_registered_per_key():
+    cache = make_cache()
+
+    async def run():
+        return (await cache.acquire("key1", "model", INSTRUCTION),
+                await cache.acquire("key2", "model", INSTRUCTION))
+
+    first, second = asyncio.run(run())
+    assert first is not second
+    assert cache.stats()["entries"] == 2
+
+def test_concurrent_acquires_share_one_registration():
+    cache = make_cache()
+
+    async def run():
+        return await asyncio.gather(*(cache.acquire("key1", "model", INSTRUCTION) for _ in range(5)))
+
+    entries = asyncio.run(run())
+    assert all(entry is entries[0] for entry in entries)
+    assert cache.created == 1
+
+def test_short_instruction_is_bypassed():
+    cache = make_cache(min_tokens=10_000)
+
+    async def run():
+        return await cache.acquire("key1", "model", INSTRUCTION)
+
+    assert asyncio.run(run()) is None
+    assert cache.bypassed == 1
+    assert cache.created == 0
+
+def test_entry_near_expiry_is_replaced_and_evicted():
+    # 期限より余裕 (refresh_margin) の方が長いので、毎回作り直される
+    cache = make_cache(ttl=10, refresh_margin=60)
+
+    async def run():
+        first = await cache.acquire("key1", "model", INSTRUCTION)
+        second = await cache.acquire("key1", "model", INSTRUCTION)
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first is not second
+    assert cache.evicted == [first]
+    assert cache.stats()["entries"] == 1
+
+def test_updated_instruction_evicts_the_stale_prefix():
+    cache = make_cache()
+
+    async def run():
+        old = await cache.acquire("key1", "model", INSTRUCTION)
+        new = await cache.acquire("key1", "model", INSTRUCTION + "追記")
+        return old, new
+
+    old, new = asyncio.run(run())
+    assert old.digest != new.digest
+    assert cache.evicted == [old]
+    assert cache.stats()["entries"] == 1
+
+def test_discard_forces_a_new_registration():
+    cache = make_cache()
+
+    async def run():
+        first = await cache.acquire("key1", "model", INSTRUCTION)
+        cache.discard(first)
+        second = await cache.acquire("key1", "model", INSTRUCTION)
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert cache.evicted == [first]
+    assert second is not first
+    assert cache.created == 2
+
+def test_invalidate_evicts_everything():
+    cache = make_cache()
+
+    async def run():
+        entries = [await cache.acquire(key, "model", INSTRUCTION) for key in ("key1", "key2")]
+        cache.invalidate()
+        return entries
+
+    entries = asyncio.run(run())
+    assert cache.evicted == entries
+    assert cache.stats()["entries"] == 0
+
+def test_saved_tokens_use_the_reported_count_when_available():
+    cache = make_cache()
+
+    async def run():
+        return await cache.acquire("key1", "model", INSTRUCTION)
+
+    prefix = asyncio.run(run())
+    cache.record_saved(prefix)
+    cache.record_saved(prefix, cached_tokens=7)
+    assert cache.tokens_saved == prefix.tokens + 7
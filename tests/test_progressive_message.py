@@ -0,0 +1,104 @@
+import asyncio
+import types
+
+import pytest
+
+class FakeMessage:
+    def __init__(self, channel, content):
+        self.channel = channel
+        self.content = content
+
+    async def edit(self, content):
+        self.channel.edits.append(content)
+        self.content = content
+
+    async def delete(self):
+        self.channel.deleted.append(self.content)
+
+class FakeChannel:
+    def __init__(self):
+        self.sent = []
+        self.edits = []
+        self.deleted = []
+
+    async def send(self, content):
+        self.sent.append(content)
+        return FakeMessage(self, content)
+
+@pytest.fixture
+def clock(monkeypatch):
+    # cogs.chat は discord.py と google-generativeai がない環境では import できない
+    pytest.importorskip("discord")
+    pytest.importorskip("google.generativeai")
+    import cogs.chat as chat
+    fake = types.SimpleNamespace(now=0.0)
+    fake.monotonic = lambda: fake.now
+    monkeypatch.setattr(chat, "time", fake)
+    return fake
+
+def make_stream(interval=1.5, first_chunk_max_chars=20):
+    from cogs.chat import ProgressiveMessage
+    channel = FakeChannel()
+    return ProgressiveMessage(channel, interval, first_chunk_max_chars), channel
+
+def test_first_post_waits_for_a_sentence_boundary(clock):
+    stream, channel = make_stream()
+    asyncio.run(stream.update("こんにち"))
+    assert channel.sent == []
+    clock.now = 0.4
+    asyncio.run(stream.update("こんにちは。今日は"))
+    assert channel.sent == ["こんにちは。"]
+    assert stream.time_to_first_text == pytest.approx(0.4)
+
+def test_long_text_without_a_boundary_is_shown_after_the_limit(clock):
+    stream, channel = make_stream(first_chunk_max_chars=5)
+    asyncio.run(stream.update("あいうえおかきくけこ"))
+    assert channel.sent == ["あいうえおかきくけこ"]
+
+def test_edits_are_throttled_to_the_interval(clock):
+    stream, channel = make_stream()
+
+    async def run():
+        await stream.update("一文目。")
+        clock.now = 1.0
+        await stream.update("一文目。二文目。")
+        clock.now = 1.6
+        await stream.update("一文目。二文目。三文目。")
+
+    asyncio.run(run())
+    assert channel.sent == ["一文目。"]
+    assert channel.edits == ["一文目。二文目。三文目。"]
+
+def test_unchanged_text_is_not_edited(clock):
+    stream, channel = make_stream()
+
+    async def run():
+        await stream.update("一文目。")
+        clock.now = 2.0
+        await stream.update("一文目。途中")
+
+    asyncio.run(run())
+    assert channel.edits == []
+
+def test_finish_renders_immediately_and_splits_long_replies(clock):
+    stream, channel = make_stream()
+    text = "あ" * 1500 + "\n" + "い" * 1000
+
+    async def run():
+        await stream.update("あ。")
+        await stream.finish(text)
+
+    asyncio.run(run())
+    assert channel.edits == ["あ" * 1500]
+    assert channel.sent == ["あ。", "い" * 1000]
+
+def test_abort_deletes_the_partial_messages(clock):
+    stream, channel = make_stream()
+
+    async def run():
+        await stream.update("一文目。")
+        await stream.abort()
+
+    asyncio.run(run())
+    assert channel.deleted == ["一文目。"]
+    assert stream.messages == []
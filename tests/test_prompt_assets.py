@@ -0,0 +1,94 @@
+import os
+
+import pytest
+
+from utils import prompt_assets
+
+@pytest.fixture
+def clock(monkeypatch):
+    """prompt_assets が見る time.monotonic を手で進められるようにし、キャッシュを空にする"""
+    now = [1000.0]
+    monkeypatch.setattr(prompt_assets.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(prompt_assets, "_cache", {})
+
+    def advance(seconds):
+        now[0] += seconds
+
+    return advance
+
+def rewrite(path, text, mtime_ns):
+    path.write_text(text, encoding="utf-8")
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+def test_unchanged_file_is_served_from_the_cache(tmp_path, clock, monkeypatch):
+    path = tmp_path / "persona.txt"
+    rewrite(path, "ペルソナ", 1_000_000_000)
+    assert prompt_assets.read_text(str(path)) == "ペルソナ"
+
+    # 確認の間隔が過ぎても、更新時刻とサイズが同じならファイルを開かない
+    monkeypatch.setattr("builtins.open", lambda *args, **kwargs: pytest.fail("ファイルを読み直しました"))
+    clock(prompt_assets.CHECK_INTERVAL_SECONDS * 2)
+    assert prompt_assets.read_text(str(path)) == "ペルソナ"
+
+@pytest.mark.parametrize("text, mtime_ns", [
+    # 更新時刻だけが変わった場合
+    ("ペルソナ", 2_000_000_000),
+    # サイズだけが変わった場合
+    ("新しいペルソナ", 1_000_000_000),
+])
+def test_changed_file_is_read_again(tmp_path, clock, text, mtime_ns):
+    path = tmp_path / "persona.txt"
+    rewrite(path, "ペルソナ", 1_000_000_000)
+    prompt_assets.read_text(str(path))
+
+    rewrite(path, text, mtime_ns)
+    clock(prompt_assets.CHECK_INTERVAL_SECONDS)
+    assert prompt_assets.read_text(str(path)) == text
+    assert prompt_assets._cache[str(path)][:2] == (mtime_ns, len(text.encode("utf-8")))
+
+def test_file_is_not_checked_within_the_interval(tmp_path, clock):
+    path = tmp_path / "persona.txt"
+    rewrite(path, "ペルソナ", 1_000_000_000)
+    prompt_assets.read_text(str(path))
+
+    rewrite(path, "新しいペルソナ", 2_000_000_000)
+    clock(prompt_assets.CHECK_INTERVAL_SECONDS - 0.1)
+    assert prompt_assets.read_text(str(path)) == "ペルソナ"
+    clock(0.1)
+    assert prompt_assets.read_text(str(path)) == "新しいペルソナ"
+
+def test_confirming_an_unchanged_file_restarts_the_interval(tmp_path, clock):
+    path = tmp_path / "persona.txt"
+    rewrite(path, "ペルソナ", 1_000_000_000)
+    prompt_assets.read_text(str(path))
+    clock(prompt_assets.CHECK_INTERVAL_SECONDS)
+    prompt_assets.read_text(str(path))
+
+    rewrite(path, "新しいペルソナ", 2_000_000_000)
+    clock(prompt_assets.CHECK_INTERVAL_SECONDS - 0.1)
+    assert prompt_assets.read_text(str(path)) == "ペルソナ"
+
+def test_missing_file_returns_none_and_drops_the_cache(tmp_path, clock):
+    path = tmp_path / "persona.txt"
+    rewrite(path, "ペルソナ", 1_000_000_000)
+    prompt_assets.read_text(str(path))
+
+    path.unlink()
+    clock(prompt_assets.CHECK_INTERVAL_SECONDS)
+    assert prompt_assets.read_text(str(path)) is None
+    assert str(path) not in prompt_assets._cache
+
+@pytest.mark.parametrize("target", ["persona.txt", None])
+def test_invalidate_forces_a_read_within_the_interval(tmp_path, clock, target):
+    path = tmp_path / "persona.txt"
+    other = tmp_path / "other.txt"
+    rewrite(path, "ペルソナ", 1_000_000_000)
+    rewrite(other, "別のファイル", 1_000_000_000)
+    prompt_assets.read_text(str(path))
+    prompt_assets.read_text(str(other))
+
+    rewrite(path, "新しいペルソナ", 1_000_000_000)
+    prompt_assets.invalidate(str(tmp_path / target) if target else None)
+    assert prompt_assets.read_text(str(path)) == "新しいペルソナ"
+    # 全ファイル分を破棄した場合だけ、他のファイルのキャッシュも消える
+    assert (str(other) in prompt_assets._cache) == (target is not None)
@@ -0,0 +1,12 @@
+from utils.prompt_builder import format_unread_messages
+
+MESSAGES = [
+    {"author": "a", "timestamp": "10時00分", "content": "こんにちは"},
+    {"content": "名前なし"},
+]
+
+def test_unread_messages_are_formatted_with_timestamps():
+    assert format_unread_messages(MESSAGES) == "[a @ 10時00分]: こんにちは\n[Unknown @ ]: 名前なし"
+
+def test_unread_messages_are_formatted_without_timestamps():
+    assert format_unread_messages(MESSAGES, with_timestamp=False) == "[a]: こんにちは\n[Unknown]: 名前なし"
@@ -0,0 +1,125 @@
+import json
+
+from utils.storage.sqlite_backend import SQLiteBackend
+
+def open_backend(tmp_path, seed_files=None):
+    backend = SQLiteBackend(str(tmp_path / "storage.sqlite3"), seed_files)
+    backend.connect()
+    return backend
+
+def test_legacy_memory_list_is_migrated_to_records(tmp_path):
+    backend = open_backend(tmp_path)
+    backend.save('memory', ["猫が好き", "誕生日は5月3日", 123])
+    backend.close()
+
+    backend = open_backend(tmp_path)
+    records = backend.load_memories()
+    assert [(r['id'], r['text']) for r in records] == [(1, "猫が好き"), (2, "誕生日は5月3日")]
+    assert all(r['created_at'] and r['last_used_at'] is None for r in records)
+    assert backend.load('memory') is None
+    backend.close()
+
+def test_memory_migration_does_not_overwrite_existing_records(tmp_path):
+    backend = open_backend(tmp_path)
+    backend.upsert_memory({"id": 1, "text": "新しい記憶", "created_at": "2024-01-01T00:00:00", "last_used_at": None})
+    backend.save('memory', ["古い記憶", "古い記憶2"])
+    backend.close()
+
+    backend = open_backend(tmp_path)
+    assert [r['text'] for r in backend.load_memories()] == ["新しい記憶", "古い記憶2"]
+    backend.close()
+
+def test_legacy_unread_dict_is_migrated_to_the_log(tmp_path):
+    backend = open_backend(tmp_path)
+    backend.save('unread', {123: [{"author": "a", "content": "x"}, {"author": "b", "content": "y"}], "456": []})
+    backend.close()
+
+    backend = open_backend(tmp_path)
+    unread = backend.load_unread()
+    assert [(e['offset'], e['content']) for e in unread["123"]] == [(1, "x"), (2, "y")]
+    assert "456" not in unread
+    assert backend.load_unread_cursors() == {}
+    assert backend.load('unread') is None
+    backend.close()
+
+def test_seed_from_json_strips_the_legacy_persona_turn(tmp_path):
+    history_file = tmp_path / "history.json"
+    history_file.write_text(json.dumps({"1": [
+        {"role": "user", "parts": ["ペルソナ"]},
+        {"role": "model", "parts": ["了解"]},
+        {"role": "user", "parts": ["こんにちは"]},
+    ]}), encoding='utf-8')
+    setting_file = tmp_path / "setting.json"
+    setting_file.write_text(json.dumps({"config": {"default_channel": 1}}), encoding='utf-8')
+
+    backend = open_backend(tmp_path, {'history': str(history_file), 'setting': str(setting_file),
+                                      'emotion': str(tmp_path / "missing.json")})
+    assert backend.load_histories() == {"1": [{"role": "model", "parts": ["了解"]}, {"role": "user", "parts": ["こんにちは"]}]}
+    assert backend.load('setting') == {"config": {"default_channel": 1}}
+    assert backend.load('emotion') is None
+    backend.close()
+
+def test_seed_is_skipped_when_the_database_has_data(tmp_path):
+    setting_file = tmp_path / "setting.json"
+    setting_file.write_text(json.dumps({"seeded": True}), encoding='utf-8')
+    backend = open_backend(tmp_path)
+    backend.save('setting', {"seeded": False})
+    backend.close()
+
+    backend = open_backend(tmp_path, {'setting': str(setting_file)})
+    assert backend.load('setting') == {"seeded": False}
+    backend.close()
+
+def test_append_history_keeps_only_the_newest_turns(tmp_path):
+    backend = open_backend(tmp_path)
+    backend.replace_history("1", [{"role": "user", "parts": [str(i)]} for i in range(3)])
+    backend.append_history("1", [{"role": "user", "parts": ["3"]}, {"role": "user", "parts": ["4"]}], keep=3)
+    assert [m['parts'][0] for m in backend.load_histories()["1"]] == ["2", "3", "4"]
+    backend.close()
+
+def test_commit_unread_removes_entries_and_never_moves_the_cursor_back(tmp_path):
+    backend = open_backend(tmp_path)
+    backend.append_unread("1", [{"offset": i, "content": str(i)} for i in (1, 2, 3)])
+    backend.commit_unread("1", 2)
+    backend.commit_unread("1", 1)
+    assert [e['offset'] for e in backend.load_unread()["1"]] == [3]
+    assert backend.load_unread_cursors() == {"1": 2}
+    backend.close()
+
+def test_archive_append_ignores_duplicate_seq(tmp_path):
+    backend = open_backend(tmp_path)
+    backend.append_archive("1", [{"seq": 1, "text": "a"}, {"seq": 2, "text": "b"}])
+    backend.append_archive("1", [{"seq": 2, "text": "b2"}, {"seq": 3, "text": "c"}])
+    assert [e['text'] for e in backend.load_archives()["1"]] == ["a", "b", "c"]
+    backend.close()
+
+def test_touch_memories_updates_only_existing_records(tmp_path):
+    backend = open_backend(tmp_path)
+    backend.upsert_memory({"id": 1, "text": "猫が好き", "created_at": "2024-01-01T00:00:00", "last_used_at": None})
+    backend.touch_memories({1: "2024-02-01T00:00:00", 2: "2024-02-01T00:00:00"})
+    assert backend.load_memories() == [{"id": 1, "text": "猫が好き", "created_at": "2024-01-01T00:00:00",
+                                        "last_used_at": "2024-02-01T00:00:00"}]
+    backend.close()
+
+def test_seed_runs_only_once_even_when_kv_stays_empty(tmp_path):
+    history_file = tmp_path / "history.json"
+    history_file.write_text(json.dumps({"1": [{"role": "user", "parts": ["古い履歴"]}]}), encoding='utf-8')
+    backend = open_backend(tmp_path, {'history': str(history_file)})
+    backend.replace_history("1", [{"role": "user", "parts": ["新しい履歴"]}])
+    backend.close()
+
+    backend = open_backend(tmp_path, {'history': str(history_file)})
+    assert backend.load_histories() == {"1": [{"role": "user", "parts": ["新しい履歴"]}]}
+    backend.close()
+
+def test_existing_database_without_the_seed_marker_is_not_reseeded(tmp_path):
+    backend = open_backend(tmp_path)
+    backend.append_unread("1", [{"offset": 1, "content": "未読"}])
+    backend._conn.execute("DELETE FROM meta")
+    backend.close()
+
+    setting_file = tmp_path / "setting.json"
+    setting_file.write_text(json.dumps({"seeded": True}), encoding='utf-8')
+    backend = open_backend(tmp_path, {'setting': str(setting_file)})
+    assert backend.load('setting') is None
+    backend.close()
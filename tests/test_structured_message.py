@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+# ai_request_handler は google-generativeai がない環境では import できない
+pytest.importorskip("google.generativeai")
+
+from utils import ai_request_handler
+from utils.ai_request_handler import _parse_structured_reply, _partial_structured_message
+from utils.unread_log import UnreadLog
+
+@pytest.mark.parametrize("raw_text, expected", [
+    ('', ""),
+    ('{"emotion_deltas": {"joy": 3}, ', ""),
+    ('{"message": "こんに', "こんに"),
+    ('{"message": "こんにちは", "emotion_deltas": {', "こんにちは"),
+    ('{"message": "改行\\nと\\"引用\\"', '改行\nと"引用"'),
+    # 途中で切れたエスケープは含めない
+    ('{"message": "abc\\', "abc"),
+    ('{"message": "abc\\u30', "abc"),
+    ('{"message": "\\u3042', "あ"),
+])
+def test_partial_structured_message(raw_text, expected):
+    assert _partial_structured_message(raw_text) == expected
+
+@pytest.mark.parametrize("text, expected", [
+    ('{"message": "こんにちは", "emotion_deltas": {"joy": 3}}', {"message": "こんにちは", "emotion_deltas": {"joy": 3}}),
+    ('```json\n{"message": "こんにちは"}\n```', {"message": "こんにちは"}),
+    # JSONとして読めない・本文がない場合は、応答全体を本文として扱う
+    ('ただの文章', {"message": "ただの文章"}),
+    ('{"emotion_deltas": {"joy": 3}}', {"message": '{"emotion_deltas": {"joy": 3}}'}),
+    ('{"message": 123}', {"message": '{"message": 123}'}),
+    ('["こんにちは"]', {"message": '["こんにちは"]'}),
+    ('"こんにちは"', {"message": '"こんにちは"'}),
+])
+def test_parse_structured_reply(text, expected):
+    assert _parse_structured_reply(text) == expected
+
+class FakeEmotionCog:
+    emotion_map = {"joy": "喜び"}
+
+    def __init__(self):
+        self.applied = []
+        self.enqueued = []
+
+    def apply_emotion_deltas(self, emotion_deltas):
+        self.applied.append(emotion_deltas)
+
+    def enqueue_update(self, bot_response, user_input=""):
+        self.enqueued.append((user_input, bot_response))
+
+@pytest.mark.parametrize("reply, applied, enqueued", [
+    ({"message": "こんにちは", "emotion_deltas": {"joy": 3}}, [{"joy": 3}], []),
+    # 変化量がなければ、別リクエストでの感情分析に回す
+    ({"message": "こんにちは"}, [], [("[user]: hi", "こんにちは")]),
+])
+def test_chat_applies_emotion_deltas_from_the_combined_reply(chat_cog, monkeypatch, reply, applied, enqueued):
+    emotion_cog = FakeEmotionCog()
+    monkeypatch.setattr(chat_cog.bot, "get_cog", lambda name: emotion_cog if name == "EmotionCog" else None)
+    requests = []
+
+    async def send_request(model, prompt, channel_id=None, **kwargs):
+        requests.append(kwargs)
+        return reply
+
+    monkeypatch.setattr(ai_request_handler, "send_request", send_request)
+    chat_cog.unread_data["1"] = UnreadLog()
+    chat_cog.unread_data["1"].append({"author": "user", "content": "hi"})
+
+    asyncio.run(chat_cog._process_channel_once(1))
+    assert requests[0]["response_schema"] is not None
+    assert chat_cog.bot.get_channel(1).sent == ["こんにちは"]
+    assert emotion_cog.applied == applied
+    assert emotion_cog.enqueued == enqueued
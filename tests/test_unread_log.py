@@ -0,0 +1,60 @@
+import utils.db_manager as data_manager
+from utils.unread_log import UnreadLog
+
+def test_append_assigns_increasing_offsets():
+    log = UnreadLog()
+    first = log.append({"content": "a"})
+    second = log.append({"content": "b"})
+    assert (first['offset'], second['offset']) == (1, 2)
+    assert len(log) == 2
+
+def test_commit_keeps_messages_received_after_the_snapshot():
+    log = UnreadLog()
+    log.append({"content": "a"})
+    snapshot = log.snapshot()
+    log.append({"content": "b"})
+
+    assert log.commit(snapshot[-1]['offset']) == 1
+    assert [e['content'] for e in log] == ["b"]
+
+def test_commit_never_moves_the_cursor_back():
+    log = UnreadLog()
+    for content in "abc":
+        log.append({"content": content})
+    log.commit(2)
+    assert log.commit(1) == 0
+    assert log.committed == 2
+    assert len(log) == 1
+
+def test_offsets_continue_after_reloading():
+    log = UnreadLog([{"offset": 3, "content": "c"}, {"offset": 2, "content": "b"}], committed=2)
+    assert [e['offset'] for e in log] == [3]
+    assert log.append({"content": "d"})['offset'] == 4
+
+def test_offsets_continue_after_everything_is_committed():
+    log = UnreadLog([], committed=5)
+    assert log.append({"content": "a"})['offset'] == 6
+
+def test_unread_merge_drops_entries_committed_in_the_same_batch(backend):
+    op = data_manager._UnreadLogOp("1", [{"offset": 1}, {"offset": 2}])
+    op = op.merge(data_manager._UnreadLogOp("1", [], cursor=2))
+    op = op.merge(data_manager._UnreadLogOp("1", [{"offset": 3}]))
+    assert op.cursor == 2
+    assert [e['offset'] for e in op.entries] == [3]
+
+    op.prepare()()
+    assert [e['offset'] for e in backend.load_unread()["1"]] == [3]
+    assert backend.load_unread_cursors() == {"1": 2}
+
+def test_unread_merge_keeps_the_largest_cursor(backend):
+    op = data_manager._UnreadLogOp("1", [], cursor=5).merge(data_manager._UnreadLogOp("1", [], cursor=3))
+    assert op.cursor == 5
+
+def test_unread_commit_removes_entries_written_in_an_earlier_batch(backend):
+    data_manager._UnreadLogOp("1", [{"offset": 1}, {"offset": 2}]).prepare()()
+    data_manager._UnreadLogOp("1", [], cursor=1).prepare()()
+    assert [e['offset'] for e in backend.load_unread()["1"]] == [2]
+
+def test_unread_op_is_replaced_by_a_reset(backend):
+    reset = data_manager._UnreadResetOp()
+    assert data_manager._UnreadLogOp("1", [{"offset": 1}]).merge(reset) is reset
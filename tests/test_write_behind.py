@@ -0,0 +1,100 @@
+import asyncio
+import threading
+
+from utils.write_behind import WriteOp, WriteBehindQueue
+
+class RecordOp(WriteOp):
+    """実行時に (名前, 値) を log に記録する操作。同じキーの操作は値を連結してまとめる。"""
+    def __init__(self, log, name, values, barrier=False, started=None, release=None):
+        self.log = log
+        self.name = name
+        self.values = values
+        self.barrier = barrier
+        self.started = started
+        self.release = release
+
+    def merge(self, newer):
+        if isinstance(newer, RecordOp) and not newer.barrier:
+            return RecordOp(self.log, self.name, self.values + newer.values)
+        return newer
+
+    def prepare(self):
+        values = list(self.values)
+        def write():
+            if self.started is not None:
+                self.started.set()
+                self.release.wait(timeout=5)
+            self.log.append((self.name, values))
+        return write
+
+def make_queue(**overrides):
+    options = {"window": 0.01, "max_delay": 1.0, "max_in_flight": 4}
+    options.update(overrides)
+    return WriteBehindQueue(**options)
+
+def test_marks_to_the_same_key_are_coalesced_into_one_write():
+    log = []
+    queue = make_queue()
+
+    async def run():
+        for i in range(5):
+            queue.mark("history", RecordOp(log, "history", [i]))
+        queue.mark("emotion", RecordOp(log, "emotion", ["e"]))
+        await queue.flush()
+
+    asyncio.run(run())
+    assert sorted(log) == [("emotion", ["e"]), ("history", [0, 1, 2, 3, 4])]
+    stats = queue.stats()
+    assert (stats["requested"], stats["written"], stats["flushes"], stats["queue_depth"]) == (6, 2, 1, 0)
+
+def test_writes_wait_for_the_debounce_window():
+    log = []
+    queue = make_queue(window=0.2)
+
+    async def run():
+        queue.mark("history", RecordOp(log, "history", [1]))
+        await asyncio.sleep(0.05)
+        assert log == []
+        await queue.flush()
+
+    asyncio.run(run())
+    assert log == [("history", [1])]
+
+def test_barrier_runs_before_the_other_writes_in_its_batch():
+    log = []
+    queue = make_queue()
+
+    async def run():
+        queue.mark(("memory", 1), RecordOp(log, "upsert", [1]))
+        queue.mark("memory_reset", RecordOp(log, "reset", [], barrier=True))
+        queue.mark(("memory", 2), RecordOp(log, "upsert", [2]))
+        await queue.flush()
+
+    asyncio.run(run())
+    assert log[0] == ("reset", [])
+    assert sorted(log[1:]) == [("upsert", [1]), ("upsert", [2])]
+
+def test_marks_during_a_flush_go_into_the_next_batch():
+    log = []
+    started = threading.Event()
+    release = threading.Event()
+    queue = make_queue()
+
+    async def run():
+        queue.mark("history", RecordOp(log, "history", [1], started=started, release=release))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+        queue.mark("history", RecordOp(log, "history", [2]))
+        release.set()
+        await queue.flush()
+        # 2回目のバッチが終わるまで待つ
+        await queue.flush()
+
+    asyncio.run(run())
+    assert log == [("history", [1]), ("history", [2])]
+    assert queue.stats()["flushes"] == 2
+
+def test_marks_outside_the_event_loop_are_written_immediately():
+    log = []
+    queue = make_queue()
+    queue.mark("history", RecordOp(log, "history", [1]))
+    assert log == [("history", [1])]
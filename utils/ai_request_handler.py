@@ -4,14 +4,20 @@ import google.api_core.exceptions
 import google.generativeai as genai
 import utils.config_manager as config
 from utils import db_manager as data_manager
+from utils import prompt_assets, prompt_builder
+from utils.gemini_pool import GeminiClientPool
+from utils.prefix_cache import PrefixCache, CachedPrefix, create_prefix_cache
+from utils.key_scheduler import KeyScheduler
+from utils.hedging import LatencyTracker, HedgeStats
+from utils.token_estimator import estimate_tokens
+from utils.history_window import HistoryWindow
+from utils.conversation_archive import ConversationArchive
 from utils.console_display import log_system, log_error, log_info, log_warning, log_success
-from datetime import datetime
 import json
-import logging
-import traceback
 import os
 import asyncio
 import re
+import time
 
 # APIキーの環境変数名のリスト
 API_KEY_ENV_VARS = [
@@ -21,9 +27,57 @@ API_KEY_ENV_VARS = [
     "GEMINI_API_KEY_3",
 ]
 
+def _load_api_keys() -> list:
+    """環境変数からAPIキーを読み込む（重複は除く）"""
+    keys = []
+    for env_var in API_KEY_ENV_VARS:
+        key = os.getenv(env_var)
+        if key and key not in keys:
+            keys.append(key)
+    return keys
+
+# 起動時に一度だけ読み込んだAPIキーのリスト
+API_KEYS = _load_api_keys()
+
 # 現在使用中のAPIキーのインデックス
 current_api_key_index = 0
 
+# APIキー・モデルごとのクライアントを使い回すプール
+_client_pool = GeminiClientPool()
+
+# APIキーごとのレート上限と健全性を管理するスケジューラ (初回使用時に生成)
+_key_scheduler = None
+
+# ペルソナなどの静的なシステム指示を登録しておくプレフィックスキャッシュ (初回使用時に生成)
+_prefix_cache = None
+_prefix_cache_ready = False
+
+# 未読メッセージなしで発言したときに、履歴に残す user ターン
+SPONTANEOUS_USER_TURN = "（未読メッセージはありません）"
+
+# 1つのキーで試行する最大回数 (初回 + 再試行)
+MAX_RETRIES_PER_KEY = 1
+
+# 要約待ちの削除済みターン (チャンネルID -> ターンのリスト) と、チャンネルごとの要約タスク
+_pending_compaction = {}
+_compaction_tasks = {}
+
+# ヘッジリクエスト用の応答時間の記録と計測値
+_latency_tracker = LatencyTracker()
+_hedge_stats = HedgeStats()
+
+def get_active_key_number() -> int:
+    """現在使用中のAPIキーの番号 (1始まり) を返す"""
+    return current_api_key_index + 1
+
+def set_active_key_number(key_number: int):
+    """次のリクエストで最初に試すAPIキーを番号 (1始まり) で指定する"""
+    global current_api_key_index
+    if 1 <= key_number <= len(API_KEYS):
+        current_api_key_index = key_number - 1
+        _get_key_scheduler().preferred_index = current_api_key_index
+        log_system(f"APIキーを {key_number}番 に切り替えました。")
+
 def initialize_histories():
     """
     履歴キャッシュの初期化。db_managerの互換関数を呼び出す。
@@ -31,27 +85,25 @@ def initialize_histories():
     data_manager.initialize_histories()
 
 def _load_persona() -> str | None:
-    """ペルソナファイルを読み込む"""
+    """ペルソナファイルを読み込む (ファイルが更新されていなければメモリ上のキャッシュを返す)"""
     try:
         if not hasattr(config, 'PERSONA_FILE'):
              log_error("CONFIG_ERROR", "config_managerにPERSONA_FILEが定義されていません。")
              return None
         persona_path = config.PERSONA_FILE
-        if os.path.exists(persona_path):
-            with open(persona_path, 'r', encoding='utf-8') as f:
-                log_info("PERSONA_LOAD", f"{persona_path} からペルソナを読み込みます。")
-                return f.read()
-        else:
+        persona = prompt_assets.read_text(persona_path)
+        if persona is None:
             log_error("PERSONA_LOAD", f"ペルソナファイルが見つかりません: {persona_path}")
-            return None
+        return persona
     except Exception as e:
         log_error("PERSONA_LOAD", f"ペルソナファイルの読み込み中にエラー: {e}")
         return None
 
-def get_channel_history(channel_id: int) -> list | None:
+def get_channel_history(channel_id: int) -> HistoryWindow | None:
     """
     指定されたチャンネルIDの履歴を db_manager のキャッシュから取得または初期化。
-    取得・初期化に成功した場合はリストを、失敗した場合は None を返す。
+    取得・初期化に成功した場合は HistoryWindow を、失敗した場合は None を返す。
+    ペルソナは履歴に含めず、送信時にシステム指示として付ける。
     """
     history_cache = data_manager.get_data('history')
     if history_cache is None:
@@ -60,233 +112,522 @@ def get_channel_history(channel_id: int) -> list | None:
 
     str_channel_id = str(channel_id)
 
-    # チャンネル履歴が存在しない、または空の場合に初期化
-    if str_channel_id not in history_cache or not history_cache[str_channel_id]:
-        log_action = "初期化" if str_channel_id not in history_cache else "再初期化"
-        log_info("HISTORY", f"CH[{channel_id}] の履歴が見つからないか空のため、ペルソナファイルから{log_action}します。")
-        persona_content = _load_persona()
-        if persona_content:
-            initial_history = [{"role": "user", "parts": [persona_content]}]
-            history_cache[str_channel_id] = initial_history
-            log_success("HISTORY", f"CH[{channel_id}] の履歴をペルソナで正常に{log_action}しました。")
-            
-            # DBに保存
-            data_manager.save_data('history', history_cache)
-            log_info("HISTORY", f"CH[{channel_id}] の初期化履歴をDBに保存しました。")
-        else:
-            log_error("HISTORY", f"CH[{channel_id}] の履歴{log_action}に失敗しました。ペルソナが読み込めません。")
-            history_cache[str_channel_id] = [] # 空のリストで初期化しておく
-            data_manager.save_data('history', history_cache)
+    # チャンネル履歴が存在しない場合に初期化
+    if str_channel_id not in history_cache:
+        log_info("HISTORY", f"CH[{channel_id}] の履歴が見つからないため、空の履歴で初期化します。")
+        history_cache[str_channel_id] = HistoryWindow()
 
     return history_cache.get(str_channel_id)
 
-def add_message_to_history(channel_id: int, role: str, message: str):
-    """履歴にメッセージを追加 (db_manager のキャッシュを更新し、DBに保存)"""
+def _get_persona_instruction(channel_id: int = None) -> tuple[str | None, int]:
+    """
+    チャンネル宛てのリクエストに付けるペルソナ (システム指示) と、その推定トークン数を返す。
+    チャンネルに紐づかないリクエスト (感情分析・要約など) にはペルソナを付けない。
+    """
+    if channel_id is None:
+        return None, 0
+    persona = _load_persona()
+    if not persona:
+        log_warning("PERSONA", f"CH[{channel_id}] のリクエストにペルソナを付けられません。ペルソナなしで送信します。")
+        return None, 0
+    return persona, estimate_tokens(persona)
+
+def add_message_to_history(channel_id: int, role: str, message: str, model_name: str = None):
+    """
+    履歴にメッセージを追加 (db_manager のキャッシュを更新し、DBに保存)。
+    履歴の推定トークン数がモデルごとの予算を超えた場合は、古いターンから削除する。
+    """
     history = get_channel_history(channel_id)
     if history is None:
          log_error("HISTORY_ADD", f"CH[{channel_id}] の履歴リスト取得に失敗したため、メッセージを追加できません。")
          return
 
-    # 履歴制限チェック
-    try:
-        max_history_length = config.get_max_history_length()
-        if len(history) >= max_history_length:
-            if len(history) >= 3: # ペルソナ + 1ペア以上ある場合
-                 del history[1:3] # インデックス1と2 (ペルソナ直後のペア) を削除
-                 log_warning("HISTORY", f"CH[{channel_id}] の履歴が長すぎるため、古い会話ペア(ペルソナ直後)を削除しました。")
-            elif len(history) == 2 and history[0].get("role") == "user":
-                 log_warning("HISTORY", f"CH[{channel_id}] 履歴が最大長ですが、ペルソナと応答のみのため削除しませんでした。")
+    entry = {"role": role, "parts": [message]}
+    history.append(entry)
 
-    except AttributeError:
-        log_warning("HISTORY", "configにget_max_history_lengthが見つかりません。履歴制限はスキップされます。")
+    # 履歴制限チェック (トークン予算)
+    try:
+        budget = config.get_history_token_budget(model_name)
+        if config.HISTORY_COMPACTION_ENABLED:
+            budget = min(budget, config.HISTORY_COMPACTION_BUDGET)
+        # 送信時に付くペルソナの分も予算に含める
+        budget -= _get_persona_instruction(channel_id)[1]
+        evicted = history.enforce_budget(budget)
+        if evicted:
+            log_warning("HISTORY", f"CH[{channel_id}] の履歴が予算({budget}トークン)を超えたため、古いターンを{len(evicted)}件削除しました。")
+            _archive_turns(channel_id, evicted)
+            _schedule_compaction(channel_id, evicted)
     except Exception as e:
         log_error("HISTORY", f"履歴削除中にエラー: {e}")
 
-    history.append({"role": role, "parts": [message]})
-    log_info("HISTORY", f"CH[{channel_id}] の履歴に {role} のメッセージを追加しました。 (現在の履歴数: {len(history)})")
+    log_info("HISTORY", f"CH[{channel_id}] の履歴に {role} のメッセージを追加しました。 (現在の履歴数: {len(history)}, 推定トークン数: {history.total_tokens})")
     
-    # DBに保存
-    data_manager.save_data('history', data_manager.get_data('history'))
+    # DBに保存 (このチャンネルのドキュメントに追加分だけを追記する)
+    data_manager.append_channel_history(channel_id, [entry])
+
+
+def _archive_turns(channel_id: int, evicted: list):
+    """履歴から削除されたターンを、チャンネルの保管庫 (追記のみ・検索可能) に移す"""
+    if not config.ARCHIVE_ENABLED or not evicted:
+        return
+    archive_cache = data_manager.get_data('archive')
+    if archive_cache is None:
+        return
+    archive = archive_cache.setdefault(str(channel_id), ConversationArchive())
+    added = archive.append_turns(evicted)
+    data_manager.append_archive(channel_id, added)
+
+def _schedule_compaction(channel_id: int, evicted: list):
+    """削除されたターンを要約待ちに積み、チャンネルごとの要約タスクをバックグラウンドで起動する"""
+    if not config.HISTORY_COMPACTION_ENABLED or not evicted:
+        return
+    str_channel_id = str(channel_id)
+    _pending_compaction.setdefault(str_channel_id, []).extend(evicted)
+
+    task = _compaction_tasks.get(str_channel_id)
+    if task is None or task.done():
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        _compaction_tasks[str_channel_id] = loop.create_task(_compact_history(str_channel_id))
+
+async def _compact_history(str_channel_id: str):
+    """要約待ちのターンを、軽量モデルでチャンネルの要約に畳み込む"""
+    while _pending_compaction.get(str_channel_id):
+        turns = _pending_compaction.pop(str_channel_id)
+        history = (data_manager.get_data('history') or {}).get(str_channel_id)
+        if history is None:
+            return
+
+        log_info("HISTORY_COMPACT", f"CH[{str_channel_id}] の古いターン{len(turns)}件を要約に畳み込みます...")
+        prompt = prompt_builder.build_summary_prompt(history.summary, turns, config.HISTORY_SUMMARY_MAX_CHARS)
+        summary = await send_request(config.MODEL_PRO_3, prompt, channel_id=None)
+
+        if not summary:
+            # 失敗したターンは次回の要約に回す (上限を超えた分は古い方から捨てる)
+            retry_turns = turns + _pending_compaction.get(str_channel_id, [])
+            _pending_compaction[str_channel_id] = retry_turns[-config.HISTORY_COMPACTION_MAX_PENDING:]
+            log_warning("HISTORY_COMPACT", f"CH[{str_channel_id}] の要約に失敗しました。次回の削除時に再試行します。")
+            return
+
+        # 要約中に履歴がリセットされた場合は、新しい履歴に古い要約を持ち込まない
+        if (data_manager.get_data('history') or {}).get(str_channel_id) is not history:
+            return
+        history.set_summary(summary.strip())
+        data_manager.save_history_summary(str_channel_id)
+        log_success("HISTORY_COMPACT", f"CH[{str_channel_id}] の要約を更新しました。(推定 {history.summary_tokens} トークン)")
+
+def _get_key_scheduler() -> KeyScheduler:
+    global _key_scheduler
+    if _key_scheduler is None:
+        _key_scheduler = KeyScheduler(API_KEYS, config.MODEL_RATE_LIMITS, config.DEFAULT_RATE_LIMIT)
+        _key_scheduler.preferred_index = current_api_key_index
+    return _key_scheduler
+
+def get_rate_limit_pressure(*model_names: str) -> float:
+    """指定モデルのうち、最もレート上限に逼迫しているものの逼迫度 (0.0〜1.0) を返す"""
+    scheduler = _get_key_scheduler()
+    return max((scheduler.pressure(name) for name in model_names), default=0.0)
+
+def get_key_utilization() -> list:
+    """APIキー×モデルごとの使用率・応答時間・エラー率を返す"""
+    return _get_key_scheduler().utilization()
+
+def _get_prefix_cache() -> PrefixCache | None:
+    global _prefix_cache, _prefix_cache_ready
+    if not _prefix_cache_ready:
+        _prefix_cache_ready = True
+        try:
+            _prefix_cache = create_prefix_cache(config.PREFIX_CACHE_MODE, _client_pool)
+        except ValueError as e:
+            log_error("PREFIX_CACHE", f"{e} プレフィックスキャッシュを使わずに送信します。")
+            _prefix_cache = None
+        if _prefix_cache is not None:
+            _prefix_cache.on_evict = lambda prefix: _client_pool.discard_cached_content(prefix.name)
+    return _prefix_cache
+
+def get_prefix_cache_stats() -> dict | None:
+    """プレフィックスキャッシュのヒット率と節約トークン数を返す (無効の場合は None)"""
+    cache = _get_prefix_cache()
+    return cache.stats() if cache is not None else None
+
+def _estimate_request_tokens(history: HistoryWindow | None, budget: int, prompt: str, persona_tokens: int = 0) -> int:
+    """リクエスト全体 (ペルソナ + 予算内の履歴 + プロンプト) のトークン数を概算する"""
+    history_tokens = min(history.total_tokens, budget) if history is not None else 0
+    return persona_tokens + history_tokens + estimate_tokens(prompt)
+
+async def _send_once(api_key: str, model_name: str, history: list, prompt: str, channel_id: int = None,
+                     system_instruction: str = None, generation_config: dict = None, on_partial=None):
+    """
+    指定キーで1回だけリクエストを送信し、応答オブジェクトを返す (例外はそのまま送出)
+    on_partial を渡すとストリーミングで受信し、それまでに受信したテキスト全体を受信のたびに渡す。
+    """
+    # システム指示が登録済みなら、本文の代わりにキャッシュ名を送る
+    prefix_cache = _get_prefix_cache()
+    prefix = None
+    if prefix_cache is not None and system_instruction:
+        prefix = await prefix_cache.acquire(api_key, model_name, system_instruction)
+
+    if history and history[0].get("role") != "user":
+        # 先頭の model ターンだけを除き、残りの文脈は送る
+        first_user = next((i for i, turn in enumerate(history) if turn.get("role") == "user"), len(history))
+        log_warning("AI_REQUEST_HISTORY_WARN", f"CH[{channel_id}] の履歴が'user'から始まっていないため、先頭の{first_user}件を除いて送信します。")
+        history = history[first_user:]
+
+    log_info("AI_REQUEST", f"モデル '{model_name}' にリクエストを送信します...")
+    try:
+        response = await _send_with_model(api_key, model_name, history, prompt, system_instruction, prefix, generation_config, on_partial)
+    except (google.api_core.exceptions.NotFound, google.api_core.exceptions.PermissionDenied) as e:
+        if prefix is None or not prefix.remote:
+            raise
+        # キャッシュが期限切れなどで消えていた場合は、指示本文を付けて送り直す
+        log_warning("PREFIX_CACHE", f"プレフィックス '{prefix.name}' が使えないため、指示本文を付けて再送信します: {e}")
+        prefix_cache.discard(prefix)
+        prefix = None
+        response = await _send_with_model(api_key, model_name, history, prompt, system_instruction, None, generation_config, on_partial)
+
+    log_info("AI_REQUEST_DEBUG", "chat.send_message_async の呼び出しが完了しました。")
+    if prefix is not None and _has_text(response):
+        usage = getattr(response, 'usage_metadata', None)
+        prefix_cache.record_saved(prefix, getattr(usage, 'cached_content_token_count', None))
+    return response
+
+async def _send_with_model(api_key: str, model_name: str, history: list, prompt: str,
+                           system_instruction: str = None, prefix: CachedPrefix = None, generation_config: dict = None,
+                           on_partial=None):
+    # グローバル設定を書き換えず、キー専用のクライアントを持つモデルを借りる
+    if prefix is not None and prefix.remote:
+        model = _client_pool.get_model(api_key, model_name, cached_content=prefix.name)
+    else:
+        model = _client_pool.get_model(api_key, model_name, system_instruction)
+    chat = model.start_chat(history=history)
 
+    try:
+        api_timeout = config.get_api_timeout()
+    except AttributeError:
+        log_warning("AI_REQUEST_CONFIG", "configにget_api_timeoutが見つかりません。デフォルトの120秒を使用します。")
+        api_timeout = 120
+
+    if on_partial is not None:
+        return await asyncio.wait_for(_consume_stream(chat, prompt, generation_config, on_partial), timeout=api_timeout)
+    return await asyncio.wait_for(
+        chat.send_message_async(prompt, generation_config=generation_config),
+        timeout=api_timeout
+    )
+
+async def _consume_stream(chat, prompt: str, generation_config: dict, on_partial):
+    """ストリーミングで応答を受信し、受信のたびにそれまでのテキスト全体を on_partial に渡す。受信し終えた応答を返す。"""
+    response = await chat.send_message_async(prompt, generation_config=generation_config, stream=True)
+    text = ""
+    async for chunk in response:
+        try:
+            text += chunk.text
+        except Exception:
+            # 本文を持たないチャンク (終了理由だけなど) は飛ばす
+            continue
+        await on_partial(text)
+    return response
+
+def _has_text(response) -> bool:
+    """応答から本文を取り出せるか (ブロックされた応答などは text の取得で例外になる)"""
+    try:
+        response.text
+        return True
+    except Exception:
+        return False
+
+def _get_hedge_delay(model_name: str) -> float | None:
+    """ヘッジリクエストを送るまでの待ち時間。ヘッジしない場合は None。"""
+    if not config.HEDGE_ENABLED or len(API_KEYS) < 2:
+        return None
+    delay = _latency_tracker.percentile(model_name, config.HEDGE_PERCENTILE, config.HEDGE_MIN_SAMPLES)
+    if delay is None:
+        delay = config.HEDGE_DEFAULT_DELAY
+    return max(config.HEDGE_MIN_DELAY, delay)
+
+def get_hedge_stats() -> dict:
+    """ヘッジリクエストの発火率と短縮時間の計測値を返す"""
+    return _hedge_stats.summary()
+
+async def _send_hedged(scheduler: KeyScheduler, lease, model_name: str, history: list, prompt: str,
+                       channel_id: int, estimated_tokens: int, system_instruction: str = None,
+                       generation_config: dict = None, on_partial=None):
+    """
+    lease のキーでリクエストを送り、期限 (過去の応答時間のパーセンタイル) までに返らなければ
+    別のキーで同じリクエストを送る。先に返った有効な応答を採用し、もう一方はキャンセルする。
+    戻り値は (応答, 応答を返したキーのリース)。プライマリが失敗しヘッジも失敗した場合はプライマリの例外を送出する。
+    ストリーミング (on_partial あり) の場合、ヘッジするのはプライマリの最初のチャンクが届くまでで、
+    ヘッジ側はストリーミングせずに受信する。プライマリが表示を始めたら、表示中の応答が入れ替わらないようヘッジ側をやめる。
+    """
+    _hedge_stats.record_request()
+    started = time.monotonic()
+    first_chunk = asyncio.Event()
+    primary_on_partial = None
+    if on_partial is not None:
+        async def primary_on_partial(text: str):
+            first_chunk.set()
+            await on_partial(text)
+    primary = asyncio.ensure_future(_send_once(lease.api_key, model_name, history, prompt, channel_id, system_instruction, generation_config, primary_on_partial))
+    first_chunk_waiter = asyncio.ensure_future(first_chunk.wait()) if on_partial is not None else None
+    hedge = None
+    hedge_lease = None
+    # ヘッジ側のリースを返却・報告したか (キャンセルや同時完了でリースを残さないため)
+    hedge_settled = False
 
-async def send_request(model_name: str, prompt: str, channel_id: int = None):
-    """AIモデルにリクエストを送信し、応答を取得 (APIキー再試行・レート制限対応付き)"""
+    try:
+        hedge_delay = _get_hedge_delay(model_name)
+        if hedge_delay is not None:
+            await asyncio.wait({primary, first_chunk_waiter} - {None}, timeout=hedge_delay, return_when=asyncio.FIRST_COMPLETED)
+            if not primary.done() and not first_chunk.is_set():
+                hedge_lease = await scheduler.acquire(model_name, estimated_tokens, exclude={lease.index}, max_wait=0)
+                if hedge_lease is not None:
+                    log_info("AI_HEDGE", f"{hedge_delay:.1f}秒以内に応答がないため、APIキー {hedge_lease.index + 1} でも同じリクエストを送信します。")
+                    _hedge_stats.record_hedge()
+                    hedge_started = time.monotonic()
+                    hedge = asyncio.ensure_future(_send_once(hedge_lease.api_key, model_name, history, prompt, channel_id, system_instruction, generation_config))
+
+        if hedge is None:
+            response = await primary
+            if _has_text(response):
+                _latency_tracker.record(model_name, time.monotonic() - started)
+            return response, lease
+
+        pending = {primary, hedge, first_chunk_waiter} - {None}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+            if primary in done and primary.exception() is None and _has_text(primary.result()):
+                _latency_tracker.record(model_name, time.monotonic() - started)
+                if not hedge.done():
+                    hedge.cancel()
+                    scheduler.release(hedge_lease)
+                elif hedge.exception() is None and _has_text(hedge.result()):
+                    # 同時に返った場合、ヘッジ側の応答は使わないがキーは正常なので返却する
+                    scheduler.release(hedge_lease)
+                else:
+                    scheduler.report_error(hedge_lease)
+                hedge_settled = True
+                return primary.result(), lease
+
+            if first_chunk.is_set() and not hedge_settled:
+                # プライマリが表示を始めたので、ヘッジ側はやめてプライマリの応答を待つ
+                if not hedge.done():
+                    hedge.cancel()
+                    scheduler.release(hedge_lease)
+                elif hedge.exception() is None and _has_text(hedge.result()):
+                    scheduler.release(hedge_lease)
+                else:
+                    scheduler.report_error(hedge_lease)
+                hedge_settled = True
+                log_info("AI_HEDGE", "プライマリの応答の表示が始まったため、ヘッジ側のリクエストをやめます。")
+                response = await primary
+                if _has_text(response):
+                    _latency_tracker.record(model_name, time.monotonic() - started)
+                return response, lease
+
+            if hedge in done:
+                if hedge.exception() is None and _has_text(hedge.result()):
+                    now = time.monotonic()
+                    _latency_tracker.record(model_name, now - hedge_started)
+                    # プライマリが返るはずだった時刻は、過去の応答時間の最大側 (p99) で見積もる
+                    expected = _latency_tracker.percentile(model_name, 0.99) or config.get_api_timeout()
+                    _hedge_stats.record_hedge_win(started + expected - now)
+                    if primary.done():
+                        scheduler.report_error(lease)
+                    else:
+                        primary.cancel()
+                        scheduler.release(lease)
+                    hedge_settled = True
+                    log_success("AI_HEDGE", f"ヘッジ側 (APIキー {hedge_lease.index + 1}) の応答を採用しました。")
+                    return hedge.result(), hedge_lease
+                # ヘッジ側の失敗はここで報告し、プライマリの結果を待つ
+                scheduler.report_error(hedge_lease)
+                hedge_settled = True
+                log_warning("AI_HEDGE", f"ヘッジ側 (APIキー {hedge_lease.index + 1}) のリクエストが失敗しました。")
+
+            if primary.done() and hedge.done():
+                break
+            if primary.done() and not hedge.done():
+                # プライマリは失敗したので、ヘッジ側の結果を待つ
+                continue
+
+        return primary.result(), lease
+    finally:
+        for task in (primary, hedge, first_chunk_waiter):
+            if task is not None and not task.done():
+                task.cancel()
+        # 呼び出し元がキャンセルされた場合など、ヘッジ側のリースが残っていれば返却する
+        if hedge_lease is not None and not hedge_settled:
+            scheduler.release(hedge_lease)
+
+async def send_request(model_name: str, prompt: str, channel_id: int = None, system_instruction: str = None,
+                       response_schema: dict = None, unread_messages: list = None, on_text=None):
+    """
+    AIモデルにリクエストを送信し、応答を取得 (APIキー再試行・レート制限対応付き)
+    チャンネル宛てのリクエストにはペルソナがシステム指示として付く。
+    チャンネルに紐づかないリクエストでは、system_instruction に呼び出し側の静的な指示を渡せる。
+    システム指示はプレフィックスキャッシュに登録され、以降は変化する部分 (履歴とプロンプト) だけが送られる。
+    response_schema を指定すると JSON で応答させ、{"message": 本文, ...} の辞書を返す。
+    この場合、履歴には本文 (message) だけが追加される。
+    unread_messages には、このリクエストで処理する未読メッセージを渡す (省略時はチャンネルの現在の未読メッセージ)。
+    on_text (async 関数) を渡すとストリーミングで受信し、それまでに受信した本文全体を受信のたびに渡す。
+    JSON で応答させる場合も、"message" の受信済みの部分だけを渡す。再試行した場合は短い本文から渡し直される。
+    戻り値と履歴への追加は、ストリーミングでない場合と同じく受信し終えた応答から1回だけ行う。
+    """
     global current_api_key_index
     log_info("AI_REQUEST", f"モデル '{model_name}' へのリクエスト処理を開始します...")
     log_info("AI_REQUEST_DEBUG", f"使用モデル名: {model_name}")
 
     # --- ユーザーメッセージの履歴追加準備 ---
     user_message_content = None
-    if channel_id is not None:
+    if channel_id is not None and unread_messages is None:
         try:
             if config.bot is None:
                 log_error("AI_REQUEST_CONFIG", "config.botがNoneです。Cogにアクセスできません。")
             else:
                 chat_cog = config.bot.get_cog('ChatManagerCog')
                 if chat_cog:
-                    str_channel_id = str(channel_id)
-                    unread_messages = chat_cog.unread_data.get(str_channel_id, [])
-                    if unread_messages:
-                         user_messages_for_history = [
-                             f"[{m.get('author','Unknown')} @ {m.get('timestamp','')}]: {m.get('content','')}"
-                             for m in unread_messages
-                         ]
-                         user_message_content = "\n".join(user_messages_for_history)
+                    unread_messages = list(chat_cog.unread_data.get(str(channel_id), []))
                 else:
                     log_warning("AI_REQUEST_COG", "ChatManagerCogが見つかりません。")
         except Exception as e:
             log_error("AI_REQUEST_HISTORY_PREP", f"履歴準備中にエラー: {e}")
-            user_message_content = None
+            unread_messages = None
+    if channel_id is not None and unread_messages:
+        user_message_content = prompt_builder.format_unread_messages(unread_messages)
+    if channel_id is not None and not user_message_content:
+        # 自発的な発言でも user / model が交互になるよう、未読がなかったことを user ターンとして残す
+        user_message_content = SPONTANEOUS_USER_TURN
     # ------------------------------------
 
     # --- 履歴取得 ---
-    history_list_ref = get_channel_history(channel_id) if channel_id is not None else []
-    if history_list_ref is None and channel_id is not None:
+    history_window = get_channel_history(channel_id) if channel_id is not None else None
+    if history_window is None and channel_id is not None:
          log_error("AI_REQUEST", f"CH[{channel_id}] の履歴取得/初期化に失敗したため、リクエストを中止します。")
          return None
+    # ペルソナは全チャンネル共通のシステム指示として付ける (履歴にはコピーしない)
+    persona_instruction, persona_tokens = _get_persona_instruction(channel_id)
+    if persona_instruction is None and system_instruction:
+        persona_instruction, persona_tokens = system_instruction, estimate_tokens(system_instruction)
+    # モデルごとのトークン予算 (ペルソナの分を除く) に収まる範囲だけを送る
+    history_budget = config.get_history_token_budget(model_name) - persona_tokens
+    history_list_ref = history_window.view(history_budget) if history_window is not None else []
     # ------------------------------------
 
-    # --- APIキーリスト作成 ---
-    api_keys_to_try = []
-    for env_var in API_KEY_ENV_VARS:
-        key = os.getenv(env_var)
-        if key:
-            api_keys_to_try.append(key)
-    log_info("AI_REQUEST_DEBUG", f"読み込んだAPIキーの数: {len(api_keys_to_try)}")
-    if not api_keys_to_try:
+    # --- APIキー (起動時に読み込み済み) ---
+    if not API_KEYS:
         log_error("AI_REQUEST_ERROR", "利用可能なGemini APIキーが環境変数に見つかりません。")
         return None
     # ------------------------------------
 
-    # --- 再試行ループ ---
+    generation_config = None
+    if response_schema is not None:
+        generation_config = {"response_mime_type": "application/json", "response_schema": response_schema}
+
+    on_partial = None
+    if on_text is not None:
+        async def on_partial(raw_text: str):
+            visible = _partial_structured_message(raw_text) if response_schema is not None else raw_text
+            if not visible:
+                return
+            try:
+                await on_text(visible)
+            except Exception as e:
+                # 表示側の失敗で受信を止めない (最終的な本文は戻り値で受け取れる)
+                log_warning("AI_STREAM", f"受信途中の本文の表示に失敗しました: {e}")
+
+    # --- 再試行ループ (キーの選択はスケジューラに任せる) ---
+    scheduler = _get_key_scheduler()
+    estimated_tokens = _estimate_request_tokens(history_window, history_budget, prompt, persona_tokens)
     last_exception = None
-    successful_key = None
     response = None
-    max_retries_per_key = 1
+    lease = None
+    failed_keys = set()
+    max_attempts = len(API_KEYS) * (MAX_RETRIES_PER_KEY + 1)
+
+    for attempt in range(max_attempts):
+        lease = await scheduler.acquire(
+            model_name, estimated_tokens,
+            exclude=failed_keys,
+            max_wait=config.KEY_SCHEDULER_MAX_WAIT
+        )
+        if lease is None:
+            log_error("AI_REQUEST_RATE_LIMIT", f"全てのAPIキーが {config.KEY_SCHEDULER_MAX_WAIT}秒以内に空きませんでした。")
+            break
 
-    start_index = current_api_key_index if 0 <= current_api_key_index < len(api_keys_to_try) else 0
-    ordered_keys = api_keys_to_try[start_index:] + api_keys_to_try[:start_index]
+        key_label = f"APIキー {lease.index + 1}/{len(API_KEYS)}"
+        log_info("AI_REQUEST", f"{key_label} を使用して試行します... (試行 {attempt + 1}/{max_attempts})")
 
-    key_index_to_try = 0
-    while key_index_to_try < len(ordered_keys):
-        api_key = ordered_keys[key_index_to_try]
-        current_index_in_original_list = -1
         try:
-            current_index_in_original_list = api_keys_to_try.index(api_key)
-        except ValueError:
-             log_error("AI_REQUEST_INTERNAL", f"キーインデックスの取得に失敗: {api_key[:5]}...")
-             key_index_to_try += 1
-             continue
-
-        log_info("AI_REQUEST", f"APIキー {current_index_in_original_list + 1}/{len(api_keys_to_try)} (Index: {current_index_in_original_list}) を使用して試行します...")
-
-        retries_with_current_key = 0
-        should_wait_before_next_key = False
-        wait_duration = 0
+            response, lease = await _send_hedged(
+                scheduler, lease, model_name, history_list_ref, prompt, channel_id, estimated_tokens,
+                persona_instruction, generation_config, on_partial
+            )
+
+            if not _has_text(response):
+                feedback = getattr(response, 'prompt_feedback', None)
+                candidates = getattr(response, 'candidates', [])
+                log_error("AI_RESPONSE", "モデルからの応答に text 属性が含まれていません。")
+                last_exception = Exception(f"Invalid response object received. Feedback: {feedback}, Candidates: {candidates}")
+                scheduler.report_error(lease)
+                failed_keys.add(lease.index)
+                response = None
+                continue
+
+            # 成功！
+            used_tokens = None
+            usage = getattr(response, 'usage_metadata', None)
+            if usage:
+                used_tokens = usage.total_token_count
+            scheduler.report_success(lease, used_tokens)
+            current_api_key_index = lease.index
+            log_success("AI_RESPONSE", f"APIキー {lease.index + 1} で応答を受信しました。")
+            break
 
-        while retries_with_current_key <= max_retries_per_key:
+        except google.api_core.exceptions.ResourceExhausted as e:
+            log_warning("AI_REQUEST_RATE_LIMIT", f"レート制限エラー発生 ({key_label}): {e}")
+            last_exception = e
+            retry_delay_seconds = 60
             try:
-                genai.configure(api_key=api_key)
-                model = genai.GenerativeModel(model_name)
+                match = re.search(r"Please retry in (\d+\.?\d*)s", str(e))
+                if match: retry_delay_seconds = float(match.group(1)) + 1.5
+            except Exception:
+                pass
+            # このキーを休ませ、待たずに空いている別のキーで再試行する
+            scheduler.report_rate_limited(lease, retry_delay_seconds)
+
+        except asyncio.TimeoutError:
+            log_error("AI_REQUEST_ERROR", f"APIリクエストがタイムアウトしました ({key_label})。")
+            last_exception = asyncio.TimeoutError("API request timed out.")
+            scheduler.report_error(lease)
+            failed_keys.add(lease.index)
+            log_info("AI_REQUEST", "待機せずに次のAPIキーへ切り替えます。")
+
+        except genai.types.StopCandidateException as e:
+            log_error("AI_REQUEST_SAFETY", f"コンテンツが安全性によりブロックされました ({key_label}): {e}")
+            last_exception = e
+            scheduler.release(lease)
+            # 安全性によるブロックは別のキーで送っても同じ結果になるので、再試行しない
+            break
 
-                if not history_list_ref or history_list_ref[0].get("role") != "user":
-                     log_warning("AI_REQUEST_HISTORY_WARN", f"CH[{channel_id}] の履歴が空か、最初の要素が'user'ではありません。API呼び出しに失敗する可能性があります。")
-                     chat = model.start_chat(history=[])
-                else:
-                     chat = model.start_chat(history=history_list_ref)
-
-                log_info("AI_REQUEST", f"モデル '{model_name}' にリクエストを送信します...")
-                try:
-                    api_timeout = config.get_api_timeout()
-                except AttributeError:
-                    log_warning("AI_REQUEST_CONFIG", "configにget_api_timeoutが見つかりません。デフォルトの120秒を使用します。")
-                    api_timeout = 120
-
-                response = await asyncio.wait_for(
-                    chat.send_message_async(prompt),
-                    timeout=api_timeout
-                )
-                log_info("AI_REQUEST_DEBUG", "chat.send_message_async の呼び出しが完了しました。")
-
-                if not hasattr(response, 'text'):
-                     feedback = getattr(response, 'prompt_feedback', None)
-                     candidates = getattr(response, 'candidates', [])
-                     log_error("AI_RESPONSE", "モデルからの応答に text 属性が含まれていません。")
-                     last_exception = Exception(f"Invalid response object received. Feedback: {feedback}, Candidates: {candidates}")
-                     retries_with_current_key = max_retries_per_key + 1
-                     continue
-
-                # 成功！
-                successful_key = api_key
-                current_api_key_index = current_index_in_original_list
-                log_success("AI_RESPONSE", f"APIキー {current_index_in_original_list + 1} で応答を受信しました。")
-                break
+        except asyncio.CancelledError:
+            scheduler.release(lease)
+            raise
 
-            except google.api_core.exceptions.ResourceExhausted as e:
-                log_warning("AI_REQUEST_RATE_LIMIT", f"レート制限エラー発生 (APIキー {current_index_in_original_list + 1}): {e}")
+        except Exception as e:
+            if "history must begin with a user message" in str(e) or "must alternate between" in str(e):
+                log_error("AI_REQUEST_HISTORY_INVALID", f"履歴形式エラー: {e}")
                 last_exception = e
-                retries_with_current_key += 1
-                retry_delay_seconds = 60
-                try:
-                    match = re.search(r"Please retry in (\d+\.?\d*)s", str(e))
-                    if match: retry_delay_seconds = float(match.group(1)) + 1.5
-                except Exception:
-                    pass
-                wait_duration = retry_delay_seconds
-                should_wait_before_next_key = True
-                
-                if retries_with_current_key <= max_retries_per_key:
-                    log_info("AI_REQUEST_RATE_LIMIT", f"{retry_delay_seconds:.1f}秒待機してから同じAPIキーで再試行します...")
-                    await asyncio.sleep(retry_delay_seconds)
-                    continue
-                else:
-                    log_warning("AI_REQUEST_RATE_LIMIT", f"APIキー {current_index_in_original_list + 1} での再試行上限に達しました。")
-                    break
-
-            except asyncio.TimeoutError:
-                # (タイムアウトエラーの処理 - 待機せず次のキーへ)
-                log_error("AI_REQUEST_ERROR", f"APIリクエストがタイムアウトしました (APIキー {current_index_in_original_list + 1})。")
-                last_exception = asyncio.TimeoutError("API request timed out.")
-                
-                # ★ 修正: 待機フラグをFalseにし、即座に次のキーへ移行
-                should_wait_before_next_key = False
-                wait_duration = 0
-                retries_with_current_key = max_retries_per_key + 1 # 現在のキーでのループを抜ける
-                
-                log_info("AI_REQUEST", "待機せずに次のAPIキーへ切り替えます。")
+                scheduler.release(lease)
                 break
+            log_error("AI_REQUEST_ERROR", f"予期せぬエラー ({key_label}): {type(e).__name__} - {e}")
+            last_exception = e
+            scheduler.report_error(lease)
+            failed_keys.add(lease.index)
+    # --- 再試行ループ終了 ---
 
-            except genai.types.StopCandidateException as e:
-                 log_error("AI_REQUEST_SAFETY", f"コンテンツが安全性によりブロックされました (APIキー {current_index_in_original_list + 1}): {e}")
-                 last_exception = e
-                 retries_with_current_key = max_retries_per_key + 1
-                 break
-
-            except Exception as e:
-                if "history must begin with a user message" in str(e) or "must alternate between" in str(e):
-                    log_error("AI_REQUEST_HISTORY_INVALID", f"履歴形式エラー: {e}")
-                    last_exception = e
-                    successful_key = None
-                    key_index_to_try = len(ordered_keys)
-                    break
-                else:
-                    log_error("AI_REQUEST_ERROR", f"予期せぬエラー (APIキー {current_index_in_original_list + 1}): {type(e).__name__} - {e}")
-                    last_exception = e
-                    retries_with_current_key = max_retries_per_key + 1
-                    break
-        # --- 内側ループ終了 ---
-
-        if successful_key:
-            break
-
-        if should_wait_before_next_key and wait_duration > 0:
-            log_info("AI_REQUEST_RATE_LIMIT", f"{wait_duration:.1f}秒待機してから次のAPIキーを試します...")
-            await asyncio.sleep(wait_duration)
-
-        key_index_to_try += 1
-    # --- 外側ループ終了 ---
-
-    if successful_key is None:
+    if response is None:
         log_error("AI_REQUEST_FATAL", "すべてのAPIキーと再試行でリクエストに失敗しました。")
         if last_exception:
              log_error("AI_REQUEST_FATAL", f"最後の試行でのエラー: {type(last_exception).__name__} - {last_exception}")
@@ -294,14 +635,18 @@ async def send_request(model_name: str, prompt: str, channel_id: int = None):
 
     # --- 成功時の処理 ---
     response_text = response.text
+    result = response_text
+    if response_schema is not None:
+        result = _parse_structured_reply(response_text)
+        response_text = result["message"]
 
     if channel_id is not None:
         log_info("AI_REQUEST_HISTORY_ADD", f"履歴追加処理を開始: channel_id={channel_id}")
         try:
             if user_message_content:
-                add_message_to_history(channel_id, "user", user_message_content)
+                add_message_to_history(channel_id, "user", user_message_content, model_name)
             if response_text:
-                 add_message_to_history(channel_id, "model", response_text)
+                 add_message_to_history(channel_id, "model", response_text, model_name)
         except Exception as history_error:
             log_error("AI_REQUEST_HISTORY_ADD", f"履歴追加中にエラー: {history_error}")
 
@@ -314,7 +659,43 @@ async def send_request(model_name: str, prompt: str, channel_id: int = None):
     except Exception as token_error:
         log_error("AI_REQUEST_TOKEN_LOG", f"トークン数ログ出力中にエラー: {token_error}")
 
-    return response_text
+    return result
+
+def _parse_structured_reply(text: str) -> dict:
+    """
+    JSONで返された応答を辞書にする。
+    JSONとして読めない場合は、応答全体を本文として扱う (他のキーは含まない)。
+    """
+    cleaned = text.strip().replace('```json', '').replace('```', '').strip()
+    try:
+        data = json.loads(cleaned)
+    except json.JSONDecodeError:
+        data = None
+    if isinstance(data, dict) and isinstance(data.get("message"), str):
+        return data
+    log_warning("AI_RESPONSE", "構造化応答をJSONとして解釈できませんでした。応答全体を本文として扱います。")
+    return {"message": text}
+
+# JSON応答の "message" の値の開始位置
+_MESSAGE_FIELD_PATTERN = re.compile(r'"message"\s*:\s*"')
+# JSON文字列の中身として完結している部分 (途中で切れたエスケープは含まない)
+_JSON_STRING_BODY_PATTERN = re.compile(r'(?:[^"\\]|\\.)*', re.S)
+
+def _partial_structured_message(raw_text: str) -> str:
+    """
+    受信途中のJSON応答から、"message" の受信済みの部分を取り出す。
+    まだ "message" を受信していない場合は空文字列を返す。
+    """
+    match = _MESSAGE_FIELD_PATTERN.search(raw_text)
+    if not match:
+        return ""
+    fragment = _JSON_STRING_BODY_PATTERN.match(raw_text, match.end()).group(0)
+    # \uXXXX が途中で切れている場合は、その手前までにする
+    fragment = re.sub(r'\\u[0-9a-fA-F]{0,3}$', '', fragment)
+    try:
+        return json.loads(f'"{fragment}"', strict=False)
+    except json.JSONDecodeError:
+        return ""
 
 # --- cogs/commands.py から呼び出される関数群 ---
 
@@ -326,7 +707,11 @@ def get_history_for_channel(channel_id: int):
     return data_manager.get_history_for_channel(channel_id)
 
 def load_persona() -> bool:
+    # キャッシュを破棄してファイルから読み直す (感情分析ペルソナも次回使用時に読み直される)
+    prompt_assets.invalidate()
     return data_manager.load_persona() is not None
 
 def apply_persona_to_channel(channel_id: int):
+    # ペルソナは送信のたびにファイルのキャッシュから付けるので、最新の内容を読み直してから会話を初期化する
+    prompt_assets.invalidate(config.PERSONA_FILE)
     data_manager.apply_persona_to_channel(channel_id)
\ No newline at end of file
@@ -0,0 +1,30 @@
+import time
+import utils.config_manager as config
+
+def channel_score(unread_log, priority: float, now: float, unread_weight: float, age_weight_per_minute: float) -> float:
+    """
+    1チャンネルの処理の優先度を計算する。
+    チャンネルの優先度 × (1 + 未読件数 × 重み + 最古の未読メッセージの経過分数 × 重み)
+    """
+    oldest = next((e.get('received_at') for e in unread_log if e.get('received_at')), None)
+    age_minutes = max(0.0, now - oldest) / 60 if oldest else 0.0
+    return priority * (1 + unread_weight * len(unread_log) + age_weight_per_minute * age_minutes)
+
+def rank_channels(unread_data: dict, channel_settings: dict, now: float = None) -> list:
+    """
+    未読メッセージのあるチャンネルを、処理の優先度が高い順に [(チャンネルID, スコア), ...] で返す。
+    チャンネルの優先度は channel_settings の priority (既定は SCHEDULER_DEFAULT_PRIORITY)。
+    優先度が0以下のチャンネルは含めない。
+    """
+    now = time.time() if now is None else now
+    ranked = []
+    for channel_id, unread_log in unread_data.items():
+        if not unread_log:
+            continue
+        priority = channel_settings.get(channel_id, {}).get('priority', config.SCHEDULER_DEFAULT_PRIORITY)
+        if priority <= 0:
+            continue
+        score = channel_score(unread_log, priority, now, config.SCHEDULER_UNREAD_WEIGHT, config.SCHEDULER_AGE_WEIGHT_PER_MINUTE)
+        ranked.append((channel_id, score))
+    ranked.sort(key=lambda item: item[1], reverse=True)
+    return ranked
@@ -17,6 +17,7 @@ UNREAD_MESSAGES_FILE = ""
 EMOTION_FILE = ""
 SCHEDULE_FILE = ""
 MEMORY_FILE = ""
+SQLITE_FILE = ""
 
 GEMINI_API_KEY_1 = os.getenv("GEMINI_API_KEY_1")
 GEMINI_API_KEY_2 = os.getenv("GEMINI_API_KEY_2")
@@ -31,17 +32,170 @@ MODEL_FLASH = 'gemini-2.0-flash'
 # APIリクエストのタイムアウト時間 (秒)
 API_TIMEOUT = 120 # 例: 120秒
 
-# 履歴の最大長 (会話ターン数ではなく、user/modelメッセージの合計数)
-# 例: 50件 = 25往復分程度
-MAX_HISTORY_LENGTH = 200
+# 履歴のトークン予算 (モデルごと、ペルソナを含む推定トークン数)
+# 予算を超えると古いターンから削除され、予算の小さいモデルには収まる範囲だけが送られる
+HISTORY_TOKEN_BUDGETS = {
+    MODEL_PRO: 48000,
+    MODEL_PRO_3: 24000,
+    MODEL_FLASH: 24000,
+}
+DEFAULT_HISTORY_TOKEN_BUDGET = 32000
+
+# 履歴の要約 (コンパクション)
+# 有効な場合、履歴は HISTORY_COMPACTION_BUDGET まで切り詰め、
+# 削除されたターンは軽量モデル (MODEL_PRO_3) でチャンネルごとの要約に畳み込む
+HISTORY_COMPACTION_ENABLED = True
+HISTORY_COMPACTION_BUDGET = 6000
+# 要約の最大文字数
+HISTORY_SUMMARY_MAX_CHARS = 1200
+# 要約に失敗したとき、次回に回す削除済みターンの最大数
+HISTORY_COMPACTION_MAX_PENDING = 40
+
+# 過去ログの保管庫: 履歴から外れたターンをチャンネルごとに保管し (追記のみ)、
+# 未読メッセージとの関連度 (BM25) が高い過去のターンを最大件数と推定トークン数の範囲でプロンプトに戻す
+ARCHIVE_ENABLED = True
+ARCHIVE_RECALL_TOP_K = 3
+ARCHIVE_RECALL_TOKEN_BUDGET = 800
+# 関連度 (BM25 スコア) がこの値未満のターンは戻さない
+ARCHIVE_RECALL_MIN_SCORE = 1.0
+# 戻す1ターンあたりの最大文字数
+ARCHIVE_RECALL_MAX_CHARS = 300
+
+# プロンプトに入れる記憶: 未読メッセージとの関連度 (BM25) が高い順に、最大件数と推定トークン数の範囲で選ぶ
+MEMORY_PROMPT_TOP_K = 8
+MEMORY_PROMPT_TOKEN_BUDGET = 600
+# 埋め込み関数を設定した場合の、ベクトル類似度の重み (0.0〜1.0、残りは BM25)
+MEMORY_EMBEDDING_WEIGHT = 0.5
+# !mem list の1ページあたりの件数
+MEMORY_LIST_PAGE_SIZE = 10
+
+# 記憶の統合: 活動の少ない時間帯 (スケジュール上で待機時間が最も長いレベルの時間) に、
+# 重複した記憶 (文字2-gramが互いにしきい値以上含まれ、数字が一致する記憶) を1件にまとめ、
+# 新しい記憶に置き換えられた古い記憶 (軽量モデルで判定) を削除する
+MEMORY_CONSOLIDATION_ENABLED = True
+# True の場合はまとめる記憶と統合後の文章をログに出すだけで、記憶は変更しない
+MEMORY_CONSOLIDATION_DRY_RUN = False
+# 置き換えられた古い記憶の削除は、軽量モデルの一度の判定で記憶が消えるため明示的に有効にした場合だけ行う
+# (False の場合は判定結果をログに出すだけで、古い記憶は残す)
+MEMORY_CONSOLIDATION_SUPERSEDE_ENABLED = False
+MEMORY_CONSOLIDATION_INTERVAL_HOURS = 24
+# 2つの記憶の語が互いにこの割合以上含まれていれば重複とみなす
+MEMORY_CONSOLIDATION_SIMILARITY = 0.95
+# 重複ではないが文字2-gramの Jaccard 係数がこの値以上の記憶の組は、新しい方に置き換えられたかを軽量モデルで判定する
+MEMORY_CONSOLIDATION_SUPERSEDE_SIMILARITY = 0.5
+# True の場合は軽量モデル (MODEL_PRO_3) で文章の統合と置き換えの判定を行う
+# (False や失敗時は、全く同じ文章の記憶だけをまとめ、置き換えられた記憶は削除しない)
+MEMORY_CONSOLIDATION_USE_LLM = True
+# 軽量モデルの逼迫度がこの値以上の間は、文章の統合を見送る
+MEMORY_CONSOLIDATION_PRESSURE_THRESHOLD = 0.5
+
+# 活動サイクルのスケジューラ: 未読メッセージのある全チャンネルを優先度の高い順に並べ、
+# 同時に最大 SCHEDULER_MAX_CONCURRENCY チャンネルまで並行して処理する
+# (スケジュールの activity_params の各レベルに "concurrency" を書くと、そのレベルの同時処理数を上書きできる)
+# 優先度 = チャンネルの優先度 × (1 + 未読件数 × SCHEDULER_UNREAD_WEIGHT + 最古の未読の経過分数 × SCHEDULER_AGE_WEIGHT_PER_MINUTE)
+SCHEDULER_MAX_CONCURRENCY = 2
+SCHEDULER_UNREAD_WEIGHT = 1.0
+SCHEDULER_AGE_WEIGHT_PER_MINUTE = 0.1
+# チャンネルの優先度の既定値 (channel_settings の "priority" で上書き、0以下なら自動では処理しない)
+SCHEDULER_DEFAULT_PRIORITY = 1.0
+
+# 緊急のメッセージ (Botへのメンション・Botへのリプライ・DM・キーワード) を受信したら、定期サイクルを待たずに応答する
+# 応答までの目標時間 (秒) はスケジュールの activity_params の各レベルの "urgent_latency" で決める (未設定ならこの値)
+# 期限が来たチャンネルは同時処理数の制限を受けずに処理を始める (連投のまとめ (BURST_*) の待機は行う)
+URGENT_DEFAULT_LATENCY_SECONDS = 30
+# メッセージにこれらの語が含まれていれば緊急として扱う (大文字小文字は区別しない)
+URGENT_KEYWORDS = []
+
+# 連投のまとめ: 未読メッセージに応答する前に、チャンネルが静かになるまで待ち、連投をまとめて1回のリクエストにする
+# 最後のメッセージからこの秒数だけ新しいメッセージがなく、入力中のユーザーもいなければ連投は終わったとみなす
+BURST_QUIET_SECONDS = 4.0
+# 入力中表示 (on_typing) の有効秒数 (Discord の入力中表示は約10秒で消える)
+BURST_TYPING_TIMEOUT_SECONDS = 10.0
+# 連投が続いていても、待ち始めてからこの秒数が経ったら応答する
+BURST_MAX_WAIT_SECONDS = 20.0
+
+# ストリーミング応答: 応答を受信しながら、最初の文がそろった時点で投稿し、以降は一定間隔で編集して続きを表示する
+# (ヘッジリクエスト (HEDGE_ENABLED) との併用時の動作は HEDGE_ENABLED の説明を参照)
+STREAM_ENABLED = os.getenv("STREAM_ENABLED", "1") == "1"
+# 表示を更新 (編集) する最短間隔 (秒、Discord の編集のレート制限に合わせる)
+STREAM_EDIT_INTERVAL_SECONDS = 1.5
+# 文の区切りが来ないまま、書きかけの部分がこの文字数に達したら、区切りを待たずに表示する
+STREAM_FIRST_CHUNK_MAX_CHARS = 120
+
+# 永続化バックエンド ("mongo" または "sqlite")
+# sqlite の場合は instances/<キャラクター名>/data/storage.sqlite3 に保存する
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "mongo")
+
+# DB書き込みのデバウンス設定 (write-behind)
+# 最後の保存要求からこの秒数だけ静かになったらまとめて書き込む
+PERSIST_DEBOUNCE_SECONDS = 2.0
+# 保存要求が続いていても、最初の要求からこの秒数が経ったら書き込む
+PERSIST_MAX_DELAY_SECONDS = 10.0
+# 同時に実行するDB書き込みの上限
+PERSIST_MAX_IN_FLIGHT = 4
+# DB専用スレッドプールのスレッド数 (読み込み・書き込み共通)
+DB_EXECUTOR_WORKERS = 6
+
+# APIキー×モデルごとのレート上限 (1分あたりのリクエスト数 / トークン数)
+MODEL_RATE_LIMITS = {
+    'gemini-2.5-flash': {'rpm': 10, 'tpm': 250000},
+    'gemini-2.5-flash-lite': {'rpm': 15, 'tpm': 250000},
+    'gemini-2.0-flash': {'rpm': 15, 'tpm': 1000000},
+}
+DEFAULT_RATE_LIMIT = {'rpm': 10, 'tpm': 250000}
+
+# 全てのAPIキーが上限に達しているとき、空きを待つ最大秒数
+KEY_SCHEDULER_MAX_WAIT = 90
+
+# ヘッジリクエスト: 応答が遅いとき、別のAPIキーで同じリクエストを並行して送る
+# ストリーミング (STREAM_ENABLED) と併用した場合、ヘッジするのは最初のチャンクが届くまでで、ヘッジ側は一括で受信する
+# (ヘッジ側が勝つと最初の表示までの時間は短くなりうるが、本文は途中経過なしでまとめて表示される。
+#  プライマリが表示を始めた後は、表示中の応答が入れ替わらないよう、遅くてもヘッジしない)
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "0") == "1"
+# 過去の応答時間のこのパーセンタイルを超えたらヘッジを送る
+HEDGE_PERCENTILE = 0.95
+# パーセンタイルを使うのに必要な最小サンプル数 (足りない間は HEDGE_DEFAULT_DELAY を使う)
+HEDGE_MIN_SAMPLES = 10
+HEDGE_DEFAULT_DELAY = 20.0
+HEDGE_MIN_DELAY = 2.0
+
+# 応答本文と感情の変化量を1回のリクエスト (JSON応答) でまとめて受け取る
+# 変化量が得られなかった場合は、従来どおり別リクエストで感情分析を行う
+EMOTION_COMBINED_ENABLED = os.getenv("EMOTION_COMBINED_ENABLED", "1") == "1"
+# 別リクエストでの感情分析はバックグラウンドで行い、この秒数の間に届いた対話を1回のリクエストにまとめる
+EMOTION_BATCH_WINDOW_SECONDS = 5.0
+# 1回の感情分析リクエストにまとめる対話の最大数
+EMOTION_BATCH_MAX_EXCHANGES = 5
+# 別リクエストでの感情分析の方法
+# "auto": 通常はAIで分析し、レート上限が逼迫しているときはキーワード表 (emotion_lexicon) で推定する
+# "llm": 常にAIで分析する / "lexicon": 常にキーワード表で推定する (APIを使わない)
+EMOTION_ESTIMATOR = os.getenv("EMOTION_ESTIMATOR", "auto")
+# 応答用・感情分析用モデルの逼迫度がこの値以上ならキーワード表に切り替える
+EMOTION_LEXICON_PRESSURE_THRESHOLD = 0.8
+# キーワード表で推定する1対話あたりの変化量の上限
+EMOTION_LEXICON_MAX_DELTA = 20
+# キーワード表で推定する間、対話1件ごとに各感情を基準値 (default_emotions) との差のこの割合だけ戻す
+EMOTION_LEXICON_DECAY_RATE = 0.05
+
+# プレフィックスキャッシュ: ペルソナなどの静的なシステム指示をモデルごとにサーバー側へ登録し、
+# 以降のリクエストでは変化する部分だけを送る
+# "gemini": Gemini のコンテキストキャッシュを使う / "local": 通信しない偽実装 (計測のみ) / "off": 使わない
+PREFIX_CACHE_MODE = os.getenv("PREFIX_CACHE_MODE", "gemini")
+PREFIX_CACHE_TTL_SECONDS = 3600
+# 期限切れの少し前に作り直す
+PREFIX_CACHE_REFRESH_MARGIN_SECONDS = 120
+# これより短い (推定トークン数が少ない) 指示はキャッシュしない (Gemini 側の最小トークン数)
+PREFIX_CACHE_MIN_TOKENS = 1024
+# 作成に失敗した指示は、この秒数の間キャッシュを試さずに通常の送信を行う
+PREFIX_CACHE_RETRY_SECONDS = 3600
 
 def get_api_timeout():
     """APIリクエストのタイムアウト時間を取得"""
     return API_TIMEOUT
 
-def get_max_history_length():
-    """履歴の最大長を取得"""
-    return MAX_HISTORY_LENGTH
+def get_history_token_budget(model_name: str = None) -> int:
+    """モデルごとの履歴のトークン予算を取得 (モデル未指定ならメインモデルの予算)"""
+    return HISTORY_TOKEN_BUDGETS.get(model_name or MODEL_PRO, DEFAULT_HISTORY_TOKEN_BUDGET)
 
 # discord.Bot インスタンスを保持 (ai_request_handler.py からアクセスするため)
 bot = None
@@ -66,7 +220,7 @@ def init(character_name: str):
     """
     global CHARACTER_NAME, BASE_DIR, DATA_DIR, TOKEN_ENV_VAR, PERSONA_FILE
     global EMOTION_ANALYZER_PERSONA_FILE, SETTING_FILE, HISTORY_FILE
-    global UNREAD_MESSAGES_FILE, EMOTION_FILE, SCHEDULE_FILE, MEMORY_FILE
+    global UNREAD_MESSAGES_FILE, EMOTION_FILE, SCHEDULE_FILE, MEMORY_FILE, SQLITE_FILE
     
     CHARACTER_NAME = character_name
     log_system(f"キャラクター '{CHARACTER_NAME}' の設定を初期化します。")
@@ -93,6 +247,7 @@ def init(character_name: str):
     EMOTION_FILE = os.path.join(DATA_DIR, "emotion.json")
     SCHEDULE_FILE = os.path.join(DATA_DIR, "schedule.json")
     MEMORY_FILE = os.path.join(DATA_DIR, "memory.json")
+    SQLITE_FILE = os.path.join(DATA_DIR, "storage.sqlite3")
 
 # --- 環境変数 (ここのロジックは簡略化) ---
     # setting.jsonを読み込んでトークン名を探すロジックは、
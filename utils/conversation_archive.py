@@ -0,0 +1,58 @@
+from datetime import datetime
+from utils.memory_index import MemoryIndex
+from utils.token_estimator import estimate_tokens
+
+class ConversationArchive:
+    """
+    1チャンネル分の、履歴から外れた古いターンの保管庫 (追記のみ)。
+    各ターンには単調増加の通し番号 (seq) を振り、BM25 の転置インデックスで検索できるようにしておく。
+    エントリは {seq, role, text, archived_at}。
+    """
+    def __init__(self, entries: list = None):
+        self.entries = {}  # seq -> エントリ
+        self.index = MemoryIndex()
+        self.last_seq = 0
+        for entry in entries or []:
+            self._add(entry)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _add(self, entry: dict):
+        self.entries[entry['seq']] = entry
+        self.index.add(entry['seq'], entry['text'])
+        self.last_seq = max(self.last_seq, entry['seq'])
+
+    def append_turns(self, turns: list) -> list:
+        """履歴のターン ({role, parts}) を保管し、追加したエントリを返す"""
+        archived_at = datetime.now().isoformat(timespec='seconds')
+        added = []
+        for turn in turns:
+            text = "\n".join(p for p in turn.get("parts", []) if isinstance(p, str)).strip()
+            if not text:
+                continue
+            entry = {"seq": self.last_seq + 1, "role": turn.get("role", "user"), "text": text, "archived_at": archived_at}
+            self._add(entry)
+            added.append(entry)
+        return added
+
+    def recall(self, query: str, top_k: int, token_budget: int, min_score: float = 0.0, max_chars: int = None) -> list:
+        """
+        query に関連する過去のターンを、関連度の高い順に最大 top_k 件・推定 token_budget トークンまで選び、
+        古い順 (seq 順) に並べて返す。
+        """
+        if not query or not self.entries:
+            return []
+        selected = []
+        used_tokens = 0
+        for seq, score in self.index.search(query, top_k * 3):
+            if len(selected) >= top_k or score < min_score:
+                break
+            entry = self.entries[seq]
+            text = entry['text'] if max_chars is None else entry['text'][:max_chars]
+            tokens = estimate_tokens(text)
+            if used_tokens + tokens > token_budget:
+                continue
+            used_tokens += tokens
+            selected.append(dict(entry, text=text))
+        return sorted(selected, key=lambda e: e['seq'])
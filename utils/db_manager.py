@@ -1,116 +1,435 @@
-import os
-import pymongo
-import threading  # ★ 追加
-import copy       # ★ 追加
+import asyncio
+import functools
+import copy
+from concurrent.futures import ThreadPoolExecutor
 from utils.console_display import log_system, log_error, log_success
+from utils.write_behind import WriteOp, WriteBehindQueue
+from utils.storage import StorageBackend, create_backend
+from utils.history_window import HistoryWindow
+from utils.conversation_archive import ConversationArchive
+from utils.unread_log import UnreadLog
 import utils.config_manager as config
 
 # グローバル変数
-_db_client = None
-_db = None
+_backend: StorageBackend | None = None
 _data_cache = {}
 
-# データキーとMongoDBのコレクション名をマッピング
-COLLECTION_MAP = {
-    'emotion': 'emotion',
-    'setting': 'setting',
-    'memory': 'memory',
-    'schedule': 'schedule',
-    'history': 'history',
-    'unread': 'unread'
-}
-
-def init_db():
-    global _db_client, _db
+# キャッシュするデータキー
+DATA_KEYS = ['emotion', 'setting', 'memory', 'schedule', 'history', 'unread', 'archive']
+
+_db_executor = None
+
+def _get_executor() -> ThreadPoolExecutor:
+    """
+    DB専用の実行スレッドプール。
+    バックエンドの呼び出しは全てここで行い、discord.py のイベントループ（ハートビート等）を止めない。
+    """
+    global _db_executor
+    if _db_executor is None:
+        _db_executor = ThreadPoolExecutor(max_workers=config.DB_EXECUTOR_WORKERS, thread_name_prefix="db")
+    return _db_executor
+
+async def _run_db(fn, *args):
+    """ブロッキングなDB処理をDB専用スレッドで実行し、結果を待つ"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), functools.partial(fn, *args))
+
+async def init_db():
+    global _backend
     try:
-        uri = os.getenv("MONGODB_URI")
-        db_name = os.getenv("DB_NAME", config.CHARACTER_NAME)
-
-        if not uri:
-            log_error("DB_MANAGER", "環境変数 'MONGODB_URI' が設定されていません。")
-            return False
-        
-        _db_client = pymongo.MongoClient(uri)
-        _db = _db_client[db_name]
-        
-        log_system(f"データベース '{db_name}' への接続に成功しました。")
+        backend = create_backend(config.STORAGE_BACKEND)
+        await _run_db(backend.connect)
+        _backend = backend
+        log_system(f"ストレージバックエンド '{backend.name}' を使用します。")
         return True
     except Exception as e:
         log_error("DB_MANAGER", f"データベース接続中にエラー: {e}")
         return False
 
-def load_all_data():
-    if _db is None:
+async def load_all_data():
+    if _backend is None:
         log_error("DB_MANAGER", "DBが初期化されていません。load_all_dataをスキップします。")
         return
 
-    global _data_cache
-    
-    for key, collection_name in COLLECTION_MAP.items():
+    for key in DATA_KEYS:
+        _data_cache[key] = await _run_db(_load_key, key)
+
+    log_system("全てのデータをDBからメモリにロードしました。")
+
+async def reload_data(key: str) -> bool:
+    """
+    指定キーのデータをDBから読み直し、メモリキャッシュを置き換える。
+    未反映の書き込みが先に消えないよう、読み込み前に保留中の書き込みをフラッシュする。
+    """
+    if _backend is None or key not in DATA_KEYS:
+        return False
+    try:
+        await flush_pending()
+        _data_cache[key] = await _run_db(_load_key, key)
+        log_success("DB_MANAGER", f"'{key}' のデータをDBから再読み込みしました。")
+        return True
+    except Exception as e:
+        log_error("DB_MANAGER", f"データの再読み込み中にエラー({key}): {e}")
+        return False
+
+def _load_key(key: str):
+    """1キー分のデータを読み込む（DB専用スレッドで実行される）"""
+    if key == 'history':
         try:
-            collection = _db[collection_name]
-            data = collection.find_one()
-
-            if data:
-                _data_cache[key] = data.get('data', {})
-            else:
-                log_system(f"DBに '{collection_name}' のデータがないため、初期化します。")
-                default_data = {}
-                if key in ['memory']:
-                    default_data = []
-
-                collection.find_one_and_update(
-                    {},
-                    {"$setOnInsert": {"data": default_data}},
-                    upsert=True
-                )
-                _data_cache[key] = default_data
+            summaries = _backend.load_history_summaries()
+            histories = {}
+            for channel_id, messages in _backend.load_histories().items():
+                window = HistoryWindow(messages)
+                window.set_summary(summaries.get(channel_id, ""))
+                histories[channel_id] = window
+            return histories
         except Exception as e:
-             log_error("DB_MANAGER", f"データのロード中にエラー({key}): {e}")
-             _data_cache[key] = {} if key != 'memory' else []
+            log_error("DB_MANAGER", f"履歴のロード中にエラー: {e}")
+            return {}
 
-    log_system("全てのデータをDBからメモリにロードしました。")
+    if key == 'memory':
+        # 記憶は {ID: レコード} (ID順) で持つ
+        try:
+            return {record['id']: record for record in _backend.load_memories()}
+        except Exception as e:
+            log_error("DB_MANAGER", f"記憶のロード中にエラー: {e}")
+            return {}
+
+    if key == 'unread':
+        # 未読メッセージは {チャンネルID: UnreadLog} で持つ
+        try:
+            cursors = _backend.load_unread_cursors()
+            entries = _backend.load_unread()
+            return {
+                channel_id: UnreadLog(entries.get(channel_id), cursors.get(channel_id, 0))
+                for channel_id in set(entries) | set(cursors)
+            }
+        except Exception as e:
+            log_error("DB_MANAGER", f"未読メッセージのロード中にエラー: {e}")
+            return {}
+
+    if key == 'archive':
+        # 保管庫は {チャンネルID: ConversationArchive} で持つ (検索用のインデックスはロード時に作る)
+        try:
+            return {channel_id: ConversationArchive(entries) for channel_id, entries in _backend.load_archives().items()}
+        except Exception as e:
+            log_error("DB_MANAGER", f"過去ログの保管庫のロード中にエラー: {e}")
+            return {}
 
-# ★★★ 内部用: 実際にDBに書き込む関数（別スレッドで動く） ★★★
-def _save_worker(collection_name, data_copy):
     try:
-        _db[collection_name].update_one(
-            {},
-            {"$set": {"data": data_copy}},
-            upsert=True
-        )
+        data = _backend.load(key)
+        if data is not None:
+            return data
+
+        log_system(f"DBに '{key}' のデータがないため、初期化します。")
+        default_data = {}
+        _backend.init_default(key, default_data)
+        return default_data
     except Exception as e:
-        print(f"![DB_BG_SAVE_ERROR] {collection_name} の保存失敗: {e}")
+        log_error("DB_MANAGER", f"データのロード中にエラー({key}): {e}")
+        return {}
+
+# --- 書き込み操作 (write-behind キューでまとめて実行される) ---
+
+class _SnapshotOp(WriteOp):
+    """キー全体を保存する。コピーはフラッシュ時に1回だけ取る。"""
+    def __init__(self, key: str, data):
+        self.key = key
+        self.data = data
+
+    def prepare(self):
+        data_copy = copy.deepcopy(self.data)
+        backend = _backend
+        return lambda: backend.save(self.key, data_copy)
+
+class _HistoryReplaceOp(WriteOp):
+    """1チャンネル分の履歴を丸ごと書き込む"""
+    def __init__(self, channel_id: str):
+        self.channel_id = channel_id
+
+    def prepare(self):
+        messages = copy.deepcopy(list(_data_cache.get('history', {}).get(self.channel_id, [])))
+        backend = _backend
+        return lambda: backend.replace_history(self.channel_id, messages)
+
+class _HistoryAppendOp(WriteOp):
+    """
+    1チャンネル分の履歴に entries を追記する。連続した追記は1回の書き込みに合体する。
+    メモリ上で古いターンが削除されていても、DB側の件数をメモリ上の履歴に揃える。
+    """
+    def __init__(self, channel_id: str, entries: list):
+        self.channel_id = channel_id
+        self.entries = entries
+
+    def merge(self, newer):
+        if isinstance(newer, _HistoryAppendOp):
+            return _HistoryAppendOp(self.channel_id, self.entries + newer.entries)
+        return newer
+
+    def prepare(self):
+        history = _data_cache.get('history', {}).get(self.channel_id, [])
+        keep = max(len(history), len(self.entries))
+        entries = copy.deepcopy(self.entries)
+        backend = _backend
+        return lambda: backend.append_history(self.channel_id, entries, keep)
+
+class _HistorySummaryOp(WriteOp):
+    """1チャンネル分の履歴の要約を書き込む"""
+    def __init__(self, channel_id: str):
+        self.channel_id = channel_id
+
+    def prepare(self):
+        history = _data_cache.get('history', {}).get(self.channel_id)
+        summary = history.summary if history is not None else ""
+        backend = _backend
+        return lambda: backend.save_history_summary(self.channel_id, summary)
+
+class _HistoryResetOp(WriteOp):
+    """全チャンネルの履歴を削除する"""
+    barrier = True
+
+    def prepare(self):
+        return _backend.reset_histories
+
+class _ArchiveAppendOp(WriteOp):
+    """1チャンネル分の保管庫に entries を追記する。連続した追記は1回の書き込みに合体する。"""
+    def __init__(self, channel_id: str, entries: list):
+        self.channel_id = channel_id
+        self.entries = entries
+
+    def merge(self, newer):
+        if isinstance(newer, _ArchiveAppendOp):
+            return _ArchiveAppendOp(self.channel_id, self.entries + newer.entries)
+        return newer
+
+    def prepare(self):
+        entries = [dict(entry) for entry in self.entries]
+        backend = _backend
+        return lambda: backend.append_archive(self.channel_id, entries)
+
+class _UnreadLogOp(WriteOp):
+    """
+    1チャンネル分の未読ログへの書き込み (追記 entries と、cursor までのコミット)。
+    連続した操作は1回に合体し、コミット済みになったメッセージはそもそも書き込まない。
+    """
+    def __init__(self, channel_id: str, entries: list, cursor: int = 0):
+        self.channel_id = channel_id
+        self.entries = entries
+        self.cursor = cursor
+
+    def merge(self, newer):
+        if isinstance(newer, _UnreadLogOp):
+            cursor = max(self.cursor, newer.cursor)
+            entries = [e for e in self.entries + newer.entries if e['offset'] > cursor]
+            return _UnreadLogOp(self.channel_id, entries, cursor)
+        return newer
+
+    def prepare(self):
+        entries = [dict(entry) for entry in self.entries]
+        cursor = self.cursor
+        backend = _backend
+        def write():
+            if cursor:
+                backend.commit_unread(self.channel_id, cursor)
+            if entries:
+                backend.append_unread(self.channel_id, entries)
+        return write
+
+class _UnreadResetOp(WriteOp):
+    """全チャンネルの未読メッセージを削除する"""
+    barrier = True
+
+    def prepare(self):
+        return _backend.reset_unread
+
+class _MemoryUpsertOp(WriteOp):
+    """記憶1件を書き込む"""
+    def __init__(self, record: dict):
+        self.record = record
+
+    def prepare(self):
+        record = dict(self.record)
+        backend = _backend
+        return lambda: backend.upsert_memory(record)
+
+class _MemoryTouchOp(WriteOp):
+    """記憶の最終使用時刻をまとめて更新する。連続した更新は1回の書き込みに合体する。"""
+    def __init__(self, last_used: dict):
+        self.last_used = last_used
+
+    def merge(self, newer):
+        if isinstance(newer, _MemoryTouchOp):
+            return _MemoryTouchOp({**self.last_used, **newer.last_used})
+        return newer
+
+    def prepare(self):
+        last_used = dict(self.last_used)
+        backend = _backend
+        return lambda: backend.touch_memories(last_used)
+
+class _MemoryDeleteOp(WriteOp):
+    """記憶1件を削除する"""
+    def __init__(self, memory_id: int):
+        self.memory_id = memory_id
+
+    def prepare(self):
+        backend = _backend
+        return lambda: backend.delete_memory(self.memory_id)
+
+class _MemoryResetOp(WriteOp):
+    """全ての記憶を削除する"""
+    barrier = True
+
+    def prepare(self):
+        return _backend.reset_memories
+
+_write_queue = None
+
+def _get_write_queue() -> WriteBehindQueue:
+    # config_manager との循環importを避けるため、初回使用時に生成する
+    global _write_queue
+    if _write_queue is None:
+        _write_queue = WriteBehindQueue(
+            window=config.PERSIST_DEBOUNCE_SECONDS,
+            max_delay=config.PERSIST_MAX_DELAY_SECONDS,
+            max_in_flight=config.PERSIST_MAX_IN_FLIGHT,
+            executor=_get_executor()
+        )
+    return _write_queue
 
 def save_data(key: str, data: dict | list):
     """
-    指定されたキーのデータを、バックグラウンドでDBに保存する（待機しない）
+    指定されたキーのデータを保存対象としてマークする（待機しない）。
+    実際の書き込みはデバウンス窓の後にまとめて行われ、同じキーへの連続した保存は1回に合体される。
     """
-    if _db is None:
+    if _backend is None:
         return False
 
-    collection_name = COLLECTION_MAP.get(key)
-    if collection_name:
-        # データのコピーを作成してスレッドに渡す（スレッド実行中に元のデータが変更されるのを防ぐため）
-        # データ量が巨大な場合は deepcopy はコストになるが、テキストベースなら許容範囲
-        try:
-            # メモリキャッシュと同期をとるために念のためコピー
-            # ※ data自体が _data_cache[key] への参照であることが多いため
-            data_copy = copy.deepcopy(data)
-            
-            # スレッドを作成してスタート（処理を待たずに即returnする）
-            t = threading.Thread(target=_save_worker, args=(collection_name, data_copy))
-            t.start()
-            return True
-        except Exception as e:
-            log_error("DB_MANAGER", f"保存スレッド作成エラー: {e}")
-            return False
+    if key == 'history':
+        # 履歴は全チャンネル分をチャンネル別に書き込む
+        for channel_id in data:
+            _get_write_queue().mark(('history', channel_id), _HistoryReplaceOp(channel_id))
+        return True
+
+    if key == 'memory':
+        # 記憶は1件ずつ書き込む
+        for record in data.values():
+            _get_write_queue().mark(('memory', record['id']), _MemoryUpsertOp(record))
+        return True
+
+    if key in ('archive', 'unread'):
+        # 保管庫と未読メッセージは追記のみで、追記・コミットのたびに1件単位で書き込み済み
+        return True
+
+    if key in DATA_KEYS:
+        _get_write_queue().mark(key, _SnapshotOp(key, data))
+        return True
     
     return False
 
 def get_data(key: str):
     return _data_cache.get(key)
 
+def save_channel_history(channel_id: int | str):
+    """指定チャンネルの履歴だけを丸ごと書き込む（初期化・ペルソナ適用時用）"""
+    if _backend is None:
+        return False
+    str_channel_id = str(channel_id)
+    _get_write_queue().mark(('history', str_channel_id), _HistoryReplaceOp(str_channel_id))
+    return True
+
+def append_channel_history(channel_id: int | str, entries: list):
+    """
+    指定チャンネルの履歴に entries を追記する。
+    書き込み量は全履歴ではなく追加分のみに比例する。
+    """
+    if _backend is None:
+        return False
+    str_channel_id = str(channel_id)
+    _get_write_queue().mark(('history', str_channel_id), _HistoryAppendOp(str_channel_id, list(entries)))
+    return True
+
+def save_history_summary(channel_id: int | str):
+    """指定チャンネルの履歴の要約を書き込む"""
+    if _backend is None:
+        return False
+    str_channel_id = str(channel_id)
+    _get_write_queue().mark(('history_summary', str_channel_id), _HistorySummaryOp(str_channel_id))
+    return True
+
+def append_archive(channel_id: int | str, entries: list):
+    """指定チャンネルの保管庫に entries (履歴から外れたターン) を追記する"""
+    if _backend is None or not entries:
+        return False
+    str_channel_id = str(channel_id)
+    _get_write_queue().mark(('archive', str_channel_id), _ArchiveAppendOp(str_channel_id, list(entries)))
+    return True
+
+def append_unread(channel_id: int | str, entry: dict):
+    """指定チャンネルの未読ログにメッセージ1件 (オフセット付き) を追記する。書き込み量は未読の件数によらない。"""
+    if _backend is None:
+        return False
+    str_channel_id = str(channel_id)
+    _get_write_queue().mark(('unread', str_channel_id), _UnreadLogOp(str_channel_id, [entry]))
+    return True
+
+def commit_unread(channel_id: int | str, cursor: int):
+    """指定チャンネルの未読ログを、オフセット cursor まで処理済みにする"""
+    if _backend is None:
+        return False
+    str_channel_id = str(channel_id)
+    _get_write_queue().mark(('unread', str_channel_id), _UnreadLogOp(str_channel_id, [], cursor))
+    return True
+
+def reset_unread():
+    """全チャンネルの未読メッセージを削除する"""
+    _data_cache.get('unread', {}).clear()
+    if _backend is None:
+        return False
+    # 保留中のチャンネル別書き込みは不要になるので破棄してから全削除する
+    _get_write_queue().discard(lambda key: isinstance(key, tuple) and key[0] == 'unread')
+    _get_write_queue().mark('unread_reset', _UnreadResetOp())
+    return True
+
+def save_memory(record: dict):
+    """記憶1件を書き込む (追加・更新)。書き込み量は全体の件数によらない。"""
+    if _backend is None:
+        return False
+    _get_write_queue().mark(('memory', record['id']), _MemoryUpsertOp(record))
+    return True
+
+def touch_memories(records: list):
+    """記憶の最終使用時刻をまとめて書き込む。何件あっても1回の書き込みになる。"""
+    if _backend is None or not records:
+        return False
+    _get_write_queue().mark('memory_touch', _MemoryTouchOp({r['id']: r['last_used_at'] for r in records}))
+    return True
+
+def delete_memory(memory_id: int):
+    """記憶1件を削除する"""
+    if _backend is None:
+        return False
+    _get_write_queue().mark(('memory', memory_id), _MemoryDeleteOp(memory_id))
+    return True
+
+def reset_memories():
+    """全ての記憶を削除する"""
+    _data_cache.get('memory', {}).clear()
+    if _backend is None:
+        return False
+    # 保留中の1件ごとの書き込みは不要になるので破棄してから全削除する
+    _get_write_queue().discard(lambda key: key == 'memory_touch' or (isinstance(key, tuple) and key[0] == 'memory'))
+    _get_write_queue().mark('memory_reset', _MemoryResetOp())
+    return True
+
+async def flush_pending():
+    """保留中の書き込みを全て実行し、完了まで待つ"""
+    await _get_write_queue().flush()
+
+def get_persistence_stats() -> dict:
+    """永続化キューの深さとフラッシュ所要時間を返す"""
+    return _get_write_queue().stats()
+
 # --- 互換関数 ---
 
 def initialize_histories():
@@ -120,34 +439,46 @@ def initialize_histories():
 
 def reset_histories():
     _data_cache['history'] = {}
-    save_data('history', {})
+    _data_cache['archive'] = {}
+    if _backend is not None:
+        # 保留中のチャンネル別書き込みは不要になるので破棄してから全削除する (保管庫も合わせて削除される)
+        _get_write_queue().discard(lambda key: isinstance(key, tuple) and key[0] in ('history', 'history_summary', 'archive'))
+        _get_write_queue().mark('history_reset', _HistoryResetOp())
     log_system("履歴をリセットし、DBに保存しました。")
 
-def get_history_for_channel(channel_id: int):
-    return _data_cache.get('history', {}).get(str(channel_id))
+def get_history_for_channel(channel_id: int) -> list | None:
+    history = _data_cache.get('history', {}).get(str(channel_id))
+    return history.to_list() if history is not None else None
 
 def apply_persona_to_channel(channel_id: int):
-    from utils.ai_request_handler import _load_persona
-    persona = _load_persona()
-    if persona:
-        str_channel_id = str(channel_id)
-        _data_cache.setdefault('history', {})[str_channel_id] = [{"role": "user", "parts": [persona]}]
-        save_data('history', _data_cache['history'])
-        log_system(f"CH[{channel_id}] の履歴にペルソナを適用し、DBに保存しました。")
+    # ペルソナは送信時にシステム指示として付くため、ここではチャンネルの会話 (ターンと要約) だけを初期化する
+    str_channel_id = str(channel_id)
+    _data_cache.setdefault('history', {})[str_channel_id] = HistoryWindow()
+    save_channel_history(str_channel_id)
+    save_history_summary(str_channel_id)
+    log_system(f"CH[{channel_id}] の履歴を初期化し、DBに保存しました。")
 
 def load_persona():
     from utils.ai_request_handler import _load_persona
     return _load_persona()
 
-def save_all_data():
-    # シャットダウン時はスレッドではなく同期的に保存したほうが安全だが、
-    # 簡易的にsave_dataを呼ぶ（プロセス終了まで少し待つ必要があるかも）
-    if _db is None: return
+async def save_all_data():
+    """全キャッシュデータを保存し、書き込みの完了まで待つ"""
+    if _backend is None: return
 
     log_system("全キャッシュデータをデータベースに保存しています...")
     for key, data in _data_cache.items():
-        # ここではコピーせずメインスレッドで保存してもよいが、
-        # 実装を統一するため save_data を使う
         save_data(key, data)
+    await flush_pending()
     
-    log_success("DB_MANAGER", "全データの保存リクエストを発行しました。")
\ No newline at end of file
+    log_success("DB_MANAGER", "全データをデータベースに保存しました。")
+
+async def shutdown():
+    """シャットダウン時の処理。全データを書き込んでから接続を閉じる。"""
+    global _backend
+    if _backend is None: return
+
+    await save_all_data()
+    await _run_db(_backend.close)
+    _backend = None
+    log_system("データベース接続を閉じました。")
\ No newline at end of file
@@ -0,0 +1,65 @@
+import re
+
+class EmotionLexicon:
+    """
+    感情ごとのキーワード表から、対話による感情の変化量を推定するローカルの推定器 (通信なし)。
+    表は感情データの emotion_lexicon に emotion_map と並べて定義する。
+    { "joy": {"嬉しい": 5, "楽しい": 5}, "sadness": ["悲しい", "寂しい"], ... }
+    値が辞書の場合はキーワードごとの重み (負の重みはその感情を下げる)、リストの場合は全て DEFAULT_WEIGHT として扱う。
+    キーワードでは感情が自然に落ち着く変化を推定できないので、decay() で基準値に少しずつ戻す。
+    全キーワードを1つの正規表現にまとめてあるので、1回の推定は文字列の走査1回で終わる。
+    """
+    DEFAULT_WEIGHT = 3
+    # 相手の発言より、自分 (AI) の応答に現れた感情の方を強く反映する
+    USER_INPUT_WEIGHT = 0.5
+    RESPONSE_WEIGHT = 1.0
+
+    def __init__(self, table: dict, emotion_map: dict = None, max_delta: int = 50, decay_rate: float = 0.0):
+        self.max_delta = max_delta
+        self.decay_rate = decay_rate
+        self._entries = {}  # キーワード -> [(感情名, 重み), ...]
+        for emotion, keywords in (table or {}).items():
+            if emotion_map is not None and emotion not in emotion_map:
+                continue
+            if isinstance(keywords, dict):
+                items = keywords.items()
+            else:
+                items = ((keyword, self.DEFAULT_WEIGHT) for keyword in keywords)
+            for keyword, weight in items:
+                if keyword and isinstance(weight, (int, float)):
+                    self._entries.setdefault(keyword, []).append((emotion, weight))
+
+        # 長いキーワードを優先して照合する (「大好き」が「好き」より先にマッチするように)
+        keywords = sorted(self._entries, key=len, reverse=True)
+        self._pattern = re.compile("|".join(map(re.escape, keywords))) if keywords else None
+
+    def __bool__(self):
+        return self._pattern is not None
+
+    def estimate(self, user_input: str, bot_response: str) -> dict:
+        """対話1件の感情の変化量 {感情名: 変化量} を返す。変化がない感情は含まない。"""
+        if self._pattern is None:
+            return {}
+        scores = {}
+        for text, factor in ((user_input, self.USER_INPUT_WEIGHT), (bot_response, self.RESPONSE_WEIGHT)):
+            if not text:
+                continue
+            for match in self._pattern.finditer(text):
+                for emotion, weight in self._entries[match.group()]:
+                    scores[emotion] = scores.get(emotion, 0.0) + weight * factor
+
+        deltas = {}
+        for emotion, score in scores.items():
+            delta = max(-self.max_delta, min(self.max_delta, round(score)))
+            if delta:
+                deltas[emotion] = delta
+        return deltas
+
+    def decay(self, current: dict, baseline: dict) -> dict:
+        """対話1件ごとに、各感情を基準値との差の decay_rate の割合だけ基準値に近づける変化量を返す"""
+        deltas = {}
+        for emotion, value in current.items():
+            delta = round((baseline.get(emotion, 0) - value) * self.decay_rate)
+            if delta:
+                deltas[emotion] = delta
+        return deltas
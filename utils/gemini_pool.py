@@ -0,0 +1,126 @@
+import hashlib
+import threading
+import google.generativeai as genai
+from google.ai import generativelanguage as glm
+from utils.console_display import log_info, log_warning
+
+# キーごとのクライアントを設定するために差し替える GenerativeModel の非公開属性
+# (google-generativeai 0.8 系で確認。requirements.txt でバージョンを固定している)
+_MODEL_CLIENT_ATTRS = ("_client", "_async_client")
+_MODEL_CACHE_ATTR = "_cached_content"
+
+class GeminiClientPool:
+    """
+    APIキーごとに長寿命のクライアントを持ち、(APIキー, モデル名, システム指示) ごとに GenerativeModel を使い回すプール。
+    genai.configure() のようなプロセス全体の設定を書き換えないため、
+    別々のキーを使う同時リクエストが互いの設定を上書きすることがない。
+    システム指示 (ペルソナ) はモデルの生成時に固定されるため、内容のハッシュもキーに含める。
+    """
+    def __init__(self):
+        self._clients = {}  # APIキー -> (同期クライアント, 非同期クライアント)
+        self._models = {}   # (APIキー, モデル名, システム指示のハッシュ or キャッシュ名) -> GenerativeModel
+        self._cache_clients = {}  # APIキー -> プレフィックスキャッシュ用の非同期クライアント
+        self._lock = threading.Lock()
+        self._private_api_available = True
+
+    def get_model(self, api_key: str, model_name: str, system_instruction: str = None,
+                  cached_content: str = None) -> genai.GenerativeModel:
+        """
+        cached_content (プレフィックスキャッシュ名) を指定した場合、システム指示はキャッシュ側にあるので
+        system_instruction は付けない。
+        """
+        if cached_content:
+            key = (api_key, model_name, cached_content)
+        else:
+            digest = hashlib.sha1(system_instruction.encode('utf-8')).hexdigest() if system_instruction else None
+            key = (api_key, model_name, digest)
+        model = self._models.get(key)
+        if model is not None:
+            return model
+
+        with self._lock:
+            model = self._models.get(key)
+            if model is None:
+                model = self._create_model(api_key, model_name, system_instruction, cached_content)
+                if model is None:
+                    # 非公開属性を使えない場合は、プロセス全体の設定で都度モデルを作る (使い回さない)
+                    return self._create_public_model(api_key, model_name, system_instruction, cached_content)
+                if not cached_content and digest is not None:
+                    # ペルソナが更新された場合、古いシステム指示のモデルは不要になるので破棄する
+                    for stale in [k for k in self._models if k[:2] == key[:2] and k[2] not in (None, digest)
+                                  and not k[2].startswith("cachedContents/")]:
+                        del self._models[stale]
+                self._models[key] = model
+                log_info("CLIENT_POOL", f"モデル '{model_name}' のクライアントを作成しました。(キー: {api_key[:5]}...)")
+        return model
+
+    def _create_model(self, api_key: str, model_name: str, system_instruction: str = None,
+                      cached_content: str = None):
+        """
+        このキー専用のクライアントを使うモデルを作る。
+        ライブラリの更新で差し替える非公開属性がなくなっていた場合は None を返す。
+        """
+        if cached_content:
+            model = genai.GenerativeModel(model_name)
+        else:
+            model = genai.GenerativeModel(model_name, system_instruction=system_instruction)
+
+        # _cached_content は from_cached_content() を通したモデルにしかないため、存在の確認はクライアントだけで行う
+        if not self._private_api_available or not all(hasattr(model, attr) for attr in _MODEL_CLIENT_ATTRS):
+            if self._private_api_available:
+                self._private_api_available = False
+                log_warning("CLIENT_POOL", "GenerativeModel のクライアントを差し替えられません。"
+                                           "genai.configure() で都度キーを設定します (同時リクエストのキーが混ざる場合があります)。")
+            return None
+
+        # モデルが使うクライアントをこのキー専用のものに差し替える
+        for attr, client in zip(_MODEL_CLIENT_ATTRS, self._get_clients(api_key)):
+            setattr(model, attr, client)
+        if cached_content:
+            # from_cached_content() はプロセス全体の設定でキャッシュを取得しに行くため、名前だけを直接設定する
+            setattr(model, _MODEL_CACHE_ATTR, cached_content)
+        return model
+
+    @staticmethod
+    def _create_public_model(api_key: str, model_name: str, system_instruction: str = None,
+                             cached_content: str = None) -> genai.GenerativeModel:
+        """公開APIだけでモデルを作る (プロセス全体のキー設定を書き換える)"""
+        genai.configure(api_key=api_key)
+        if cached_content:
+            return genai.GenerativeModel.from_cached_content(cached_content)
+        return genai.GenerativeModel(model_name, system_instruction=system_instruction)
+
+    def get_cache_client(self, api_key: str):
+        """プレフィックスキャッシュの作成・削除に使う、キー専用の非同期クライアント"""
+        client = self._cache_clients.get(api_key)
+        if client is None:
+            with self._lock:
+                client = self._cache_clients.get(api_key)
+                if client is None:
+                    client = glm.CacheServiceAsyncClient(client_options={"api_key": api_key})
+                    self._cache_clients[api_key] = client
+        return client
+
+    def discard_cached_content(self, cached_content: str):
+        """破棄されたプレフィックスキャッシュを使うモデルを取り除く"""
+        with self._lock:
+            for key in [k for k in self._models if k[2] == cached_content]:
+                del self._models[key]
+
+    def clear(self):
+        """保持しているクライアントとモデルを全て破棄する"""
+        with self._lock:
+            self._models.clear()
+            self._clients.clear()
+            self._cache_clients.clear()
+
+    def _get_clients(self, api_key: str):
+        clients = self._clients.get(api_key)
+        if clients is None:
+            options = {"api_key": api_key}
+            clients = (
+                glm.GenerativeServiceClient(client_options=options),
+                glm.GenerativeServiceAsyncClient(client_options=options),
+            )
+            self._clients[api_key] = clients
+        return clients
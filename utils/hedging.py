@@ -0,0 +1,50 @@
+import math
+from collections import deque
+
+class LatencyTracker:
+    """モデルごとに直近の応答時間を保持し、パーセンタイルを返す"""
+    def __init__(self, window: int = 100):
+        self.window = window
+        self._samples = {}  # モデル名 -> deque[秒]
+
+    def record(self, model_name: str, latency: float):
+        samples = self._samples.get(model_name)
+        if samples is None:
+            samples = self._samples[model_name] = deque(maxlen=self.window)
+        samples.append(latency)
+
+    def percentile(self, model_name: str, q: float, min_samples: int = 1) -> float | None:
+        """q (0.0〜1.0) パーセンタイルの応答時間。サンプルが min_samples 未満なら None。"""
+        samples = self._samples.get(model_name)
+        if not samples or len(samples) < min_samples:
+            return None
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))
+        return ordered[index]
+
+class HedgeStats:
+    """ヘッジリクエストの発火率と、それによって短縮できた時間の計測値"""
+    def __init__(self):
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.latency_saved = 0.0
+
+    def record_request(self):
+        self.requests += 1
+
+    def record_hedge(self):
+        self.hedged += 1
+
+    def record_hedge_win(self, saved_seconds: float):
+        self.hedge_wins += 1
+        self.latency_saved += max(0.0, saved_seconds)
+
+    def summary(self) -> dict:
+        return {
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "hedge_rate": round(self.hedged / self.requests, 3) if self.requests else 0.0,
+            "hedge_wins": self.hedge_wins,
+            "latency_saved_s": round(self.latency_saved, 1),
+        }
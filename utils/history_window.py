@@ -0,0 +1,104 @@
+from collections import deque
+from utils.token_estimator import estimate_message_tokens
+
+# 要約ターンの見出し (履歴の先頭に user ターンとして挿入する)
+SUMMARY_HEADER = "# これまでの会話の要約\n"
+# 要約の直後に置く model ターン (user / model が交互になるようにする)
+SUMMARY_ACK = "了解しました。要約を踏まえて会話を続けます。"
+
+class HistoryWindow:
+    """
+    1チャンネル分の会話履歴。
+    ターンを deque で持つことで古いターンの削除を O(1) で行う。
+    各ターンの推定トークン数も保持し、合計を常に把握している。
+    リストと同じように len() / 反復 / 添字アクセス ([0] や [-1]) ができる。
+    削除された古いターンは要約 (summary) として保持でき、送信時は先頭に user ターン (と model の応答) として入る。
+    APIは user ターンから始まる履歴を求めるので、削除や切り出しの後の窓は常に user ターンから始まる。
+    反復・添字アクセスの対象は保存されるターン (turns) だけで、要約は含まない。
+    ペルソナは履歴に含めず、送信時にシステム指示として付ける (ai_request_handler)。
+    """
+    def __init__(self, messages: list = None):
+        self.turns = deque()
+        self._turn_tokens = deque()
+        self.turn_tokens_total = 0
+        self.summary = ""
+        self.summary_tokens = 0
+        for message in messages or []:
+            self.append(message)
+
+    @property
+    def total_tokens(self) -> int:
+        return self.summary_tokens + self.turn_tokens_total
+
+    def set_summary(self, summary: str):
+        self.summary = summary or ""
+        self.summary_tokens = sum(estimate_message_tokens(turn) for turn in self._pinned())
+
+    def _pinned(self) -> list:
+        """送信時に常に先頭に置くターン (要約と、それに続く model の応答)"""
+        if not self.summary:
+            return []
+        return [
+            {"role": "user", "parts": [SUMMARY_HEADER + self.summary]},
+            {"role": "model", "parts": [SUMMARY_ACK]},
+        ]
+
+    def append(self, message: dict):
+        tokens = estimate_message_tokens(message)
+        self.turns.append(message)
+        self._turn_tokens.append(tokens)
+        self.turn_tokens_total += tokens
+
+    def evict_oldest(self) -> dict | None:
+        """最も古いターンを1件削除して返す"""
+        if not self.turns:
+            return None
+        self.turn_tokens_total -= self._turn_tokens.popleft()
+        return self.turns.popleft()
+
+    def enforce_budget(self, budget: int, keep_turns: int = 2) -> list:
+        """
+        合計トークン数が budget 以下になるまで、古いターンを削除する。
+        残りが model ターンから始まらないよう、続く model ターンもまとめて削除する。
+        直近の keep_turns 件は予算を超えていても残す。削除したターンを古い順に返す。
+        """
+        evicted = []
+        while self.total_tokens > budget and len(self.turns) > keep_turns:
+            evicted.append(self.evict_oldest())
+            while len(self.turns) > keep_turns and self.turns[0].get("role") != "user":
+                evicted.append(self.evict_oldest())
+        return evicted
+
+    def view(self, budget: int) -> list:
+        """
+        履歴は削除せず、budget に収まる範囲 (要約 + 新しい方からのターン) をリストで返す。
+        予算の小さいモデルに送るときに使う。ターンは user ターンから始まる位置で切り出す。
+        """
+        pinned = self._pinned()
+        start = 0
+        if self.total_tokens > budget:
+            remaining = budget - self.summary_tokens
+            count = 0
+            for tokens in reversed(self._turn_tokens):
+                if remaining - tokens < 0:
+                    break
+                remaining -= tokens
+                count += 1
+            start = len(self.turns) - count
+        while start < len(self.turns) and self.turns[start].get("role") != "user":
+            start += 1
+        return pinned + [self.turns[i] for i in range(start, len(self.turns))]
+
+    def to_list(self) -> list:
+        return list(self)
+
+    def __len__(self):
+        return len(self.turns)
+
+    def __iter__(self):
+        return iter(self.turns)
+
+    def __getitem__(self, index: int | slice):
+        if isinstance(index, slice):
+            return self.to_list()[index]
+        return self.turns[index]
@@ -0,0 +1,235 @@
+import asyncio
+import time
+from utils.console_display import log_info, log_warning
+
+class TokenBucket:
+    """
+    1分あたりの上限 (RPM / TPM) を表すトークンバケット。
+    capacity 分まで貯まり、1分かけて capacity 分だけ回復する。
+    """
+    def __init__(self, capacity: float):
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.rate = self.capacity / 60.0
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated_at = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """amount 分が使えるようになるまでの秒数 (0なら即座に使える)"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float, now: float):
+        self._refill(now)
+        # 実際の使用量が見積もりを超えた場合はマイナス (借り) になり、その分回復が遅れる
+        self.tokens -= amount
+
+    def drain(self, now: float):
+        self._refill(now)
+        self.tokens = min(self.tokens, 0.0)
+
+    def utilization(self, now: float) -> float:
+        self._refill(now)
+        return max(0.0, min(1.0, 1.0 - self.tokens / self.capacity))
+
+class KeyLease:
+    """スケジューラが割り当てたAPIキー。結果は report_* で報告する。"""
+    def __init__(self, index: int, api_key: str, model_name: str, estimated_tokens: int):
+        self.index = index
+        self.api_key = api_key
+        self.model_name = model_name
+        self.estimated_tokens = estimated_tokens
+        self.started_at = time.monotonic()
+
+class _KeyHealth:
+    """1つのキー×モデルの状態 (バケット・遅延・エラー率・クールダウン)"""
+    def __init__(self, rpm: int, tpm: int):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.latency = None       # 直近の応答時間 (EWMA, 秒)
+        self.error_rate = 0.0     # 直近のエラー率 (EWMA)
+        self.cooldown_until = 0.0
+        self.in_flight = 0
+        self.total_requests = 0
+        self.total_errors = 0
+
+class KeyScheduler:
+    """
+    APIキーごとの RPM / TPM をトークンバケットで管理し、
+    余力があるキーの中から最も健全なもの (エラー率・応答時間が低いもの) を選んでリクエストを割り当てる。
+    全てのキーが上限に達している場合だけ、最初に空くキーを待つ。
+    """
+    # 健全性スコアの重み
+    EWMA_ALPHA = 0.3
+    ERROR_WEIGHT = 10.0
+    IN_FLIGHT_WEIGHT = 1.0
+
+    def __init__(self, api_keys: list, rate_limits: dict, default_limits: dict):
+        self.api_keys = list(api_keys)
+        self.rate_limits = rate_limits
+        self.default_limits = default_limits
+        self.preferred_index = 0
+        self._health = {}  # (キー番号, モデル名) -> _KeyHealth
+        self._waiting = {}  # モデル名 -> 空きを待っているリクエスト数
+        self._changed = asyncio.Condition()
+
+    def _get_health(self, index: int, model_name: str) -> _KeyHealth:
+        health = self._health.get((index, model_name))
+        if health is None:
+            limits = self.rate_limits.get(model_name, self.default_limits)
+            health = _KeyHealth(limits['rpm'], limits['tpm'])
+            self._health[(index, model_name)] = health
+        return health
+
+    def _score(self, index: int, health: _KeyHealth) -> float:
+        latency = health.latency if health.latency is not None else 0.0
+        score = latency + health.error_rate * self.ERROR_WEIGHT + health.in_flight * self.IN_FLIGHT_WEIGHT
+        if index == self.preferred_index:
+            score -= 0.01  # 同点なら !key で指定されたキーを優先
+        return score
+
+    async def acquire(self, model_name: str, estimated_tokens: int, exclude=(), max_wait: float = 60.0) -> KeyLease | None:
+        """
+        使用するキーを選んで返す。exclude に含まれるキー番号は (他に候補がある限り) 使わない。
+        全てのキーが上限に達している場合は最大 max_wait 秒待ち、それでも空かなければ None を返す。
+        """
+        if not self.api_keys:
+            return None
+
+        deadline = time.monotonic() + max_wait
+        candidates = [i for i in range(len(self.api_keys)) if i not in exclude] or list(range(len(self.api_keys)))
+
+        while True:
+            now = time.monotonic()
+            best_index = None
+            best_score = None
+            shortest_wait = None
+            for index in candidates:
+                health = self._get_health(index, model_name)
+                wait = max(
+                    health.cooldown_until - now,
+                    health.requests.wait_time(1, now),
+                    health.tokens.wait_time(estimated_tokens, now),
+                    0.0
+                )
+                if wait > 0:
+                    shortest_wait = wait if shortest_wait is None else min(shortest_wait, wait)
+                    continue
+                score = self._score(index, health)
+                if best_score is None or score < best_score:
+                    best_index, best_score = index, score
+
+            if best_index is not None:
+                health = self._get_health(best_index, model_name)
+                health.requests.consume(1, now)
+                health.tokens.consume(estimated_tokens, now)
+                health.in_flight += 1
+                health.total_requests += 1
+                return KeyLease(best_index, self.api_keys[best_index], model_name, estimated_tokens)
+
+            remaining = deadline - now
+            if remaining <= 0:
+                return None
+            wait = min(shortest_wait, remaining)
+            log_warning("KEY_SCHEDULER", f"全てのAPIキーが上限に達しています。{wait:.1f}秒後に再確認します。(モデル: {model_name})")
+            # 他のリクエストの完了でキーが空くこともあるので、通知があれば早めに再確認する
+            self._waiting[model_name] = self._waiting.get(model_name, 0) + 1
+            try:
+                async with self._changed:
+                    try:
+                        await asyncio.wait_for(self._changed.wait(), timeout=wait)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                self._waiting[model_name] -= 1
+
+    def report_success(self, lease: KeyLease, used_tokens: int = None):
+        now = time.monotonic()
+        health = self._get_health(lease.index, lease.model_name)
+        health.in_flight = max(0, health.in_flight - 1)
+        latency = now - lease.started_at
+        health.latency = latency if health.latency is None else health.latency + self.EWMA_ALPHA * (latency - health.latency)
+        health.error_rate *= (1 - self.EWMA_ALPHA)
+        if used_tokens is not None:
+            # 見積もりとの差分だけバケットを補正する
+            health.tokens.consume(used_tokens - lease.estimated_tokens, now)
+        self._notify()
+
+    def report_rate_limited(self, lease: KeyLease, retry_after: float):
+        now = time.monotonic()
+        health = self._get_health(lease.index, lease.model_name)
+        health.in_flight = max(0, health.in_flight - 1)
+        health.cooldown_until = max(health.cooldown_until, now + retry_after)
+        health.requests.drain(now)
+        self._record_error(health)
+        log_info("KEY_SCHEDULER", f"APIキー {lease.index + 1} を {retry_after:.1f}秒間休ませます。(モデル: {lease.model_name})")
+        self._notify()
+
+    def report_error(self, lease: KeyLease):
+        health = self._get_health(lease.index, lease.model_name)
+        health.in_flight = max(0, health.in_flight - 1)
+        self._record_error(health)
+        self._notify()
+
+    def release(self, lease: KeyLease):
+        """結果を評価せずにキーを返却する (キャンセル時など)"""
+        health = self._get_health(lease.index, lease.model_name)
+        health.in_flight = max(0, health.in_flight - 1)
+        self._notify()
+
+    def _record_error(self, health: _KeyHealth):
+        health.total_errors += 1
+        health.error_rate += self.EWMA_ALPHA * (1.0 - health.error_rate)
+
+    def _notify(self):
+        async def notify():
+            async with self._changed:
+                self._changed.notify_all()
+        try:
+            asyncio.get_running_loop().create_task(notify())
+        except RuntimeError:
+            pass
+
+    def pressure(self, model_name: str) -> float:
+        """
+        モデルのレート上限への逼迫度 (0.0〜1.0)。
+        最も余裕のあるキーの使用率 (RPM / TPM の大きい方) で、休止中のキーは 1.0 とみなす。
+        空きを待っているリクエストがある場合は 1.0 を返す。
+        """
+        if self._waiting.get(model_name) or not self.api_keys:
+            return 1.0
+        now = time.monotonic()
+        pressure = 1.0
+        for index in range(len(self.api_keys)):
+            health = self._get_health(index, model_name)
+            if health.cooldown_until > now:
+                continue
+            used = max(health.requests.utilization(now), health.tokens.utilization(now))
+            pressure = min(pressure, used)
+        return pressure
+
+    def utilization(self) -> list:
+        """キー×モデルごとの使用率と健全性を返す"""
+        now = time.monotonic()
+        report = []
+        for (index, model_name), health in sorted(self._health.items()):
+            report.append({
+                "key": index + 1,
+                "model": model_name,
+                "rpm_used": round(health.requests.utilization(now) * 100),
+                "tpm_used": round(health.tokens.utilization(now) * 100),
+                "latency_ms": round(health.latency * 1000) if health.latency is not None else None,
+                "error_rate": round(health.error_rate, 2),
+                "cooldown": round(max(0.0, health.cooldown_until - now), 1),
+                "requests": health.total_requests,
+                "errors": health.total_errors,
+            })
+        return report
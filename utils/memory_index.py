@@ -0,0 +1,133 @@
+import math
+import re
+
+# 英数字は単語単位、それ以外 (日本語など) は文字の2-gramに分割する
+_WORD_PATTERN = re.compile(r"[0-9a-z]+|[^\s0-9a-z!-/:-@\[-`{-~、。！？「」『』（）・…]+")
+
+def tokenize(text: str) -> list:
+    """検索用にテキストを語に分割する (英数字は単語、日本語は文字の2-gram)"""
+    tokens = []
+    for chunk in _WORD_PATTERN.findall(text.lower()):
+        if chunk.isascii():
+            tokens.append(chunk)
+        elif len(chunk) == 1:
+            tokens.append(chunk)
+        else:
+            tokens.extend(chunk[i:i + 2] for i in range(len(chunk) - 1))
+    return tokens
+
+class MemoryIndex:
+    """
+    記憶を検索するためのローカルな BM25 インデックス。
+    追加・削除はその記憶の語だけを更新するので、件数が増えても1件あたりの更新コストは変わらない。
+    embed_fn (テキスト -> ベクトル) を渡すと、BM25 のスコアとベクトルのコサイン類似度を組み合わせて順位付けする。
+    """
+    K1 = 1.5
+    B = 0.75
+
+    def __init__(self, embed_fn=None, embedding_weight: float = 0.5):
+        self.embed_fn = embed_fn
+        self.embedding_weight = embedding_weight
+        self._postings = {}    # 語 -> {記憶ID: 出現回数}
+        self._doc_terms = {}   # 記憶ID -> {語: 出現回数}
+        self._doc_lengths = {} # 記憶ID -> 語数
+        self._embeddings = {}  # 記憶ID -> ベクトル
+        self._total_length = 0
+
+    def __len__(self):
+        return len(self._doc_terms)
+
+    def add(self, doc_id, text: str):
+        if doc_id in self._doc_terms:
+            self.remove(doc_id)
+        terms = {}
+        for token in tokenize(text):
+            terms[token] = terms.get(token, 0) + 1
+        for token, count in terms.items():
+            self._postings.setdefault(token, {})[doc_id] = count
+        self._doc_terms[doc_id] = terms
+        length = sum(terms.values())
+        self._doc_lengths[doc_id] = length
+        self._total_length += length
+        if self.embed_fn is not None:
+            self._embeddings[doc_id] = self.embed_fn(text)
+
+    def remove(self, doc_id):
+        terms = self._doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        for token in terms:
+            postings = self._postings.get(token)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[token]
+        self._total_length -= self._doc_lengths.pop(doc_id, 0)
+        self._embeddings.pop(doc_id, None)
+
+    def clear(self):
+        self._postings.clear()
+        self._doc_terms.clear()
+        self._doc_lengths.clear()
+        self._embeddings.clear()
+        self._total_length = 0
+
+    def search(self, query: str, k: int = None) -> list:
+        """query との関連度が高い順に [(記憶ID, スコア), ...] を返す (関連度0の記憶は含まない)"""
+        scores = self._bm25(query)
+        if self.embed_fn is not None and self._embeddings:
+            scores = self._blend_embeddings(query, scores)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return ranked[:k] if k is not None else ranked
+
+    def _bm25(self, query: str) -> dict:
+        doc_count = len(self._doc_terms)
+        if not doc_count:
+            return {}
+        avg_length = self._total_length / doc_count or 1.0
+        scores = {}
+        for token in set(tokenize(query)):
+            postings = self._postings.get(token)
+            if not postings:
+                continue
+            df = len(postings)
+            idf = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+            for doc_id, tf in postings.items():
+                norm = self.K1 * (1 - self.B + self.B * self._doc_lengths[doc_id] / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.K1 + 1) / (tf + norm)
+        return scores
+
+    def _blend_embeddings(self, query: str, bm25_scores: dict) -> dict:
+        query_vector = self.embed_fn(query)
+        top = max(bm25_scores.values(), default=0.0) or 1.0
+        blended = {}
+        for doc_id, vector in self._embeddings.items():
+            similarity = _cosine(query_vector, vector)
+            score = (1 - self.embedding_weight) * bm25_scores.get(doc_id, 0.0) / top + self.embedding_weight * similarity
+            if score > 0:
+                blended[doc_id] = score
+        return blended
+
+def _cosine(a, b) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+def jaccard(a: str, b: str) -> float:
+    """2つのテキストの語 (文字2-gram) の集合の Jaccard 係数"""
+    set_a, set_b = set(tokenize(a)), set(tokenize(b))
+    if not set_a or not set_b:
+        return 0.0
+    return len(set_a & set_b) / len(set_a | set_b)
+
+def mutual_containment(a: str, b: str) -> float:
+    """2つのテキストの語 (文字2-gram) が互いにどれだけ含まれているか (両方向の包含率の小さい方, 0.0〜1.0)"""
+    set_a, set_b = set(tokenize(a)), set(tokenize(b))
+    if not set_a or not set_b:
+        return 0.0
+    return len(set_a & set_b) / max(len(set_a), len(set_b))
+
+def differing_numbers(a: str, b: str) -> bool:
+    """片方のテキストにしかない数字の語があるかどうか (日付や数量が違えば別の事実とみなす)"""
+    set_a, set_b = set(tokenize(a)), set(tokenize(b))
+    return any(any(c.isdigit() for c in token) for token in set_a ^ set_b)
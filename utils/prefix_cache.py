@@ -0,0 +1,218 @@
+import asyncio
+import datetime
+import hashlib
+import time
+from utils.console_display import log_info, log_success, log_warning
+from utils.token_estimator import estimate_tokens
+
+class CachedPrefix:
+    """
+    登録済みの静的プレフィックス (システム指示) への参照。
+    remote が True の場合、リクエストでは指示本文の代わりに name (キャッシュ名) を送る。
+    """
+    def __init__(self, name: str, digest: str, tokens: int, expires_at: float, remote: bool = True):
+        self.name = name
+        self.digest = digest
+        self.tokens = tokens
+        self.expires_at = expires_at
+        self.remote = remote
+
+class PrefixCache:
+    """
+    ペルソナなどの静的なシステム指示を (APIキー, モデル) ごとに一度だけ登録しておくキャッシュのインターフェース。
+    acquire() は登録済みのプレフィックスを返し、無ければ登録する。キャッシュできない場合は None を返すので、
+    呼び出し側は通常どおり指示本文を付けて送信する。
+    ヒット率・節約トークン数の計測と、期限・失敗の管理はこのクラスが行い、
+    サブクラスは _create() / _delete() だけを実装する。
+    """
+    name = "base"
+
+    def __init__(self, ttl: float, refresh_margin: float, min_tokens: int, retry_seconds: float):
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.min_tokens = min_tokens
+        self.retry_seconds = retry_seconds
+
+        self._entries = {}   # (APIキー, モデル名, 指示のハッシュ) -> CachedPrefix
+        self._creating = {}  # 同上 -> 作成中のタスク
+        self._failed = {}    # (モデル名, 指示のハッシュ) -> 再試行できる時刻
+        self.on_evict = None  # 破棄したプレフィックスを受け取るコールバック (クライアントプールの掃除用)
+
+        # 計測値
+        self.lookups = 0
+        self.hits = 0
+        self.created = 0
+        self.bypassed = 0
+        self.tokens_saved = 0
+
+    async def acquire(self, api_key: str, model_name: str, instruction: str) -> CachedPrefix | None:
+        if not instruction:
+            return None
+        self.lookups += 1
+        digest = hashlib.sha1(instruction.encode('utf-8')).hexdigest()
+        key = (api_key, model_name, digest)
+        now = time.time()
+
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at - self.refresh_margin > now:
+            self.hits += 1
+            return entry
+
+        if self._failed.get((model_name, digest), 0) > now:
+            self.bypassed += 1
+            return None
+        tokens = estimate_tokens(instruction)
+        if tokens < self.min_tokens:
+            self._failed[(model_name, digest)] = now + self.retry_seconds
+            log_info("PREFIX_CACHE", f"指示が短いため (推定 {tokens} トークン) モデル '{model_name}' ではキャッシュせずに送信します。")
+            self.bypassed += 1
+            return None
+
+        # 同じプレフィックスへの同時リクエストでは、作成を1回にまとめる
+        task = self._creating.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._register(key, instruction, tokens))
+            self._creating[key] = task
+            task.add_done_callback(lambda _: self._creating.pop(key, None))
+        entry = await asyncio.shield(task)
+        if entry is None:
+            self.bypassed += 1
+        return entry
+
+    def record_saved(self, prefix: CachedPrefix, cached_tokens: int = None):
+        """キャッシュを使ったリクエストが成功したときに呼ぶ。応答のキャッシュ済みトークン数があればそれを使う。"""
+        self.tokens_saved += cached_tokens if cached_tokens else prefix.tokens
+
+    def discard(self, prefix: CachedPrefix):
+        """サーバー側で使えなくなったプレフィックスを破棄する (次回のリクエストで作り直される)"""
+        for key in [k for k, e in self._entries.items() if e is prefix]:
+            del self._entries[key]
+        if self.on_evict is not None:
+            self.on_evict(prefix)
+
+    def invalidate(self):
+        """登録済みのプレフィックスを全て破棄する (次回のリクエストで作り直される)"""
+        entries = list(self._entries.values())
+        self._entries.clear()
+        self._failed.clear()
+        for entry in entries:
+            self._evict(entry)
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.name,
+            "entries": len(self._entries),
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / self.lookups, 3) if self.lookups else 0.0,
+            "created": self.created,
+            "bypassed": self.bypassed,
+            "tokens_saved": self.tokens_saved,
+        }
+
+    async def _register(self, key: tuple, instruction: str, tokens: int) -> CachedPrefix | None:
+        api_key, model_name, digest = key
+        try:
+            entry = await self._create(api_key, model_name, instruction, digest, tokens)
+        except Exception as e:
+            self._failed[(model_name, digest)] = time.time() + self.retry_seconds
+            log_warning("PREFIX_CACHE", f"モデル '{model_name}' のプレフィックスキャッシュを作成できませんでした。通常の送信に切り替えます: {e}")
+            return None
+
+        self.created += 1
+        old = self._entries.get(key)
+        self._entries[key] = entry
+        if old is not None:
+            self._evict(old)
+        # 指示が更新された場合、同じキー・モデルの古いプレフィックスは不要になる
+        for stale in [k for k in self._entries if k[:2] == key[:2] and k[2] != digest]:
+            self._evict(self._entries.pop(stale))
+        log_success("PREFIX_CACHE", f"モデル '{model_name}' のプレフィックス (推定 {entry.tokens} トークン) を登録しました。(キー: {api_key[:5]}...)")
+        return entry
+
+    def _evict(self, entry: CachedPrefix):
+        if self.on_evict is not None:
+            self.on_evict(entry)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        loop.create_task(self._delete_quietly(entry))
+
+    async def _delete_quietly(self, entry: CachedPrefix):
+        try:
+            await self._delete(entry)
+        except Exception as e:
+            # 削除に失敗しても期限が来ればサーバー側で消える
+            log_warning("PREFIX_CACHE", f"プレフィックス '{entry.name}' の削除に失敗しました: {e}")
+
+    async def _create(self, api_key: str, model_name: str, instruction: str, digest: str, tokens: int) -> CachedPrefix:
+        raise NotImplementedError
+
+    async def _delete(self, entry: CachedPrefix):
+        raise NotImplementedError
+
+class GeminiPrefixCache(PrefixCache):
+    """Gemini のコンテキストキャッシュ (CachedContent) にシステム指示を登録する実装"""
+    name = "gemini"
+
+    def __init__(self, client_pool, **kwargs):
+        super().__init__(**kwargs)
+        self.client_pool = client_pool
+        self._owners = {}  # キャッシュ名 -> APIキー (キャッシュは作成したキーのプロジェクトにしか存在しない)
+
+    async def _create(self, api_key: str, model_name: str, instruction: str, digest: str, tokens: int) -> CachedPrefix:
+        from google.ai import generativelanguage as glm
+
+        client = self.client_pool.get_cache_client(api_key)
+        cached = await client.create_cached_content(
+            cached_content=glm.CachedContent(
+                model=f"models/{model_name}",
+                display_name=f"prefix-{digest[:12]}",
+                system_instruction=glm.Content(parts=[glm.Part(text=instruction)]),
+                ttl=datetime.timedelta(seconds=self.ttl),
+            )
+        )
+        usage = getattr(cached, 'usage_metadata', None)
+        if usage and usage.total_token_count:
+            tokens = usage.total_token_count
+        self._owners[cached.name] = api_key
+        return CachedPrefix(cached.name, digest, tokens, time.time() + self.ttl)
+
+    async def _delete(self, entry: CachedPrefix):
+        api_key = self._owners.pop(entry.name, None)
+        if api_key is not None:
+            await self.client_pool.get_cache_client(api_key).delete_cached_content(name=entry.name)
+
+class LocalPrefixCache(PrefixCache):
+    """
+    通信しない偽実装。登録・期限・ヒット率の計測だけを行い、リクエストでは指示本文をそのまま送る。
+    キャッシュの効果を見積もる場合や、APIキーなしで動作を確かめる場合に使う。
+    """
+    name = "local"
+
+    async def _create(self, api_key: str, model_name: str, instruction: str, digest: str, tokens: int) -> CachedPrefix:
+        return CachedPrefix(f"local/{model_name}/{digest[:12]}", digest, tokens, time.time() + self.ttl, remote=False)
+
+    async def _delete(self, entry: CachedPrefix):
+        pass
+
+def create_prefix_cache(mode: str, client_pool) -> PrefixCache | None:
+    """
+    設定名からプレフィックスキャッシュを生成する。"off" の場合は None を返す。
+    """
+    import utils.config_manager as config
+
+    options = {
+        "ttl": config.PREFIX_CACHE_TTL_SECONDS,
+        "refresh_margin": config.PREFIX_CACHE_REFRESH_MARGIN_SECONDS,
+        "min_tokens": config.PREFIX_CACHE_MIN_TOKENS,
+        "retry_seconds": config.PREFIX_CACHE_RETRY_SECONDS,
+    }
+    if mode == "gemini":
+        return GeminiPrefixCache(client_pool, **options)
+    if mode == "local":
+        return LocalPrefixCache(**options)
+    if mode == "off":
+        return None
+    raise ValueError(f"不明なプレフィックスキャッシュの設定です: {mode}")
@@ -0,0 +1,44 @@
+import os
+import time
+from utils.console_display import log_info
+
+# ペルソナなどのプロンプト用テキストファイルのキャッシュ
+# { パス: (mtime_ns, サイズ, 内容, 最終確認時刻) }
+_cache = {}
+
+# この秒数以内に確認したファイルは stat もせずにメモリから返す
+CHECK_INTERVAL_SECONDS = 5.0
+
+def read_text(path: str) -> str | None:
+    """
+    テキストファイルをキャッシュ経由で読み込む。
+    ファイルの更新時刻(mtime)とサイズが変わった場合だけ読み直す。
+    ファイルが存在しない場合は None を返す（読み込みエラーは例外として送出）。
+    """
+    now = time.monotonic()
+    entry = _cache.get(path)
+    if entry and now - entry[3] < CHECK_INTERVAL_SECONDS:
+        return entry[2]
+
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        _cache.pop(path, None)
+        return None
+
+    if entry and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+        _cache[path] = (entry[0], entry[1], entry[2], now)
+        return entry[2]
+
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    _cache[path] = (stat.st_mtime_ns, stat.st_size, text, now)
+    log_info("PROMPT_ASSET", f"{path} を読み込みました。")
+    return text
+
+def invalidate(path: str = None):
+    """キャッシュを破棄する。path を省略すると全ファイル分を破棄する。"""
+    if path is None:
+        _cache.clear()
+    else:
+        _cache.pop(path, None)
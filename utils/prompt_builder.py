@@ -1,4 +1,5 @@
 import utils.db_manager as data_manager
+import utils.config_manager as config
 from datetime import datetime, timezone, timedelta
 
 def get_current_time_str():
@@ -9,8 +10,11 @@ def get_current_time_str():
     weekday_jp = weekday_jp_list[now.weekday()]
     return now.strftime(f"%Y年%m月%d日({weekday_jp}) %H時%M分")
 
-def get_bot_status_text(bot) -> str:
-    """Botの現在の感情と記憶から、状況説明テキストを生成します。"""
+def get_bot_status_text(bot, messages: list = None) -> str:
+    """
+    Botの現在の感情と記憶から、状況説明テキストを生成します。
+    記憶は全件ではなく、messages (未読メッセージ) に関連するものをトークン予算の範囲で選んで入れます。
+    """
     emotion_cog = bot.get_cog('EmotionCog')
     memory_cog = bot.get_cog('MemoryCog')
     chat_cog = bot.get_cog('ChatManagerCog')
@@ -26,7 +30,8 @@ def get_bot_status_text(bot) -> str:
     emotions_text = "\n".join(emotion_lines)
 
     # 記憶データを取得
-    memories = memory_cog.memories
+    query = "\n".join(m.get('content', '') for m in messages) if messages else ""
+    memories = memory_cog.select_memories(query)
     memories_text = ""
     if memories:
         memories_list = "\n".join(f"* {m}" for m in memories)
@@ -41,10 +46,52 @@ def get_bot_status_text(bot) -> str:
 {get_current_time_str()}
 """
 
-def build_response_prompt(messages: list, bot_status: str) -> str:
+def build_archive_recall_text(channel_id: int, messages: list) -> str:
+    """
+    履歴から外れた過去の会話のうち、messages (未読メッセージ) に関連するターンを保管庫から選び、
+    プロンプトに差し込むテキストを組み立てます。該当がなければ空文字列を返します。
+    """
+    if not config.ARCHIVE_ENABLED or not messages:
+        return ""
+    archive = (data_manager.get_data('archive') or {}).get(str(channel_id))
+    if not archive:
+        return ""
+
+    query = "\n".join(m.get('content', '') for m in messages)
+    entries = archive.recall(
+        query,
+        top_k=config.ARCHIVE_RECALL_TOP_K,
+        token_budget=config.ARCHIVE_RECALL_TOKEN_BUDGET,
+        min_score=config.ARCHIVE_RECALL_MIN_SCORE,
+        max_chars=config.ARCHIVE_RECALL_MAX_CHARS
+    )
+    if not entries:
+        return ""
+
+    lines = []
+    for entry in entries:
+        speaker = "あなた" if entry['role'] == "model" else "Discord"
+        lines.append(f"[{speaker}]: {entry['text']}")
+    return "# 関連する過去の会話\n（今の会話に関係しそうな、以前のやり取りの抜粋です）\n" + "\n".join(lines)
+
+def format_unread_messages(messages: list, with_timestamp: bool = True) -> str:
+    """
+    未読メッセージを「[送信者 @ 時刻]: 本文」の行にまとめます (履歴の user ターンと感情分析の入力に使います)。
+    with_timestamp が False の場合は「[送信者]: 本文」にします。
+    """
+    lines = []
+    for m in messages:
+        author = m.get('author', 'Unknown')
+        if with_timestamp:
+            author = f"{author} @ {m.get('timestamp', '')}"
+        lines.append(f"[{author}]: {m.get('content', '')}")
+    return "\n".join(lines)
+
+def build_response_prompt(messages: list, bot_status: str, recall_text: str = "") -> str:
     """
     AIに応答を生成させるためのプロンプトを組み立てます。
     未読メッセージの有無で内容を切り替えます。
+    recall_text (関連する過去の会話) があれば、未読メッセージの後に入れます。
     """
     if messages:
         # 1. 未読メッセージがある場合
@@ -56,6 +103,8 @@ def build_response_prompt(messages: list, bot_status: str) -> str:
         instruction = "あなたはDiscordを確認したところ、以下の未読メッセージが溜まっていました。\n相手の「現在の行動」も参考にしながら、これら全ての会話の流れを踏まえて、あなたの次のメッセージを生成してください。"
         
         # ここで return します (conversation_log はここでしか使わない)
+        if recall_text:
+            conversation_log = f"{conversation_log}\n\n{recall_text}"
         return f"{instruction}\n\n{conversation_log}\n\n{bot_status}"
     else:
         # 2. 自発的メッセージを生成させたい場合 (conversation_log は使わない)
@@ -63,16 +112,117 @@ def build_response_prompt(messages: list, bot_status: str) -> str:
         
         return f"{instruction}\n\n{bot_status}"
 
-def build_emotion_analysis_prompt(emotion_map: dict, persona: str, user_input: str, bot_response: str) -> str:
+def build_emotion_analysis_instruction(emotion_map: dict, persona: str) -> str:
     """
-    対話から感情の変化を分析させるためのプロンプトを組み立てます。
+    感情分析の静的な部分 (分析役のペルソナと感情リスト) を組み立てます。
+    システム指示として送るので、感情データが変わらない限り毎回同じ文字列になります。
     """
     emotion_list_str = ", ".join([f"'{name}({ja_name})'" for name, (_, ja_name) in emotion_map.items()])
-    
+
     return (
         f"{persona}\n\n"
-        f"分析可能な感情リスト:\n{emotion_list_str}\n\n"
-        f'分析対象の対話:\n'
-        f'[ユーザー]: "{user_input}"\n'
-        f'[AIの応答]: "{bot_response}"'
-    )
\ No newline at end of file
+        f"分析可能な感情リスト:\n{emotion_list_str}"
+    )
+
+def build_emotion_analysis_prompt(exchanges: list) -> str:
+    """
+    対話から感情の変化を分析させるためのプロンプト (毎回変わる部分) を組み立てます。
+    exchanges は [(ユーザーの発言, AIの応答), ...] の古い順のリストです。
+    複数ある場合は、対話ごとの変化量を順番に並べたJSON配列で返させます。
+    """
+    if len(exchanges) == 1:
+        user_input, bot_response = exchanges[0]
+        return (
+            f'分析対象の対話:\n'
+            f'[ユーザー]: "{user_input}"\n'
+            f'[AIの応答]: "{bot_response}"'
+        )
+
+    blocks = [
+        f'## 対話{i}\n[ユーザー]: "{user_input}"\n[AIの応答]: "{bot_response}"'
+        for i, (user_input, bot_response) in enumerate(exchanges, 1)
+    ]
+    return (
+        f"分析対象の対話 ({len(exchanges)}件、古い順):\n\n" + "\n\n".join(blocks) + "\n\n"
+        f"各対話ごとの変化量のJSONオブジェクトを、対話と同じ順番で並べたJSON配列 ({len(exchanges)}要素) で出力してください。"
+        f"1つのJSONオブジェクトにまとめず、変化のない対話も {{}} として含めてください。"
+    )
+
+def build_reply_with_emotions_instruction(emotion_map: dict) -> str:
+    """
+    応答本文と感情の変化量を1回のリクエストでまとめて返させるための、出力形式の指示を組み立てます。
+    build_response_prompt() の結果の末尾に付けて使います。
+    """
+    emotion_list_str = ", ".join([f"'{name}({ja_name})'" for name, (_, ja_name) in emotion_map.items()])
+
+    return (
+        "\n\n# 出力形式\n"
+        "次の2つのキーを持つJSONオブジェクトだけを出力してください。\n"
+        '- "message": Discordに送信するあなたのメッセージ本文\n'
+        '- "emotion_deltas": このやり取りの結果としての、あなた自身の感情パラメータの変化量。'
+        "感情パラメータ名をキー、-50から+50の範囲の整数を値とし、変化がないパラメータは含めないでください。\n"
+        f"感情パラメータ: {emotion_list_str}"
+    )
+
+def build_reply_with_emotions_schema(emotion_map: dict) -> dict:
+    """
+    build_reply_with_emotions_instruction() の出力形式に対応するレスポンススキーマを返します。
+    """
+    return {
+        "type": "OBJECT",
+        "properties": {
+            "message": {"type": "STRING"},
+            "emotion_deltas": {
+                "type": "OBJECT",
+                "properties": {name: {"type": "INTEGER"} for name in emotion_map},
+            },
+        },
+        "required": ["message"],
+    }
+
+def build_memory_merge_prompt(memories: list) -> str:
+    """
+    内容が重複している記憶を1つの記憶にまとめさせるためのプロンプトを組み立てます。
+    memories は古い順の記憶の文字列のリストです。
+    """
+    memory_lines = "\n".join(f"* {m}" for m in memories)
+    return (
+        "以下はロールプレイキャラクターの「重要な記憶」のうち、内容が重複している項目です。\n"
+        "全ての事実を残したまま、1つの簡潔な記憶 (1〜2文) に統合してください。\n"
+        "内容が食い違う場合は、後に書かれた (新しい) 方を正としてください。\n"
+        "統合した記憶の本文のみを出力してください。\n\n"
+        f"{memory_lines}"
+    )
+
+def build_memory_supersede_prompt(old_memory: str, new_memory: str) -> str:
+    """
+    新しい記憶が古い記憶の事実を置き換えているか (古い記憶が不要になったか) を判定させるためのプロンプトを組み立てます。
+    """
+    return (
+        "以下はロールプレイキャラクターの「重要な記憶」のうち、内容の似た2つの項目です。\n"
+        "新しい記憶が古い記憶と同じ事柄について、その内容を更新・訂正しているかを判定してください。\n"
+        "両方が同時に成り立つ別々の事実 (例: 「猫が好き」と「犬も好き」) の場合は置き換えではありません。\n"
+        "古い記憶が不要になった場合は「はい」、そうでなければ「いいえ」とだけ出力してください。\n\n"
+        f"# 古い記憶\n{old_memory}\n\n"
+        f"# 新しい記憶\n{new_memory}"
+    )
+
+def build_summary_prompt(previous_summary: str, turns: list, max_chars: int) -> str:
+    """
+    履歴から外れた古い会話を、これまでの要約に畳み込ませるためのプロンプトを組み立てます。
+    """
+    lines = []
+    for turn in turns:
+        speaker = "あなた" if turn.get("role") == "model" else "Discord"
+        text = "\n".join(p for p in turn.get("parts", []) if isinstance(p, str))
+        lines.append(f"[{speaker}]: {text}")
+    conversation_log = "\n".join(lines)
+
+    return (
+        "あなたはロールプレイの会話ログを要約する記録係です。\n"
+        "以下の「これまでの要約」に「新しく古くなった会話」の内容を統合し、1つの要約に書き直してください。\n"
+        "登場人物、約束、出来事、相手の好みや感情の変化など、今後の会話で参照されそうな事実を優先して残してください。\n"
+        f"要約は{max_chars}文字以内の箇条書きとし、要約本文のみを出力してください。\n\n"
+        f"# これまでの要約\n{previous_summary or '（なし）'}\n\n"
+        f"# 新しく古くなった会話\n{conversation_log}"
+    )
@@ -0,0 +1,29 @@
+from utils.storage.base import StorageBackend
+
+def create_backend(name: str) -> StorageBackend:
+    """
+    設定名からバックエンドを生成する。
+    - "mongo": MongoDB (従来の構成)
+    - "sqlite": instances/<キャラクター名>/data/ 以下の組み込みSQLite
+    """
+    # config_manager は db_manager を import するため、循環importを避けてここで読み込む
+    import utils.config_manager as config
+
+    if name == "mongo":
+        # pymongo は Mongo を使う場合だけ必要
+        from utils.storage.mongo_backend import MongoBackend
+        return MongoBackend(config.CHARACTER_NAME)
+
+    if name == "sqlite":
+        from utils.storage.sqlite_backend import SQLiteBackend
+        seed_files = {
+            'setting': config.SETTING_FILE,
+            'emotion': config.EMOTION_FILE,
+            'memory': config.MEMORY_FILE,
+            'schedule': config.SCHEDULE_FILE,
+            'unread': config.UNREAD_MESSAGES_FILE,
+            'history': config.HISTORY_FILE,
+        }
+        return SQLiteBackend(config.SQLITE_FILE, seed_files)
+
+    raise ValueError(f"不明なストレージバックエンドです: {name}")
@@ -0,0 +1,122 @@
+# 旧形式の履歴は先頭にペルソナのターンを1件持っていた。
+# ペルソナは送信時にシステム指示として付けるようになったので、移行時に取り除く。
+LEGACY_PERSONA_TURNS = 1
+
+def strip_legacy_persona(messages: list) -> list:
+    """旧形式 (先頭がペルソナの user ターン) の履歴からペルソナを取り除く"""
+    if messages and messages[0].get('role') == 'user':
+        return messages[LEGACY_PERSONA_TURNS:]
+    return messages
+
+def memory_records_from_legacy(texts: list, created_at: str) -> list:
+    """旧形式 (文字列のリスト) の記憶を、1件ずつのレコードに変換する (IDは1から順に振る)"""
+    return [
+        {"id": i, "text": text, "created_at": created_at, "last_used_at": None}
+        for i, text in enumerate(texts, 1) if isinstance(text, str)
+    ]
+
+def unread_entries_from_legacy(messages: list) -> list:
+    """旧形式 (メッセージのリスト) の未読メッセージに、1から順にオフセットを振る"""
+    return [dict(message, offset=i) for i, message in enumerate(messages, 1) if isinstance(message, dict)]
+
+class StorageBackend:
+    """
+    永続化バックエンドのインターフェース。
+    メソッドは全てブロッキングで、db_manager の DB 専用スレッドから呼ばれる。
+    """
+    name = "base"
+
+    def connect(self):
+        """接続・スキーマ準備を行う。失敗した場合は例外を送出する。"""
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+    # --- キー単位のデータ (emotion, setting, schedule) ---
+
+    def load(self, key: str):
+        """保存されているデータを返す。存在しない場合は None を返す。"""
+        raise NotImplementedError
+
+    def init_default(self, key: str, default_data):
+        """データが存在しない場合のみ default_data を書き込む"""
+        raise NotImplementedError
+
+    def save(self, key: str, data):
+        raise NotImplementedError
+
+    # --- チャンネル別の会話履歴 ---
+
+    def load_histories(self) -> dict:
+        """{チャンネルID: [ {role, parts}, ... ]} を返す"""
+        raise NotImplementedError
+
+    def replace_history(self, channel_id: str, messages: list):
+        raise NotImplementedError
+
+    def append_history(self, channel_id: str, entries: list, keep: int):
+        """entries を追記し、末尾 keep 件だけを残す"""
+        raise NotImplementedError
+
+    def load_history_summaries(self) -> dict:
+        """{チャンネルID: 要約テキスト} を返す"""
+        raise NotImplementedError
+
+    def save_history_summary(self, channel_id: str, summary: str):
+        raise NotImplementedError
+
+    def reset_histories(self):
+        """全チャンネルの履歴・要約・過去ログの保管庫を削除する"""
+        raise NotImplementedError
+
+    # --- 履歴から外れたターンの保管庫 (追記のみ) ---
+
+    def load_archives(self) -> dict:
+        """{チャンネルID: [ {seq, role, text, archived_at}, ... ] (seq順)} を返す"""
+        raise NotImplementedError
+
+    def append_archive(self, channel_id: str, entries: list):
+        raise NotImplementedError
+
+    # --- チャンネル別の未読メッセージ (追記専用のログ + 処理済みカーソル) ---
+
+    def load_unread(self) -> dict:
+        """{チャンネルID: [ {offset, author, content, ...}, ... ] (offset順)} を返す"""
+        raise NotImplementedError
+
+    def load_unread_cursors(self) -> dict:
+        """{チャンネルID: 処理済みの最後のオフセット} を返す"""
+        raise NotImplementedError
+
+    def append_unread(self, channel_id: str, entries: list):
+        raise NotImplementedError
+
+    def commit_unread(self, channel_id: str, cursor: int):
+        """オフセットが cursor 以下のメッセージを削除し、カーソルを記録する"""
+        raise NotImplementedError
+
+    def reset_unread(self):
+        """全チャンネルの未読メッセージとカーソルを削除する"""
+        raise NotImplementedError
+
+    # --- 記憶 (1件ずつのレコード) ---
+
+    def load_memories(self) -> list:
+        """[{id, text, created_at, last_used_at}, ...] を id の昇順で返す"""
+        raise NotImplementedError
+
+    def upsert_memory(self, record: dict):
+        """記憶1件を書き込む (同じ id があれば置き換える)"""
+        raise NotImplementedError
+
+    def touch_memories(self, last_used: dict):
+        """{記憶ID: 最終使用時刻} の最終使用時刻だけをまとめて更新する (存在しない記憶は作らない)"""
+        raise NotImplementedError
+
+    def delete_memory(self, memory_id: int):
+        raise NotImplementedError
+
+    def reset_memories(self):
+        """全ての記憶を削除する"""
+        raise NotImplementedError
@@ -0,0 +1,273 @@
+import os
+from datetime import datetime
+import pymongo
+from utils.console_display import log_system, log_success
+from utils.storage.base import StorageBackend, strip_legacy_persona, memory_records_from_legacy, unread_entries_from_legacy
+
+# データキーとMongoDBのコレクション名をマッピング
+COLLECTION_MAP = {
+    'emotion': 'emotion',
+    'setting': 'setting',
+    'memory': 'memory',
+    'schedule': 'schedule',
+    'history': 'history',
+    'unread': 'unread',
+    'unread_cursor': 'unread_cursor',
+    'archive': 'archive'
+}
+
+# 履歴はチャンネルごとに1ドキュメントで保存する
+# { "channel_id": "<チャンネルID>", "messages": [ {role, parts}, ... ], "summary": "<要約>" }
+HISTORY_ID_FIELD = 'channel_id'
+
+# 保管庫は1ターンごとに1ドキュメントで追記する
+# { "channel_id": "<チャンネルID>", "seq": <通し番号>, "role": "user" | "model", "text": "<本文>", "archived_at": "<ISO時刻>" }
+
+# 未読メッセージは1件ごとに1ドキュメントで追記し、処理済みの位置はチャンネルごとのカーソルで記録する
+# unread:        { "channel_id": "<チャンネルID>", "offset": <オフセット>, "author": ..., "content": ..., ... }
+# unread_cursor: { "channel_id": "<チャンネルID>", "committed": <処理済みの最後のオフセット> }
+
+# 記憶は1件ごとに1ドキュメントで保存する
+# { "memory_id": <ID>, "text": "<記憶>", "created_at": "<ISO時刻>", "last_used_at": "<ISO時刻>" | null }
+MEMORY_ID_FIELD = 'memory_id'
+
+class MongoBackend(StorageBackend):
+    """MongoDB (環境変数 MONGODB_URI / DB_NAME) に保存するバックエンド"""
+    name = "mongo"
+
+    def __init__(self, db_name: str):
+        self.db_name = os.getenv("DB_NAME", db_name)
+        self._client = None
+        self._db = None
+
+    def connect(self):
+        uri = os.getenv("MONGODB_URI")
+        if not uri:
+            raise RuntimeError("環境変数 'MONGODB_URI' が設定されていません。")
+
+        client = pymongo.MongoClient(uri)
+        client.admin.command('ping')
+        self._client = client
+        self._db = client[self.db_name]
+
+        history = self._history()
+        history.create_index(HISTORY_ID_FIELD, unique=True, sparse=True)
+        self._migrate_legacy_history(history)
+        self._migrate_persona_head(history)
+
+        self._db[COLLECTION_MAP['archive']].create_index([(HISTORY_ID_FIELD, 1), ("seq", 1)], unique=True)
+
+        unread = self._unread()
+        self._migrate_legacy_unread(unread)
+        unread.create_index([(HISTORY_ID_FIELD, 1), ("offset", 1)], unique=True)
+        self._db[COLLECTION_MAP['unread_cursor']].create_index(HISTORY_ID_FIELD, unique=True)
+
+        memory = self._memory()
+        memory.create_index(MEMORY_ID_FIELD, unique=True, sparse=True)
+        self._migrate_legacy_memory(memory)
+        log_system(f"データベース '{self.db_name}' への接続に成功しました。")
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+        self._client = None
+        self._db = None
+
+    def load(self, key: str):
+        doc = self._db[COLLECTION_MAP[key]].find_one()
+        return doc.get('data', {}) if doc else None
+
+    def init_default(self, key: str, default_data):
+        self._db[COLLECTION_MAP[key]].find_one_and_update(
+            {},
+            {"$setOnInsert": {"data": default_data}},
+            upsert=True
+        )
+
+    def save(self, key: str, data):
+        self._db[COLLECTION_MAP[key]].update_one({}, {"$set": {"data": data}}, upsert=True)
+
+    def load_histories(self) -> dict:
+        histories = {}
+        for doc in self._history().find({HISTORY_ID_FIELD: {"$exists": True}}):
+            histories[doc[HISTORY_ID_FIELD]] = doc.get('messages', [])
+        return histories
+
+    def replace_history(self, channel_id: str, messages: list):
+        self._history().bulk_write([self._history_replace_request(channel_id, messages)])
+
+    def append_history(self, channel_id: str, entries: list, keep: int):
+        self._history().update_one(
+            {HISTORY_ID_FIELD: channel_id},
+            {"$push": {"messages": {"$each": entries, "$slice": -keep}}},
+            upsert=True
+        )
+
+    def load_history_summaries(self) -> dict:
+        return {
+            doc[HISTORY_ID_FIELD]: doc['summary']
+            for doc in self._history().find({"summary": {"$exists": True}}, {HISTORY_ID_FIELD: 1, "summary": 1})
+        }
+
+    def save_history_summary(self, channel_id: str, summary: str):
+        self._history().update_one({HISTORY_ID_FIELD: channel_id}, {"$set": {"summary": summary}}, upsert=True)
+
+    def reset_histories(self):
+        self._history().delete_many({})
+        self._db[COLLECTION_MAP['archive']].delete_many({})
+
+    def load_archives(self) -> dict:
+        archives = {}
+        for doc in self._db[COLLECTION_MAP['archive']].find({}, {"_id": 0}).sort([(HISTORY_ID_FIELD, 1), ("seq", 1)]):
+            archives.setdefault(doc.pop(HISTORY_ID_FIELD), []).append(doc)
+        return archives
+
+    def append_archive(self, channel_id: str, entries: list):
+        if entries:
+            self._db[COLLECTION_MAP['archive']].insert_many(
+                [dict(entry, **{HISTORY_ID_FIELD: channel_id}) for entry in entries], ordered=False
+            )
+
+    def load_unread(self) -> dict:
+        unread = {}
+        for doc in self._unread().find({HISTORY_ID_FIELD: {"$exists": True}}, {"_id": 0}).sort([(HISTORY_ID_FIELD, 1), ("offset", 1)]):
+            unread.setdefault(doc.pop(HISTORY_ID_FIELD), []).append(doc)
+        return unread
+
+    def load_unread_cursors(self) -> dict:
+        return {
+            doc[HISTORY_ID_FIELD]: doc['committed']
+            for doc in self._db[COLLECTION_MAP['unread_cursor']].find({}, {"_id": 0})
+        }
+
+    def append_unread(self, channel_id: str, entries: list):
+        if entries:
+            self._unread().insert_many(
+                [dict(entry, **{HISTORY_ID_FIELD: channel_id}) for entry in entries], ordered=False
+            )
+
+    def commit_unread(self, channel_id: str, cursor: int):
+        self._unread().delete_many({HISTORY_ID_FIELD: channel_id, "offset": {"$lte": cursor}})
+        self._db[COLLECTION_MAP['unread_cursor']].update_one(
+            {HISTORY_ID_FIELD: channel_id}, {"$max": {"committed": cursor}}, upsert=True
+        )
+
+    def reset_unread(self):
+        self._unread().delete_many({})
+        self._db[COLLECTION_MAP['unread_cursor']].delete_many({})
+
+    def _unread(self):
+        return self._db[COLLECTION_MAP['unread']]
+
+    def _migrate_legacy_unread(self, collection):
+        """旧形式の単一未読ドキュメント ({チャンネルID: [メッセージ, ...]}) を1件ごとのドキュメントに分割する"""
+        legacy_doc = collection.find_one({HISTORY_ID_FIELD: {"$exists": False}})
+        if not legacy_doc:
+            return
+
+        legacy_data = legacy_doc.get('data') or {}
+        log_system(f"旧形式の未読ドキュメントを検出しました。{len(legacy_data)}チャンネル分を追記専用のログに移行します。")
+        docs = [
+            dict(entry, **{HISTORY_ID_FIELD: str(channel_id)})
+            for channel_id, messages in legacy_data.items()
+            for entry in unread_entries_from_legacy(messages or [])
+        ]
+        if docs:
+            collection.insert_many(docs, ordered=False)
+        collection.delete_one({"_id": legacy_doc["_id"]})
+        log_success("DB_MANAGER", "未読メッセージの移行が完了しました。")
+
+    def load_memories(self) -> list:
+        return [
+            self._memory_record(doc)
+            for doc in self._memory().find({MEMORY_ID_FIELD: {"$exists": True}}).sort(MEMORY_ID_FIELD, 1)
+        ]
+
+    def upsert_memory(self, record: dict):
+        self._memory().bulk_write([self._memory_upsert_request(record)])
+
+    def touch_memories(self, last_used: dict):
+        if not last_used:
+            return
+        self._memory().bulk_write([
+            pymongo.UpdateOne({MEMORY_ID_FIELD: memory_id}, {"$set": {"last_used_at": used_at}})
+            for memory_id, used_at in last_used.items()
+        ], ordered=False)
+
+    def delete_memory(self, memory_id: int):
+        self._memory().delete_one({MEMORY_ID_FIELD: memory_id})
+
+    def reset_memories(self):
+        self._memory().delete_many({})
+
+    def _memory(self):
+        return self._db[COLLECTION_MAP['memory']]
+
+    @staticmethod
+    def _memory_record(doc: dict) -> dict:
+        return {
+            "id": doc[MEMORY_ID_FIELD],
+            "text": doc.get('text', ""),
+            "created_at": doc.get('created_at'),
+            "last_used_at": doc.get('last_used_at'),
+        }
+
+    @staticmethod
+    def _memory_upsert_request(record: dict) -> pymongo.UpdateOne:
+        return pymongo.UpdateOne(
+            {MEMORY_ID_FIELD: record['id']},
+            {"$set": {
+                "text": record['text'],
+                "created_at": record.get('created_at'),
+                "last_used_at": record.get('last_used_at')
+            }},
+            upsert=True
+        )
+
+    def _migrate_legacy_memory(self, collection):
+        """旧形式の記憶ドキュメント (文字列のリスト) を1件ごとのドキュメントに分割する"""
+        legacy_doc = collection.find_one({MEMORY_ID_FIELD: {"$exists": False}})
+        if not legacy_doc:
+            return
+
+        records = memory_records_from_legacy(legacy_doc.get('data') or [], datetime.now().isoformat(timespec='seconds'))
+        log_system(f"旧形式の記憶ドキュメントを検出しました。{len(records)}件を1件ごとのドキュメントに移行します。")
+        if records:
+            collection.bulk_write([self._memory_upsert_request(r) for r in records], ordered=False)
+        collection.delete_one({"_id": legacy_doc["_id"]})
+        log_success("DB_MANAGER", "記憶の移行が完了しました。")
+
+    def _history(self):
+        return self._db[COLLECTION_MAP['history']]
+
+    @staticmethod
+    def _history_replace_request(channel_id: str, messages: list) -> pymongo.UpdateOne:
+        # 要約など他のフィールドは残したまま、ターンだけを置き換える
+        return pymongo.UpdateOne(
+            {HISTORY_ID_FIELD: channel_id},
+            {"$set": {"messages": messages}},
+            upsert=True
+        )
+
+    def _migrate_legacy_history(self, collection):
+        """旧形式の単一履歴ドキュメントをチャンネル別ドキュメントに分割する"""
+        legacy_doc = collection.find_one({HISTORY_ID_FIELD: {"$exists": False}})
+        if not legacy_doc:
+            return
+
+        legacy_data = legacy_doc.get('data') or {}
+        log_system(f"旧形式の履歴ドキュメントを検出しました。{len(legacy_data)}チャンネル分をチャンネル別ドキュメントに移行します。")
+        requests = [
+            self._history_replace_request(str(channel_id), strip_legacy_persona(messages))
+            for channel_id, messages in legacy_data.items()
+        ]
+        if requests:
+            collection.bulk_write(requests, ordered=False)
+        collection.delete_one({"_id": legacy_doc["_id"]})
+        log_success("DB_MANAGER", "履歴の移行が完了しました。")
+
+    def _migrate_persona_head(self, collection):
+        """チャンネル別ドキュメントに残っているペルソナのコピー (head) を削除する"""
+        result = collection.update_many({"head": {"$exists": True}}, {"$unset": {"head": ""}})
+        if result.modified_count:
+            log_success("DB_MANAGER", f"{result.modified_count}チャンネル分の履歴からペルソナのコピーを削除しました。")
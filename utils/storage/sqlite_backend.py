@@ -0,0 +1,319 @@
+import os
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from utils.console_display import log_system, log_error
+from utils.storage.base import StorageBackend, strip_legacy_persona, memory_records_from_legacy, unread_entries_from_legacy
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv (
+    key  TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS history_messages (
+    channel_id TEXT    NOT NULL,
+    seq        INTEGER NOT NULL,
+    message    TEXT    NOT NULL,
+    PRIMARY KEY (channel_id, seq)
+);
+CREATE TABLE IF NOT EXISTS history_summary (
+    channel_id TEXT PRIMARY KEY,
+    summary    TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS archive (
+    channel_id TEXT    NOT NULL,
+    seq        INTEGER NOT NULL,
+    entry      TEXT    NOT NULL,
+    PRIMARY KEY (channel_id, seq)
+);
+CREATE TABLE IF NOT EXISTS unread_log (
+    channel_id TEXT    NOT NULL,
+    offset     INTEGER NOT NULL,
+    message    TEXT    NOT NULL,
+    PRIMARY KEY (channel_id, offset)
+);
+CREATE TABLE IF NOT EXISTS unread_cursor (
+    channel_id TEXT PRIMARY KEY,
+    committed  INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS memories (
+    id     INTEGER PRIMARY KEY,
+    record TEXT NOT NULL
+);
+-- 初期データの取り込み済みなど、DB自体の状態を記録する
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+-- ペルソナは履歴に保存しなくなったため、旧スキーマのペルソナ用テーブルは削除する
+DROP TABLE IF EXISTS history_head;
+"""
+
+# 初期データの取り込み後にデータが入りうるテーブル (取り込みの印がない古いDBの判定に使う)
+SEEDED_TABLES = ("kv", "history_messages", "history_summary", "archive", "unread_log", "unread_cursor", "memories")
+
+class SQLiteBackend(StorageBackend):
+    """
+    instances/<キャラクター名>/data/ 以下の SQLite ファイルに保存する組み込みバックエンド。
+    WALモードで開くため、書き込み中でも読み込みはブロックされない。
+    DBが空の場合は、同じディレクトリの既存JSONファイル (setting.json など) から初期データを取り込む。
+    """
+    name = "sqlite"
+
+    def __init__(self, db_path: str, seed_files: dict = None):
+        self.db_path = db_path
+        self.seed_files = seed_files or {}
+        self._conn = None
+        # 接続は DB 専用スレッド間で共有するため、書き込みはロックで直列化する
+        self._lock = threading.Lock()
+
+    def connect(self):
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        self._conn = conn
+        log_system(f"SQLiteデータベース '{self.db_path}' を開きました。(WAL)")
+        self._seed_from_json()
+        self._migrate_legacy_memory()
+        self._migrate_legacy_unread()
+
+    def close(self):
+        if self._conn is not None:
+            with self._lock:
+                self._conn.close()
+        self._conn = None
+
+    def load(self, key: str):
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM kv WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def init_default(self, key: str, default_data):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO kv (key, data) VALUES (?, ?)",
+                (key, json.dumps(default_data, ensure_ascii=False))
+            )
+
+    def save(self, key: str, data):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO kv (key, data) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET data = excluded.data",
+                (key, json.dumps(data, ensure_ascii=False))
+            )
+
+    def load_histories(self) -> dict:
+        histories = {}
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT channel_id, message FROM history_messages ORDER BY channel_id, seq"
+            ).fetchall()
+        for channel_id, message in rows:
+            histories.setdefault(channel_id, []).append(json.loads(message))
+        return histories
+
+    def replace_history(self, channel_id: str, messages: list):
+        with self._lock, self._transaction():
+            self._conn.execute("DELETE FROM history_messages WHERE channel_id = ?", (channel_id,))
+            self._write_history(channel_id, messages)
+
+    def append_history(self, channel_id: str, entries: list, keep: int):
+        with self._lock, self._transaction():
+            row = self._conn.execute(
+                "SELECT COALESCE(MAX(seq), 0) FROM history_messages WHERE channel_id = ?", (channel_id,)
+            ).fetchone()
+            last_seq = row[0]
+            self._conn.executemany(
+                "INSERT INTO history_messages (channel_id, seq, message) VALUES (?, ?, ?)",
+                [(channel_id, last_seq + i + 1, json.dumps(e, ensure_ascii=False)) for i, e in enumerate(entries)]
+            )
+            # 末尾 keep 件より古いターンを削除 (主キーの範囲削除なので全体の件数に依存しない)
+            self._conn.execute(
+                "DELETE FROM history_messages WHERE channel_id = ? AND seq <= ?",
+                (channel_id, last_seq + len(entries) - keep)
+            )
+
+    def load_history_summaries(self) -> dict:
+        with self._lock:
+            return dict(self._conn.execute("SELECT channel_id, summary FROM history_summary").fetchall())
+
+    def save_history_summary(self, channel_id: str, summary: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO history_summary (channel_id, summary) VALUES (?, ?) "
+                "ON CONFLICT(channel_id) DO UPDATE SET summary = excluded.summary",
+                (channel_id, summary)
+            )
+
+    def reset_histories(self):
+        with self._lock, self._transaction():
+            self._conn.execute("DELETE FROM history_messages")
+            self._conn.execute("DELETE FROM history_summary")
+            self._conn.execute("DELETE FROM archive")
+
+    def load_archives(self) -> dict:
+        archives = {}
+        with self._lock:
+            rows = self._conn.execute("SELECT channel_id, entry FROM archive ORDER BY channel_id, seq").fetchall()
+        for channel_id, entry in rows:
+            archives.setdefault(channel_id, []).append(json.loads(entry))
+        return archives
+
+    def append_archive(self, channel_id: str, entries: list):
+        with self._lock, self._transaction():
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO archive (channel_id, seq, entry) VALUES (?, ?, ?)",
+                [(channel_id, e['seq'], json.dumps(e, ensure_ascii=False)) for e in entries]
+            )
+
+    def load_unread(self) -> dict:
+        unread = {}
+        with self._lock:
+            rows = self._conn.execute("SELECT channel_id, message FROM unread_log ORDER BY channel_id, offset").fetchall()
+        for channel_id, message in rows:
+            unread.setdefault(channel_id, []).append(json.loads(message))
+        return unread
+
+    def load_unread_cursors(self) -> dict:
+        with self._lock:
+            return dict(self._conn.execute("SELECT channel_id, committed FROM unread_cursor").fetchall())
+
+    def append_unread(self, channel_id: str, entries: list):
+        with self._lock, self._transaction():
+            self._write_unread(channel_id, entries)
+
+    def commit_unread(self, channel_id: str, cursor: int):
+        with self._lock, self._transaction():
+            self._conn.execute("DELETE FROM unread_log WHERE channel_id = ? AND offset <= ?", (channel_id, cursor))
+            self._conn.execute(
+                "INSERT INTO unread_cursor (channel_id, committed) VALUES (?, ?) "
+                "ON CONFLICT(channel_id) DO UPDATE SET committed = MAX(committed, excluded.committed)",
+                (channel_id, cursor)
+            )
+
+    def reset_unread(self):
+        with self._lock, self._transaction():
+            self._conn.execute("DELETE FROM unread_log")
+            self._conn.execute("DELETE FROM unread_cursor")
+
+    def load_memories(self) -> list:
+        with self._lock:
+            rows = self._conn.execute("SELECT record FROM memories ORDER BY id").fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def upsert_memory(self, record: dict):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO memories (id, record) VALUES (?, ?) ON CONFLICT(id) DO UPDATE SET record = excluded.record",
+                (record['id'], json.dumps(record, ensure_ascii=False))
+            )
+
+    def touch_memories(self, last_used: dict):
+        with self._lock, self._transaction():
+            self._conn.executemany(
+                "UPDATE memories SET record = json_set(record, '$.last_used_at', ?) WHERE id = ?",
+                [(used_at, memory_id) for memory_id, used_at in last_used.items()]
+            )
+
+    def delete_memory(self, memory_id: int):
+        with self._lock:
+            self._conn.execute("DELETE FROM memories WHERE id = ?", (memory_id,))
+
+    def reset_memories(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM memories")
+
+    def _migrate_legacy_memory(self):
+        """kv テーブルに残っている旧形式の記憶 (文字列のリスト) を1件ごとのレコードに移す"""
+        legacy = self.load('memory')
+        if legacy is None:
+            return
+        records = memory_records_from_legacy(legacy if isinstance(legacy, list) else [], datetime.now().isoformat(timespec='seconds'))
+        with self._lock, self._transaction():
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO memories (id, record) VALUES (?, ?)",
+                [(r['id'], json.dumps(r, ensure_ascii=False)) for r in records]
+            )
+            self._conn.execute("DELETE FROM kv WHERE key = 'memory'")
+        log_system(f"旧形式の記憶{len(records)}件を1件ごとのレコードに移行しました。")
+
+    def _migrate_legacy_unread(self):
+        """kv テーブルに残っている旧形式の未読メッセージ ({チャンネルID: [メッセージ, ...]}) をログに移す"""
+        legacy = self.load('unread')
+        if legacy is None:
+            return
+        channels = legacy if isinstance(legacy, dict) else {}
+        with self._lock, self._transaction():
+            for channel_id, messages in channels.items():
+                self._write_unread(str(channel_id), unread_entries_from_legacy(messages or []))
+            self._conn.execute("DELETE FROM kv WHERE key = 'unread'")
+        log_system(f"旧形式の未読メッセージ ({len(channels)}チャンネル分) を追記専用のログに移行しました。")
+
+    def _write_unread(self, channel_id: str, entries: list):
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO unread_log (channel_id, offset, message) VALUES (?, ?, ?)",
+            [(channel_id, e['offset'], json.dumps(e, ensure_ascii=False)) for e in entries]
+        )
+
+    def _write_history(self, channel_id: str, messages: list):
+        self._conn.executemany(
+            "INSERT INTO history_messages (channel_id, seq, message) VALUES (?, ?, ?)",
+            [(channel_id, i + 1, json.dumps(m, ensure_ascii=False)) for i, m in enumerate(messages)]
+        )
+
+    def _transaction(self):
+        return _Transaction(self._conn)
+
+    def _seed_from_json(self):
+        """
+        初回の起動時のみ、既存のJSONファイルから初期データを取り込む。
+        取り込み済みかは meta テーブルの印で判断する (記憶や未読は kv 以外のテーブルに移るため、kv が空かどうかでは判断できない)。
+        印がない古いDBは、いずれかのテーブルにデータがあれば取り込み済みとみなす。
+        """
+        with self._lock:
+            seeded = self._conn.execute("SELECT 1 FROM meta WHERE key = 'seeded'").fetchone()
+            has_data = seeded or any(
+                self._conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone() for table in SEEDED_TABLES
+            )
+        if not has_data:
+            self._import_seed_files()
+        if not seeded:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO meta (key, value) VALUES ('seeded', ?)",
+                    (datetime.now().isoformat(timespec='seconds'),)
+                )
+
+    def _import_seed_files(self):
+        for key, path in self.seed_files.items():
+            if not path or not os.path.exists(path):
+                continue
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except Exception as e:
+                log_error("DB_MANAGER", f"初期データ '{path}' の読み込みに失敗しました: {e}")
+                continue
+
+            if key == 'history':
+                for channel_id, messages in data.items():
+                    self.replace_history(str(channel_id), strip_legacy_persona(messages))
+            else:
+                self.save(key, data)
+            log_system(f"'{path}' から '{key}' の初期データを取り込みました。")
+
+class _Transaction:
+    """autocommit 接続上で BEGIN/COMMIT を明示するコンテキストマネージャ"""
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
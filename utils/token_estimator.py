@@ -0,0 +1,19 @@
+def estimate_tokens(text: str) -> int:
+    """
+    APIを呼ばずにトークン数を概算する。
+    英数字などASCII文字は約4文字で1トークン、日本語などの非ASCII文字は約1文字1トークンとして数える。
+    UTF-8のバイト数との差から非ASCII文字数を求めるので、文字ごとのループを回さずに済む。
+    """
+    if not text:
+        return 0
+    length = len(text)
+    byte_length = len(text.encode('utf-8'))
+    # 非ASCII文字は(ほぼ)3バイトなので、増えたバイト数の半分が非ASCII文字数の目安になる
+    non_ascii = min(length, (byte_length - length) // 2)
+    ascii_chars = length - non_ascii
+    return non_ascii + (ascii_chars + 3) // 4
+
+def estimate_message_tokens(message: dict) -> int:
+    """履歴の1ターン ({role, parts}) のトークン数を概算する"""
+    # ロール等のオーバーヘッドとして数トークンを加える
+    return 4 + sum(estimate_tokens(part) for part in message.get("parts", []) if isinstance(part, str))
@@ -0,0 +1,39 @@
+class UnreadLog:
+    """
+    1チャンネル分の未読メッセージの追記専用ログ。
+    各メッセージには単調増加のオフセット (offset) を振り、処理側は「どこまで処理したか」(カーソル) をコミットする。
+    処理中に届いたメッセージはカーソルより後ろに残るので、受信と処理を並行させても取りこぼさない。
+    エントリは {offset, author, content, timestamp, activity}。
+    """
+    def __init__(self, entries: list = None, committed: int = 0):
+        self.committed = committed
+        self.entries = sorted((e for e in entries or [] if e['offset'] > committed), key=lambda e: e['offset'])
+        self.last_offset = max([committed] + [e['offset'] for e in self.entries])
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def append(self, message: dict) -> dict:
+        """メッセージに次のオフセットを振って追記し、追記したエントリを返す"""
+        self.last_offset += 1
+        entry = dict(message, offset=self.last_offset)
+        self.entries.append(entry)
+        return entry
+
+    def snapshot(self) -> list:
+        """現時点の未読メッセージのコピーを返す (処理後は末尾のオフセットを commit() に渡す)"""
+        return list(self.entries)
+
+    def commit(self, cursor: int) -> int:
+        """オフセットが cursor 以下のメッセージを処理済みとして取り除き、取り除いた件数を返す"""
+        if cursor <= self.committed:
+            return 0
+        remaining = [e for e in self.entries if e['offset'] > cursor]
+        removed = len(self.entries) - len(remaining)
+        self.entries = remaining
+        self.committed = cursor
+        self.last_offset = max(self.last_offset, cursor)
+        return removed
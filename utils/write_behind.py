@@ -0,0 +1,174 @@
+import asyncio
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from utils.console_display import log_error, log_info
+
+class WriteOp:
+    """
+    書き込み待ちの操作。同じキーに後から来た操作と merge() でまとめられる。
+    prepare() はイベントループ上で呼ばれ、スナップショットを取ってから
+    ワーカースレッドで実行する関数を返す。
+    """
+    # True の操作はバッチ内で他の操作より先に、単独で実行される (全削除など)
+    barrier = False
+
+    def merge(self, newer: "WriteOp") -> "WriteOp":
+        return newer
+
+    def prepare(self):
+        raise NotImplementedError
+
+class WriteBehindQueue:
+    """
+    ダーティなキーを記録し、デバウンス窓の中で書き込みをまとめて行う永続化ワーカー。
+    - 同じキーへの連続した保存要求は1回の書き込みに合体される
+    - 最後の要求から window 秒静かになるか、最初の要求から max_delay 秒経つとフラッシュ
+    - 同時に実行される書き込みは max_in_flight 件まで
+    """
+    def __init__(self, window: float, max_delay: float, max_in_flight: int, executor: Executor = None):
+        self.window = window
+        self.max_delay = max_delay
+        self.max_in_flight = max(1, max_in_flight)
+
+        self._pending: dict = {}
+        self._first_dirty_at = None
+        self._last_dirty_at = None
+        self._wakeup = None
+        self._flush_now = None
+        self._idle = None
+        self._task = None
+        self._in_flight_limit = None
+        self._executor = executor or ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="db-write")
+
+        # 計測値
+        self._in_flight = 0
+        self._requested = 0
+        self._written = 0
+        self._flushes = 0
+        self._last_flush_ms = 0.0
+        self._avg_flush_ms = 0.0
+        self._max_flush_ms = 0.0
+
+    def mark(self, key, op: WriteOp):
+        """キーをダーティにする。イベントループ外から呼ばれた場合は即座に同期書き込みする。"""
+        self._requested += 1
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._run_sync(key, op)
+            return
+
+        existing = self._pending.get(key)
+        self._pending[key] = existing.merge(op) if existing else op
+
+        now = time.monotonic()
+        if self._first_dirty_at is None:
+            self._first_dirty_at = now
+        self._last_dirty_at = now
+
+        self._ensure_worker(loop)
+        self._idle.clear()
+        self._wakeup.set()
+
+    def discard(self, predicate):
+        """predicate(key) が真になる保留中の操作を破棄する (リセット時など)"""
+        for key in [k for k in self._pending if predicate(k)]:
+            del self._pending[key]
+
+    async def flush(self):
+        """保留中の書き込みを待たずに実行し、完了まで待機する"""
+        if self._task is None:
+            return
+        if self._pending:
+            self._flush_now.set()
+            self._wakeup.set()
+        await self._idle.wait()
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": len(self._pending),
+            "in_flight": self._in_flight,
+            "requested": self._requested,
+            "written": self._written,
+            "flushes": self._flushes,
+            "last_flush_ms": round(self._last_flush_ms, 1),
+            "avg_flush_ms": round(self._avg_flush_ms, 1),
+            "max_flush_ms": round(self._max_flush_ms, 1),
+        }
+
+    def _ensure_worker(self, loop):
+        if self._task is not None and not self._task.done():
+            return
+        self._wakeup = asyncio.Event()
+        self._flush_now = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._in_flight_limit = asyncio.Semaphore(self.max_in_flight)
+        self._task = loop.create_task(self._worker())
+
+    def _run_sync(self, key, op: WriteOp):
+        try:
+            op.prepare()()
+            self._written += 1
+        except Exception as e:
+            log_error("WRITE_BEHIND", f"同期書き込みに失敗しました ({key}): {e}")
+
+    async def _worker(self):
+        while True:
+            self._wakeup.clear()
+            if not self._pending:
+                self._idle.set()
+                await self._wakeup.wait()
+                continue
+
+            # デバウンス: 静かになるか、最大遅延に達するまで待つ
+            while not self._flush_now.is_set():
+                now = time.monotonic()
+                deadline = min(self._last_dirty_at + self.window, self._first_dirty_at + self.max_delay)
+                if now >= deadline:
+                    break
+                try:
+                    await asyncio.wait_for(self._flush_now.wait(), timeout=deadline - now)
+                except asyncio.TimeoutError:
+                    pass
+            self._flush_now.clear()
+
+            batch = self._pending
+            self._pending = {}
+            self._first_dirty_at = None
+            self._last_dirty_at = None
+            if batch:
+                await self._flush_batch(batch)
+
+    async def _flush_batch(self, batch: dict):
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+
+        # スナップショットはイベントループ上で取る (キャッシュの変更と競合させないため)
+        prepared = []
+        for key, op in batch.items():
+            try:
+                prepared.append((key, op.barrier, op.prepare()))
+            except Exception as e:
+                log_error("WRITE_BEHIND", f"書き込み準備に失敗しました ({key}): {e}")
+
+        async def run(key, fn):
+            async with self._in_flight_limit:
+                self._in_flight += 1
+                try:
+                    await loop.run_in_executor(self._executor, fn)
+                    self._written += 1
+                except Exception as e:
+                    log_error("WRITE_BEHIND", f"書き込みに失敗しました ({key}): {e}")
+                finally:
+                    self._in_flight -= 1
+
+        for key, _, fn in [p for p in prepared if p[1]]:
+            await run(key, fn)
+        await asyncio.gather(*(run(key, fn) for key, barrier, fn in prepared if not barrier))
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self._flushes += 1
+        self._last_flush_ms = elapsed_ms
+        self._max_flush_ms = max(self._max_flush_ms, elapsed_ms)
+        self._avg_flush_ms += (elapsed_ms - self._avg_flush_ms) / self._flushes
+        log_info("WRITE_BEHIND", f"{len(prepared)}件の書き込みをフラッシュしました ({elapsed_ms:.0f}ms, 保存要求累計: {self._requested})")